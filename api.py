@@ -0,0 +1,271 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from cache import DEFAULT_CACHE_MAX_BYTES, ResultCache, cache_key
+from http_server import DEFAULT_BODY_TIMEOUT, DEFAULT_KEEP_ALIVE_TIMEOUT, HTTPError, HTTPServer, Request, Response
+from memory import MB
+from metrics import PROMETHEUS_CONTENT_TYPE, Metrics
+from pdf_processing import DEFAULT_TEXT_BACKEND
+from png_output import DEFAULT_PNG_PROFILE
+from pipeline import (
+    DEFAULT_JOB_TIMEOUT,
+    DEFAULT_MAX_JOBS_PER_WORKER,
+    DEFAULT_MAX_WORKER_RSS,
+    DEFAULT_PNG_RENDERER,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_ROWS_PER_PAGE,
+    ConversionResult,
+    PipelineError,
+    PipelineTimeout,
+    ProcessingPool,
+    output_pages,
+)
+from scheduler import DEFAULT_MAX_QUEUE_LENGTH, JobRejected, JobScheduler
+
+DEFAULT_API_HOST = "127.0.0.1"
+DEFAULT_API_PORT = 8080
+# The same limit as for files sent to the bot.
+DEFAULT_MAX_UPLOAD_SIZE = 10 * MB
+DEFAULT_API_DRAIN_TIMEOUT = 30.0
+RESPONSE_FORMATS = ("png", "pdf", "json")
+CONTENT_TYPES = {"png": "image/png", "pdf": "application/pdf", "json": "application/json"}
+# Seconds a client is asked to wait before retrying a request rejected by the scheduler.
+RETRY_AFTER = 5
+API_CLIENT = "api"
+
+T = TypeVar("T")
+
+load_dotenv()
+
+
+def result_to_json(result: ConversionResult) -> bytes:
+    document = {
+        "analysis_name": result.analysis_name,
+        "profile": result.profile,
+        "report_date": result.report_date,
+        "pages": result.pages,
+        "rows": [row._asdict() for row in result.rows],
+    }
+    return json.dumps(document, ensure_ascii=False).encode()
+
+
+class ConversionAPI:
+    """Converts reports over HTTP for programs that do not go through Telegram.
+
+    ``POST /convert`` takes the PDF as the request body and answers with the
+    chart, or with the parsed rows when ``format=json``. Long reports split
+    into pages return one PNG page at a time, chosen with ``page``, and give
+    the number of pages in ``X-Pages``. Conversions share the worker pool,
+    the result cache and the limits of a ``JobScheduler`` with the bot's
+    code paths: a full queue is answered with 503 and ``Retry-After``.
+
+    With a ``token`` every request must send ``Authorization: Bearer <token>``.
+    """
+
+    def __init__(
+        self,
+        pool: ProcessingPool,
+        scheduler: JobScheduler,
+        cache: Optional[ResultCache] = None,
+        metrics: Optional[Metrics] = None,
+        host: str = DEFAULT_API_HOST,
+        port: int = DEFAULT_API_PORT,
+        max_upload_size: int = DEFAULT_MAX_UPLOAD_SIZE,
+        keep_alive_timeout: float = DEFAULT_KEEP_ALIVE_TIMEOUT,
+        token: Optional[str] = None,
+        body_timeout: float = DEFAULT_BODY_TIMEOUT,
+    ) -> None:
+        self.pool = pool
+        self.scheduler = scheduler
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.token = token
+        routes = {
+            ("POST", "/convert"): self.handle_convert,
+            ("GET", "/health"): self.handle_health,
+            ("GET", "/metrics"): self.handle_metrics,
+        }
+        self.server = HTTPServer(routes, host, port, max_upload_size, keep_alive_timeout, body_timeout)
+
+    @property
+    def port(self) -> int:
+        return self.server.port
+
+    async def start(self) -> None:
+        if not self.token:
+            logging.warning("API_TOKEN is not set, anyone who can reach the API can convert files")
+        await self.server.start()
+
+    async def stop(self, drain_timeout: float = DEFAULT_API_DRAIN_TIMEOUT) -> None:
+        await self.server.stop(drain_timeout)
+
+    def _authorize(self, request: Request) -> None:
+        if self.token is None:
+            return
+        received = request.headers.get("authorization", "")
+        if not hmac.compare_digest(received.encode(), f"Bearer {self.token}".encode()):
+            raise HTTPError(401)
+
+    async def _schedule(self, stage: str, job: Callable[[], Awaitable[T]]) -> T:
+        async def timed_job() -> T:
+            with self.metrics.time(stage):
+                return await job()
+
+        return await self.scheduler.run(API_CLIENT, timed_job)
+
+    async def handle_health(self, request: Request) -> Response:
+        return Response(body=b"ok")
+
+    async def handle_metrics(self, request: Request) -> Response:
+        self._authorize(request)
+        return Response(body=self.metrics.render().encode(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    async def handle_convert(self, request: Request) -> Response:
+        self._authorize(request)
+        fmt = request.query.get("format", ["png"])[0]
+        if fmt not in RESPONSE_FORMATS:
+            raise HTTPError(400, f"format must be one of: {', '.join(RESPONSE_FORMATS)}")
+        try:
+            page = int(request.query.get("page", ["1"])[0])
+        except ValueError:
+            raise HTTPError(400, "page must be a number")
+        if not request.body.startswith(b"%PDF"):
+            raise HTTPError(415, "The body must be a PDF file")
+
+        self.metrics.inc("api_requests", format=fmt)
+        try:
+            return await self._convert(request.body, fmt, page)
+        except JobRejected as e:
+            self.metrics.inc("job_failures", kind="api", reason="rejected")
+            return Response(503, str(e).encode(), headers={"Retry-After": str(RETRY_AFTER)})
+        except PipelineError as e:
+            self.metrics.inc("job_failures", kind="api", reason=type(e).__name__)
+            logging.error(f"Processing pipeline failed: {e}")
+            return Response(503 if isinstance(e, PipelineTimeout) else 500, str(e).encode())
+
+    async def _convert(self, content: bytes, fmt: str, page: int) -> Response:
+        key = cache_key(content, self.pool.renderer_version)
+        result = self.cache.get(key) if self.cache is not None else None
+        if result is None:
+            # JSON only needs the rows; charts are rendered in the same worker call.
+            formats = [] if fmt == "json" else [fmt]
+            result = await self._schedule("api_convert", lambda: self.pool.convert_report(content, formats))
+            self.metrics.inc("rows_parsed", len(result.rows))
+            self.metrics.inc("pages_parsed", result.pages)
+        else:
+            self.metrics.inc("result_cache_hits")
+
+        if not result.rows:
+            self.metrics.inc("job_failures", kind="api", reason="no_rows")
+            raise HTTPError(422, "No results found in the report")
+        if fmt == "json":
+            self._cache(key, result)
+            return Response(body=result_to_json(result), content_type=CONTENT_TYPES[fmt])
+
+        if fmt not in result.outputs:
+            outputs = await self._schedule(
+                "api_render", lambda: self.pool.render_report(result.rows, result.analysis_name, [fmt])
+            )
+            result.outputs.update(outputs)
+        self._cache(key, result)
+        pages = output_pages(result.outputs, fmt)
+        if not 1 <= page <= len(pages):
+            raise HTTPError(404, f"The chart has {len(pages)} pages")
+        body = result.outputs[pages[page - 1]]
+        return Response(body=body, content_type=CONTENT_TYPES[fmt], headers={"X-Pages": str(len(pages))})
+
+    def _cache(self, key: str, result: ConversionResult) -> None:
+        if self.cache is not None:
+            self.cache.put(key, result)
+
+
+API_HOST = os.getenv("API_HOST", DEFAULT_API_HOST)
+API_PORT = int(os.getenv("API_PORT", DEFAULT_API_PORT))
+API_TOKEN = os.getenv("API_TOKEN")
+API_MAX_UPLOAD_MB = float(os.getenv("API_MAX_UPLOAD_MB", DEFAULT_MAX_UPLOAD_SIZE / MB))
+API_KEEP_ALIVE_TIMEOUT = float(os.getenv("API_KEEP_ALIVE_TIMEOUT", DEFAULT_KEEP_ALIVE_TIMEOUT))
+API_BODY_TIMEOUT = float(os.getenv("API_BODY_TIMEOUT", DEFAULT_BODY_TIMEOUT))
+API_DRAIN_TIMEOUT = float(os.getenv("API_DRAIN_TIMEOUT", DEFAULT_API_DRAIN_TIMEOUT))
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", DEFAULT_POOL_SIZE))
+WORKER_JOB_TIMEOUT = float(os.getenv("WORKER_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT))
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", DEFAULT_MAX_JOBS_PER_WORKER))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", DEFAULT_MAX_WORKER_RSS // MB))
+WORKER_TRACE_MEMORY = os.getenv("WORKER_TRACE_MEMORY", "0") != "0"
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", DEFAULT_TEXT_BACKEND)
+PNG_RENDERER = os.getenv("PNG_RENDERER", DEFAULT_PNG_RENDERER)
+PNG_PROFILE = os.getenv("PNG_PROFILE", DEFAULT_PNG_PROFILE)
+ROWS_PER_PAGE = int(os.getenv("ROWS_PER_PAGE", DEFAULT_ROWS_PER_PAGE))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", WORKER_POOL_SIZE))
+MAX_QUEUE_LENGTH = int(os.getenv("MAX_QUEUE_LENGTH", DEFAULT_MAX_QUEUE_LENGTH))
+
+
+async def main() -> None:
+    metrics = Metrics()
+    pool = ProcessingPool(
+        size=WORKER_POOL_SIZE,
+        job_timeout=WORKER_JOB_TIMEOUT,
+        text_backend=PDF_TEXT_BACKEND,
+        metrics=metrics,
+        png_renderer=PNG_RENDERER,
+        png_profile=PNG_PROFILE,
+        rows_per_page=ROWS_PER_PAGE,
+        max_jobs_per_worker=WORKER_MAX_JOBS,
+        max_worker_rss=WORKER_MAX_RSS_MB * MB,
+        trace_memory=WORKER_TRACE_MEMORY,
+    )
+    metrics.add_gauge("worker_rss_bytes", pool.max_rss)
+    cache = ResultCache(max_bytes=RESULT_CACHE_MAX_BYTES)
+    metrics.add_gauge("result_cache_bytes", lambda: cache.current_bytes)
+    metrics.add_gauge("result_cache_entries", lambda: len(cache))
+    # Every request comes from the same client, so only the queue limits them.
+    scheduler = JobScheduler(
+        max_concurrent=MAX_CONCURRENT_JOBS,
+        max_jobs_per_user=MAX_CONCURRENT_JOBS + MAX_QUEUE_LENGTH,
+        max_queue_length=MAX_QUEUE_LENGTH,
+        metrics=metrics,
+    )
+    api = ConversionAPI(
+        pool,
+        scheduler,
+        cache,
+        metrics,
+        API_HOST,
+        API_PORT,
+        int(API_MAX_UPLOAD_MB * MB),
+        API_KEEP_ALIVE_TIMEOUT,
+        API_TOKEN,
+        API_BODY_TIMEOUT,
+    )
+    await api.start()
+    prewarm = asyncio.create_task(pool.prewarm())
+
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+
+    def _signal_handler(sig):
+        logging.info(f"Received exit signal {sig.name}...")
+        stop_event.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, _signal_handler, sig)
+
+    await stop_event.wait()
+
+    logging.info("Stopping the conversion API...")
+    prewarm.cancel()
+    await api.stop(API_DRAIN_TIMEOUT)
+    pool.shutdown()
+    logging.info("Conversion API stopped gracefully")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Line parser throughput on Helix page texts.
+
+Compares ``parse_line`` with the pattern cascade in
+``parse_line_with_patterns``, separately for result lines and for the
+header, footer and comment lines around them, and with the parser of each
+report profile on the result lines of its reports::
+
+    python -m benchmarks.parser_throughput [--repeat N]
+"""
+import argparse
+import os
+import time
+from typing import Callable, List
+
+from pdf_processing import extract_analysis_name, parse_line, parse_line_with_patterns
+from profiles import detect_profile
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "tests", "data", "helix_pages.txt")
+
+
+def load_pages(path: str = CORPUS_PATH) -> List[str]:
+    """Return the page texts of the corpus, which are separated by form feeds."""
+    with open(path, encoding="utf-8") as f:
+        return f.read().split("\f\n")
+
+
+def measure(parse: Callable[[str], object], lines: List[str], repeat: int) -> float:
+    """Return parsed lines per second."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            parse(line)
+    return len(lines) * repeat / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Line parser throughput on Helix page texts.")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    profile = None
+    lines = [line for page in load_pages() for line in page.split("\n")]
+    assert [parse_line(line) for line in lines] == [parse_line_with_patterns(line) for line in lines]
+    result_lines = [line for line in lines if parse_line_with_patterns(line) is not None]
+    other_lines = [line for line in lines if parse_line_with_patterns(line) is None]
+
+    for label, subset in (("all lines", lines), ("result lines", result_lines), ("other lines", other_lines)):
+        cascade = measure(parse_line_with_patterns, subset, args.repeat)
+        single_pass = measure(parse_line, subset, args.repeat)
+        print(
+            f"{label:<13} ({len(subset):3d}): cascade {cascade:10,.0f} lines/s, "
+            f"single pass {single_pass:10,.0f} lines/s ({single_pass / cascade:.1f}x)"
+        )
+
+    reports = {}
+    for page in load_pages():
+        if extract_analysis_name(page):
+            # The first page of the next report in the corpus.
+            profile = detect_profile(page)
+        reports.setdefault(profile, []).extend(line for line in page.split("\n") if parse_line(line) is not None)
+    for profile, subset in reports.items():
+        generic = measure(parse_line, subset, args.repeat)
+        specialised = measure(profile.parse_line, subset, args.repeat)
+        print(
+            f"{profile.key:<20} ({len(subset):3d}): single pass {generic:10,.0f} lines/s, "
+            f"profile {specialised:10,.0f} lines/s ({specialised / generic:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
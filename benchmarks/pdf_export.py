@@ -0,0 +1,91 @@
+"""Size and write time of the PDF export on synthetic reports of growing size.
+
+Compares the per-row gridspec chart of ``plot_scales_with_adjusted_ref_labels_spacing``
+with ``plot_scales``, and a long report split into pages of ``--rows-per-page``::
+
+    python -m benchmarks.pdf_export [--case N] [--repeat N] [--rows-per-page N]
+
+Times are the best of ``--repeat`` runs. The gridspec chart always writes a
+PNG as well, so only its total time is reported.
+"""
+import argparse
+import io
+import logging
+import math
+import time
+import warnings
+from typing import Dict, List, Optional, Sequence
+
+from benchmarks.synthetic_report import build_report_pdf, synthetic_rows
+from pdf_processing import ResultRow, create_dataframe, extract_data_from_all_pages, open_pdf
+from pipeline import render_report
+from plotting import plot_scales, plot_scales_with_adjusted_ref_labels_spacing
+
+DEFAULT_CASES = [20, 60, 100]
+DEFAULT_ROWS_PER_PAGE = 20
+
+
+def report_rows(analytes: int) -> List[ResultRow]:
+    with open_pdf(build_report_pdf(synthetic_rows(analytes)), "pdfium") as pdf:
+        rows, _ = extract_data_from_all_pages(pdf)
+    return rows
+
+
+def measure(analytes: int, repeat: int, rows_per_page: int) -> Dict[str, float]:
+    """Return the PDF sizes in bytes and write times in seconds of each export for one report."""
+    rows = report_rows(analytes)
+    title = "Анализ мочи на органические кислоты"
+    results: Dict[str, float] = {}
+
+    best = math.inf
+    for _ in range(repeat):
+        pdf = io.BytesIO()
+        start = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            plot_scales_with_adjusted_ref_labels_spacing(create_dataframe(rows), title, io.BytesIO(), pdf)
+        best = min(best, time.perf_counter() - start)
+    results["gridspec_bytes"] = len(pdf.getvalue())
+    results["gridspec_png_and_pdf_seconds"] = best
+
+    best = math.inf
+    for _ in range(repeat):
+        pdf = io.BytesIO()
+        timings: Dict[str, float] = {}
+        plot_scales(rows, title, save_path_pdf=pdf, timings=timings)
+        best = min(best, timings["savefig_pdf"])
+    results["plot_scales_bytes"] = len(pdf.getvalue())
+    results["plot_scales_savefig_seconds"] = best
+
+    if analytes > rows_per_page:
+        best = math.inf
+        for _ in range(repeat):
+            timings = {}
+            outputs = render_report(rows, title, ["pdf"], rows_per_page=rows_per_page, timings=timings)
+            best = min(best, timings["savefig_pdf"])
+        results["pages_bytes"] = len(outputs["pdf"])
+        results["pages_savefig_seconds"] = best
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Size and write time of the PDF export.")
+    parser.add_argument("--case", dest="cases", type=int, action="append", help="Number of analytes.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rows-per-page", type=int, default=DEFAULT_ROWS_PER_PAGE)
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    for analytes in args.cases or DEFAULT_CASES:
+        results = measure(analytes, args.repeat, args.rows_per_page)
+        print(
+            analytes,
+            " ".join(
+                f"{name}={value / 1024:.1f}KiB" if name.endswith("_bytes") else f"{name}={value * 1000:.0f}ms"
+                for name, value in results.items()
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Size, resolution and encode time of the PNG export with each profile of ``png_output.PNG_PROFILES``.
+
+Renders synthetic reports of growing size with both PNG renderers::
+
+    python -m benchmarks.png_profiles [--case N] [--repeat N] [--profile NAME]
+
+Times are the best of ``--repeat`` runs. ``encode`` is quantizing and
+compressing the drawn image, ``total`` also includes drawing it.
+"""
+import argparse
+import io
+import logging
+import math
+from typing import Dict, List, Optional, Sequence
+
+from PIL import Image
+
+from benchmarks.pdf_export import report_rows
+from pdf_processing import ResultRow
+from plotting import plot_scales
+from png_output import PNG_PROFILES
+from raster import plot_scales_raster
+
+DEFAULT_CASES = [20, 60, 100]
+RENDERERS = {"matplotlib": plot_scales, "pillow": plot_scales_raster}
+
+
+def measure(rows: List[ResultRow], profile: str, renderer: str, repeat: int) -> Dict[str, float]:
+    """Return the PNG size in bytes, its pixel size and the best encode and total times in seconds."""
+    title = "Анализ мочи на органические кислоты"
+    encode = total = math.inf
+    for _ in range(repeat):
+        png = io.BytesIO()
+        timings: Dict[str, float] = {}
+        RENDERERS[renderer](rows, title, png, timings=timings, png_profile=PNG_PROFILES[profile])
+        encode = min(encode, timings["encode_png"])
+        total = min(total, timings.get("figure_raster", 0.0) + timings["savefig_png"])
+    width, height = Image.open(png).size
+    return {"bytes": len(png.getvalue()), "width": width, "height": height, "encode": encode, "total": total}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Size and encode time of the PNG profiles.")
+    parser.add_argument("--case", dest="cases", type=int, action="append", help="Number of analytes.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--profile", dest="profiles", choices=PNG_PROFILES, action="append")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    for analytes in args.cases or DEFAULT_CASES:
+        rows = report_rows(analytes)
+        for profile in args.profiles or PNG_PROFILES:
+            for renderer in RENDERERS:
+                results = measure(rows, profile, renderer, args.repeat)
+                print(
+                    f"{analytes} {profile} {renderer} {results['width']:.0f}x{results['height']:.0f} "
+                    f"{results['bytes'] / 1024:.1f}KiB encode={results['encode'] * 1000:.0f}ms "
+                    f"total={results['total'] * 1000:.0f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
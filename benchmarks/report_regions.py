@@ -0,0 +1,60 @@
+"""Effect of the report region map on extraction time and unparsed lines.
+
+Reads a synthetic Helix report with two appendix pages, once page by page in
+full and once cropped to the results table with early termination at the end
+marker::
+
+    python -m benchmarks.report_regions [--rows N] [--repeat N]
+"""
+import argparse
+import logging
+import time
+from typing import Optional, Tuple
+
+from benchmarks.synthetic_report import build_report_pdf, synthetic_rows
+from pdf_processing import DEFAULT_REPORT_LAYOUT, TEXT_BACKENDS, extract_data_from_all_pages, open_pdf
+
+
+class WarningCounter(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+
+
+def measure(content: bytes, backend: str, layout: Optional[str], repeat: int) -> Tuple[float, int, int]:
+    """Return the best time in seconds, the number of rows and of unparsed lines."""
+    counter = WarningCounter()
+    logging.getLogger().addHandler(counter)
+    best = float("inf")
+    try:
+        for _ in range(repeat):
+            counter.count = 0
+            with open_pdf(content, backend) as pdf:
+                start = time.perf_counter()
+                rows, _ = extract_data_from_all_pages(pdf, layout)
+                best = min(best, time.perf_counter() - start)
+    finally:
+        logging.getLogger().removeHandler(counter)
+    return best, len(rows), counter.count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Effect of the report region map on extraction.")
+    parser.add_argument("--rows", type=int, default=140)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger().handlers[:] = [logging.NullHandler()]
+
+    content = build_report_pdf(synthetic_rows(args.rows), appendix_pages=2)
+    for backend in TEXT_BACKENDS:
+        for label, layout in (("whole pages", None), ("table region", DEFAULT_REPORT_LAYOUT)):
+            seconds, rows, unparsed = measure(content, backend, layout, args.repeat)
+            print(f"{backend:<11} {label:<12} {seconds * 1000:8.1f} ms, {rows} rows, {unparsed} unparsed lines")
+
+
+if __name__ == "__main__":
+    main()
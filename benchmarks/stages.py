@@ -0,0 +1,158 @@
+"""Per-stage timings of the conversion on synthetic reports of growing size.
+
+Each case is a synthetic Helix report with N analytes across M pages. The
+stages are timed separately, best of ``--repeat`` runs, and written as JSON.
+With ``--baseline`` the run fails when a stage is slower than the stored
+timing by more than ``--threshold``, or has no stored timing at all::
+
+    python -m benchmarks.stages [--output results.json]
+    python -m benchmarks.stages --baseline benchmarks/baseline.json
+    python -m benchmarks.stages --update-baseline benchmarks/baseline.json
+
+Timings depend on the machine, so the baseline has to be recorded on the
+machine that checks against it, and recorded again whenever a stage is
+added or changed.
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.synthetic_report import build_report_pdf, synthetic_rows
+from pdf_processing import (
+    DEFAULT_TEXT_BACKEND,
+    TEXT_BACKENDS,
+    create_dataframe,
+    extract_data_from_all_pages,
+    extract_data_from_page,
+    open_pdf,
+)
+from plotting import plot_scales, plot_scales_with_adjusted_ref_labels_spacing
+from raster import plot_scales_raster
+
+# (analytes, pages) of each synthetic report.
+DEFAULT_CASES = [(10, 1), (40, 2), (80, 3)]
+DEFAULT_THRESHOLD = 0.25
+# Differences below this many seconds are timer and scheduler noise.
+MIN_REGRESSION_SECONDS = 0.002
+
+
+def best_time(fn: Callable[[], Any], repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_stages(analytes: int, pages: int, repeat: int, text_backend: str) -> Dict[str, float]:
+    """Return the best time in seconds of every stage for one synthetic report."""
+    content = build_report_pdf(synthetic_rows(analytes), rows_per_page=math.ceil(analytes / pages))
+    with open_pdf(content, text_backend) as pdf:
+        page_texts = [page.extract_text() for page in pdf.pages]
+    timings = {
+        "extract_data_from_page": best_time(lambda: [extract_data_from_page(text) for text in page_texts], repeat)
+    }
+
+    def extract_all() -> None:
+        # Opening is part of the stage, since pdfplumber caches parsed pages.
+        with open_pdf(content, text_backend) as pdf:
+            extract_data_from_all_pages(pdf)
+
+    timings["extract_data_from_all_pages"] = best_time(extract_all, repeat)
+    with open_pdf(content, text_backend) as pdf:
+        rows, analysis_name = extract_data_from_all_pages(pdf)
+    timings["create_dataframe"] = best_time(lambda: create_dataframe(rows), repeat)
+    df = create_dataframe(rows)
+    timings["plot_scales_with_adjusted_ref_labels_spacing"] = best_time(
+        lambda: plot_scales_with_adjusted_ref_labels_spacing(df, analysis_name, io.BytesIO(), io.BytesIO()), repeat
+    )
+    timings["plot_scales"] = best_time(lambda: plot_scales(rows, analysis_name, io.BytesIO(), io.BytesIO()), repeat)
+    timings["plot_scales_png"] = best_time(lambda: plot_scales(rows, analysis_name, io.BytesIO()), repeat)
+    timings["plot_scales_raster"] = best_time(lambda: plot_scales_raster(rows, analysis_name, io.BytesIO()), repeat)
+    return timings
+
+
+def run_suite(cases: Sequence[Tuple[int, int]], repeat: int, text_backend: str) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "text_backend": text_backend,
+        "repeat": repeat,
+        "cases": {},
+    }
+    for analytes, pages in cases:
+        name = f"{analytes}x{pages}"
+        results["cases"][name] = time_stages(analytes, pages, repeat, text_backend)
+        print(name, " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in results["cases"][name].items()))
+    return results
+
+
+def find_regressions(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+    min_seconds: float = MIN_REGRESSION_SECONDS,
+) -> List[str]:
+    """Describe every stage that got slower than the baseline by more than ``threshold``.
+
+    A measured stage without a baseline timing is reported as well, so new
+    stages are not left unchecked. Stages only in the baseline are ignored.
+    """
+    regressions = []
+    for case, timings in results["cases"].items():
+        for stage, seconds in timings.items():
+            reference = baseline.get("cases", {}).get(case, {}).get(stage)
+            if reference is None:
+                regressions.append(f"{case} {stage}: {seconds * 1000:.1f} ms, no baseline timing")
+                continue
+            if seconds > reference * (1 + threshold) and seconds - reference > min_seconds:
+                regressions.append(
+                    f"{case} {stage}: {seconds * 1000:.1f} ms, baseline {reference * 1000:.1f} ms "
+                    f"(+{(seconds / reference - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def parse_case(value: str) -> Tuple[int, int]:
+    analytes, _, pages = value.partition("x")
+    return int(analytes), int(pages or 1)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-stage timings of the conversion on synthetic reports.")
+    parser.add_argument("--case", dest="cases", type=parse_case, action="append", help="NxM: N analytes, M pages.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--text-backend", choices=TEXT_BACKENDS, default=DEFAULT_TEXT_BACKEND)
+    parser.add_argument("--output", help="Write the timings to this JSON file.")
+    parser.add_argument("--baseline", help="Fail if a stage regressed against this JSON file.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown, 0.25 = 25%%.")
+    parser.add_argument("--update-baseline", metavar="PATH", help="Store the timings as the new baseline.")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    results = run_suite(args.cases or DEFAULT_CASES, args.repeat, args.text_backend)
+    for path in filter(None, (args.output, args.update_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No stage regressed by more than {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
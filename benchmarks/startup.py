@@ -0,0 +1,87 @@
+"""Cold start cost of the bot: module imports and the first request.
+
+Every import is timed in a fresh interpreter, which also shows which heavy
+libraries a module pulls in. The first request is timed on a new worker pool,
+with and without ``ProcessingPool.prewarm`` before it::
+
+    python -m benchmarks.startup [--budget SECONDS] [--text-backend pdfium]
+
+With ``--budget`` the run fails when importing the bot takes longer.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.synthetic_report import build_report_pdf, synthetic_rows
+from pdf_processing import DEFAULT_TEXT_BACKEND, TEXT_BACKENDS
+from pipeline import OUTPUT_FORMATS, ProcessingPool
+
+MODULES = ("bot", "handlers", "pipeline", "pdf_processing", "plotting")
+HEAVY_MODULES = ("matplotlib", "numpy", "pandas", "pdfplumber", "pypdfium2", "PIL")
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """Import ``module`` in a fresh interpreter and return the seconds it took and the heavy modules it loaded."""
+    script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    ).stdout.splitlines()[-1]
+    seconds, loaded = json.loads(output)
+    return seconds, loaded
+
+
+async def time_first_requests(content: bytes, text_backend: str, prewarm: bool) -> Dict[str, float]:
+    pool = ProcessingPool(size=1, text_backend=text_backend)
+    timings = {}
+    try:
+        if prewarm:
+            start = time.perf_counter()
+            await pool.prewarm()
+            timings["prewarm"] = time.perf_counter() - start
+        for name in ("first_request", "second_request"):
+            start = time.perf_counter()
+            await pool.convert_report(content, OUTPUT_FORMATS)
+            timings[name] = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    return timings
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import and first-request cost of the bot.")
+    parser.add_argument("--budget", type=float, help="Fail if importing the bot takes longer, in seconds.")
+    parser.add_argument("--text-backend", choices=TEXT_BACKENDS, default=DEFAULT_TEXT_BACKEND)
+    args = parser.parse_args(argv)
+
+    bot_import = None
+    for module in MODULES:
+        seconds, loaded = measure_import(module)
+        if module == "bot":
+            bot_import = seconds
+        print(f"import {module:<15} {seconds * 1000:7.0f} ms  loads: {', '.join(loaded) or '-'}")
+
+    content = build_report_pdf(synthetic_rows(40), rows_per_page=20)
+    for prewarm in (False, True):
+        timings = asyncio.run(time_first_requests(content, args.text_backend, prewarm))
+        label = "with prewarm   " if prewarm else "without prewarm"
+        print(label, " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items()))
+
+    if args.budget is not None and bot_import > args.budget:
+        print(f"Importing the bot took {bot_import:.2f} s, over the budget of {args.budget:g} s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
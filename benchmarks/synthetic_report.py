@@ -0,0 +1,166 @@
+"""Synthetic Helix-style reports for tests and benchmarks.
+
+The PDFs mimic the layout of Helix organic-acid and amino-acid reports: a lab
+and patient header, the analysis name followed by "Метод:", a results table
+with name, value, unit and reference columns, and a footer on every page.
+"""
+import io
+import itertools
+from typing import List, Sequence, Tuple
+
+import matplotlib
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+# Name, value, unit and reference column texts of one table row.
+ReportRow = Tuple[str, str, str, str]
+
+ORGANIC_ACIDS = "Органические кислоты в моче (расширенный профиль)"
+AMINO_ACIDS = "Аминокислоты в крови (32 показателя)"
+
+ANALYTE_NAMES = [
+    "Молочная кислота (лактат, E270)",
+    "Пировиноградная кислота (пируват)",
+    "Лимонная кислота (цитрат, E330)",
+    "Цис-аконитовая кислота",
+    "2-Кетоглутаровая кислота",
+    "Янтарная кислота (сукцинат)",
+    "Фумаровая кислота",
+    "Яблочная кислота (малат)",
+    "Гидроксиметилглутаровая кислота",
+    "Адипиновая кислота",
+    "Субериновая кислота",
+    "Этилмалоновая кислота",
+    "Гомованилиновая кислота (HVA)",
+    "Ванилилминдальная кислота (VMA)",
+    "Хинолиновая кислота",
+    "Кинуреновая кислота",
+    "Аланин",
+    "Аргинин",
+    "Цитруллин",
+    "Глицин",
+    "Метионин",
+    "Орнитин",
+    "Фенилаланин",
+    "Тирозин",
+    "Лейцин/Изолейцин",
+    "Свободный карнитин (C0)",
+]
+RATIO_NAMES = [
+    "Гомованилиновая кислота/Ванилилминдальная кислота",
+    "Фенилаланин/Тирозин",
+    "Глицин/Серин",
+]
+UNITS = ["ммоль/моль креат.", "мкмоль/л", "нмоль/мл"]
+ROW_KINDS = ("range", "range", "ratio", "less_than", "range", "not_detected", "no_ref")
+ROW_HEIGHT = 0.018
+TABLE_TOP = 0.78
+COLUMNS = (0.06, 0.5, 0.6, 0.76)
+END_MARKER_LINE = "Исполнитель: Петрова А. А. Одобрено: Сидоров В. В. 22.03.2024 14:12"
+# Appendix pages describe the panel and quote example results, which a parser
+# reading past the end of the report would pick up as rows.
+APPENDIX_LINES = [
+    "Описание исследования",
+    "Органические кислоты являются продуктами обмена веществ.",
+    "Пример записи результата:",
+    "Аланин 356.12 мкмоль/л 200.00 - 480.00",
+    "Повышение показателя не всегда указывает на патологию.",
+]
+APPENDIX_PARAGRAPH = "Показатель отражает активность цикла трикарбоновых кислот и зависит от питания."
+
+
+def synthetic_rows(num_rows: int) -> List[ReportRow]:
+    """Build ``num_rows`` deterministic table rows mixing every kind of result line.
+
+    Besides plain reference ranges there are ratio rows without a unit, ``<x``
+    upper limits, "не обнаружено" and rows without reference values.
+    """
+    rows = []
+    names = itertools.cycle(ANALYTE_NAMES)
+    ratio_names = itertools.cycle(RATIO_NAMES)
+    for i in range(num_rows):
+        kind = ROW_KINDS[i % len(ROW_KINDS)]
+        unit = UNITS[i % len(UNITS)]
+        suffix = "" if i < len(ANALYTE_NAMES) else f" ({chr(ord('A') + i // len(ANALYTE_NAMES) - 1)})"
+        value = 0.5 + (i * 37 % 100) / 10
+        if kind == "ratio":
+            rows.append((next(ratio_names) + suffix, f"{value / 5:.2f}", "", "0.32 - 2.2"))
+            continue
+        name = next(names) + suffix
+        if kind == "range":
+            rows.append((name, f"{value:.4f}", unit, f"{value * 0.6:.4f} - {value * 1.3 + 1:.4f}"))
+        elif kind == "less_than":
+            rows.append((name, f"{value:.4f}", unit, f"<{value + 2:.4f}"))
+        elif kind == "not_detected":
+            rows.append((name, "0.00", unit, "не обнаружено"))
+        else:
+            rows.append((name, f"{value:.4f}", unit, "Референсные значения не определены"))
+    return rows
+
+
+def _draw_page(
+    fig: Figure,
+    rows: Sequence[ReportRow],
+    analysis_name: str,
+    page_number: int,
+    num_pages: int,
+    last_table_page: bool,
+) -> None:
+    fig.text(0.06, 0.96, "ООО «Хеликс» Лицензия № Л041-01148-78/00365305 от 27.04.2019", fontsize=7)
+    fig.text(0.06, 0.94, "Пациент: Иванова Мария Петровна Пол: Ж Дата рождения: 12.03.1986", fontsize=7)
+    fig.text(0.06, 0.92, "ИНЗ: 1234567890 Дата взятия образца: 15.03.2024 09:40", fontsize=7)
+    if page_number == 1:
+        fig.text(0.06, 0.88, f"Исследование (врач): {analysis_name} Метод: ВЭЖХ-МС/МС", fontsize=8)
+        fig.text(0.06, 0.86, "Биоматериал: моча, разовая порция", fontsize=7)
+    for x, header in zip(COLUMNS, ("Исследование", "Результат", "Единицы", "Референсные значения")):
+        fig.text(x, TABLE_TOP + 0.03, header, fontsize=7, weight="bold")
+    for i, row in enumerate(rows):
+        y = TABLE_TOP - i * ROW_HEIGHT
+        for x, text in zip(COLUMNS, row):
+            if text:
+                fig.text(x, y, text, fontsize=7)
+    if last_table_page:
+        y = TABLE_TOP - len(rows) * ROW_HEIGHT
+        fig.text(0.06, y, END_MARKER_LINE, fontsize=7)
+        fig.text(0.06, y - ROW_HEIGHT, "Комментарий: повторное исследование через 3 - 6 месяцев.", fontsize=7)
+    fig.text(0.06, 0.05, "Результаты исследований не являются диагнозом.", fontsize=6)
+    fig.text(0.8, 0.03, f"Страница {page_number} из {num_pages}", fontsize=6)
+
+
+def _draw_appendix_page(fig: Figure, page_number: int, num_pages: int) -> None:
+    lines = APPENDIX_LINES + [APPENDIX_PARAGRAPH] * 40
+    for i, line in enumerate(lines):
+        fig.text(0.06, 0.9 - i * ROW_HEIGHT, line, fontsize=7)
+    fig.text(0.8, 0.03, f"Страница {page_number} из {num_pages}", fontsize=6)
+
+
+def build_report_pdf(
+    rows: Sequence[ReportRow],
+    analysis_name: str = ORGANIC_ACIDS,
+    rows_per_page: int = 35,
+    appendix_pages: int = 0,
+) -> bytes:
+    """Render the rows into a multi-page Helix-style PDF and return its bytes.
+
+    The table ends with the "Исполнитель:" sign-off line and may be followed
+    by ``appendix_pages`` pages of panel description.
+    """
+    pages = [rows[i : i + rows_per_page] for i in range(0, len(rows), rows_per_page)] or [[]]
+    num_pages = len(pages) + appendix_pages
+    buffer = io.BytesIO()
+    # TrueType fonts keep a unicode mapping, so the text can be extracted back.
+    with matplotlib.rc_context({"pdf.fonttype": 42}), PdfPages(buffer) as pdf:
+        for page_number, page_rows in enumerate(pages, start=1):
+            fig = Figure(figsize=(8.27, 11.69))
+            _draw_page(fig, page_rows, analysis_name, page_number, num_pages, page_number == len(pages))
+            pdf.savefig(fig)
+        for page_number in range(len(pages) + 1, num_pages + 1):
+            fig = Figure(figsize=(8.27, 11.69))
+            _draw_appendix_page(fig, page_number, num_pages)
+            pdf.savefig(fig)
+    return buffer.getvalue()
+
+
+def expected_line(row: ReportRow) -> str:
+    """Return the text line a PDF extractor should produce for a table row."""
+    return " ".join(text for text in row if text)
@@ -0,0 +1,48 @@
+"""Per-page text extraction time of each PDF text backend.
+
+Builds a synthetic Helix report, extracts every page with each backend from
+``pdf_processing.TEXT_BACKENDS`` and checks that the parsed rows are the same::
+
+    python -m benchmarks.text_backends [--rows N] [--repeat N]
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+from benchmarks.synthetic_report import ORGANIC_ACIDS, build_report_pdf, synthetic_rows
+from pdf_processing import TEXT_BACKENDS, extract_data_from_page, open_pdf
+
+
+def time_pages(content: bytes, backend: str) -> Tuple[List[float], List[list]]:
+    """Return the extraction time in seconds and the parsed rows of every page."""
+    timings, rows = [], []
+    with open_pdf(content, backend) as pdf:
+        for page in pdf.pages:
+            start = time.perf_counter()
+            text = page.extract_text()
+            timings.append(time.perf_counter() - start)
+            rows.append(extract_data_from_page(text))
+    return timings, rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-page text extraction time of each PDF text backend.")
+    parser.add_argument("--rows", type=int, default=140)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    content = build_report_pdf(synthetic_rows(args.rows), ORGANIC_ACIDS)
+    reference = None
+    for backend in TEXT_BACKENDS:
+        runs = [time_pages(content, backend) for _ in range(args.repeat)]
+        best = [min(run[0][i] for run in runs) for i in range(len(runs[0][0]))]
+        rows = runs[0][1]
+        if reference is None:
+            reference = rows
+        fidelity = "same rows" if rows == reference else "ROWS DIFFER"
+        pages = ", ".join(f"{t * 1000:.1f}" for t in best)
+        print(f"{backend:<11} total {sum(best) * 1000:8.1f} ms, per page [{pages}] ms, {fidelity}")
+
+
+if __name__ == "__main__":
+    main()
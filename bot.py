@@ -2,6 +2,7 @@ import asyncio
 import logging
 import os
 import signal
+import time
 
 import nest_asyncio
 from dotenv import load_dotenv
@@ -14,16 +15,78 @@ from telegram.ext import (
 )
 
 from handlers import (
+    finish_background_tasks,
     handle_download,
     handle_file,
     handle_lab_selection,
     handle_non_pdf,
+    handle_trends,
     start,
 )
+from cache import DEFAULT_CACHE_MAX_BYTES, ResultCache
+from history import AnalyteHistory
+from jobs import JobIndex
+from metrics import DEFAULT_METRICS_PORT, Metrics, start_metrics_server
+from pdf_processing import DEFAULT_TEXT_BACKEND
+from memory import MB
+from png_output import DEFAULT_PNG_PROFILE
+from pipeline import (
+    DEFAULT_JOB_TIMEOUT,
+    DEFAULT_MAX_JOBS_PER_WORKER,
+    DEFAULT_MAX_WORKER_RSS,
+    DEFAULT_PNG_RENDERER,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_ROWS_PER_PAGE,
+    ProcessingPool,
+)
+from scheduler import DEFAULT_MAX_JOBS_PER_USER, DEFAULT_MAX_QUEUE_LENGTH, JobScheduler
+from storage import (
+    DEFAULT_MAX_TOTAL_BYTES,
+    DEFAULT_MAX_USER_BYTES,
+    DEFAULT_SWEEP_INTERVAL,
+    DEFAULT_TTL,
+    ArtifactStore,
+    run_sweeper,
+)
+from webhook import (
+    DEFAULT_DRAIN_TIMEOUT,
+    DEFAULT_WEBHOOK_LISTEN,
+    DEFAULT_WEBHOOK_PATH,
+    DEFAULT_WEBHOOK_PORT,
+    WebhookServer,
+)
 
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", DEFAULT_POOL_SIZE))
+WORKER_JOB_TIMEOUT = float(os.getenv("WORKER_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT))
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", DEFAULT_MAX_JOBS_PER_WORKER))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", DEFAULT_MAX_WORKER_RSS // MB))
+WORKER_TRACE_MEMORY = os.getenv("WORKER_TRACE_MEMORY", "0") != "0"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+PERSIST_FILES = os.getenv("PERSIST_FILES", "1") != "0"
+ARTIFACT_MAX_USER_BYTES = int(os.getenv("ARTIFACT_MAX_USER_BYTES", DEFAULT_MAX_USER_BYTES))
+ARTIFACT_MAX_TOTAL_BYTES = int(os.getenv("ARTIFACT_MAX_TOTAL_BYTES", DEFAULT_MAX_TOTAL_BYTES))
+ARTIFACT_TTL_DAYS = float(os.getenv("ARTIFACT_TTL_DAYS", DEFAULT_TTL / 86400))
+ARTIFACT_SWEEP_INTERVAL = float(os.getenv("ARTIFACT_SWEEP_INTERVAL", DEFAULT_SWEEP_INTERVAL))
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", DEFAULT_TEXT_BACKEND)
+PNG_RENDERER = os.getenv("PNG_RENDERER", DEFAULT_PNG_RENDERER)
+PNG_PROFILE = os.getenv("PNG_PROFILE", DEFAULT_PNG_PROFILE)
+ROWS_PER_PAGE = int(os.getenv("ROWS_PER_PAGE", DEFAULT_ROWS_PER_PAGE))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", WORKER_POOL_SIZE))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", DEFAULT_MAX_JOBS_PER_USER))
+MAX_QUEUE_LENGTH = int(os.getenv("MAX_QUEUE_LENGTH", DEFAULT_MAX_QUEUE_LENGTH))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", DEFAULT_METRICS_PORT))
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", DEFAULT_WEBHOOK_LISTEN)
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", DEFAULT_WEBHOOK_PORT))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", DEFAULT_WEBHOOK_PATH)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT))
+STARTUP_TIME_BUDGET = float(os.getenv("STARTUP_TIME_BUDGET", 5))
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -34,9 +97,55 @@ nest_asyncio.apply()
 
 
 async def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+    started = time.perf_counter()
+    if BOT_MODE not in ("polling", "webhook"):
+        raise ValueError(f"Unknown BOT_MODE {BOT_MODE!r}, expected 'polling' or 'webhook'")
+    application = Application.builder().token(TOKEN).concurrent_updates(True).build()
+    metrics = Metrics()
+    pool = ProcessingPool(
+        size=WORKER_POOL_SIZE,
+        job_timeout=WORKER_JOB_TIMEOUT,
+        text_backend=PDF_TEXT_BACKEND,
+        metrics=metrics,
+        png_renderer=PNG_RENDERER,
+        png_profile=PNG_PROFILE,
+        rows_per_page=ROWS_PER_PAGE,
+        max_jobs_per_worker=WORKER_MAX_JOBS,
+        max_worker_rss=WORKER_MAX_RSS_MB * MB,
+        trace_memory=WORKER_TRACE_MEMORY,
+    )
+    metrics.add_gauge("worker_rss_bytes", pool.max_rss)
+    cache = ResultCache(max_bytes=RESULT_CACHE_MAX_BYTES)
+    metrics.add_gauge("result_cache_bytes", lambda: cache.current_bytes)
+    metrics.add_gauge("result_cache_entries", lambda: len(cache))
+    application.bot_data["metrics"] = metrics
+    application.bot_data["scheduler"] = JobScheduler(
+        max_concurrent=MAX_CONCURRENT_JOBS,
+        max_jobs_per_user=MAX_JOBS_PER_USER,
+        max_queue_length=MAX_QUEUE_LENGTH,
+        metrics=metrics,
+    )
+    application.bot_data["processing_pool"] = pool
+    application.bot_data["result_cache"] = cache
+    store = None
+    if PERSIST_FILES:
+        store = ArtifactStore(
+            max_user_bytes=ARTIFACT_MAX_USER_BYTES,
+            max_total_bytes=ARTIFACT_MAX_TOTAL_BYTES,
+            ttl=ARTIFACT_TTL_DAYS * 86400,
+        )
+        metrics.add_gauge("artifact_store_bytes", store.usage)
+    application.bot_data["artifact_store"] = store
+    # Job IDs outlive a restart when files are kept, so old download buttons keep working.
+    job_index = JobIndex(
+        os.path.join(store.root, "jobs.sqlite3") if store is not None else ":memory:", ttl=ARTIFACT_TTL_DAYS * 86400
+    )
+    application.bot_data["job_index"] = job_index
+    history = AnalyteHistory(os.path.join(store.root, "history.sqlite3") if store is not None else ":memory:")
+    application.bot_data["analyte_history"] = history
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("trends", handle_trends))
     application.add_handler(
         CallbackQueryHandler(handle_lab_selection, pattern="^lab_helix$")
     )
@@ -48,11 +157,31 @@ async def main() -> None:
         CallbackQueryHandler(handle_download, pattern="^download_(png|pdf)_")
     )
 
-    logging.info("Bot started and ready to receive commands")
+    logging.info(f"Bot started in {BOT_MODE} mode and ready to receive commands")
 
+    connecting = time.perf_counter()
     await application.initialize()
+    connected = time.perf_counter()
     await application.start()
-    await application.updater.start_polling()
+    webhook = None
+    if BOT_MODE == "webhook":
+        webhook = WebhookServer(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN)
+        await webhook.start(WEBHOOK_URL)
+    else:
+        await application.updater.start_polling()
+    metrics_server = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    startup = time.perf_counter() - started
+    metrics.observe("startup", startup)
+    logging.info(
+        f"Ready to receive updates {startup:.2f} s after start, "
+        f"connecting to Telegram took {connected - connecting:.2f} s"
+    )
+    if startup > STARTUP_TIME_BUDGET:
+        logging.warning(f"Startup took {startup:.2f} s, over the budget of {STARTUP_TIME_BUDGET:g} s")
+    # Workers load matplotlib and the PDF libraries and render a dummy chart
+    # in the background, so the first upload does not wait for that.
+    prewarm = asyncio.create_task(pool.prewarm())
+    sweeper = asyncio.create_task(run_sweeper(store, ARTIFACT_SWEEP_INTERVAL)) if store is not None else None
 
     loop = asyncio.get_running_loop()
     stop_event = asyncio.Event()
@@ -67,9 +196,24 @@ async def main() -> None:
     await stop_event.wait()
 
     logging.info("Stopping application...")
-    await application.updater.stop()
+    prewarm.cancel()
+    if sweeper is not None:
+        sweeper.cancel()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    if webhook is not None:
+        await webhook.stop(WEBHOOK_DRAIN_TIMEOUT)
+    else:
+        await application.updater.stop()
+    # Processes the updates that were already received before returning.
     await application.stop()
     await application.shutdown()
+    pool.shutdown()
+    job_index.close()
+    history.close()
+    if store is not None:
+        await finish_background_tasks()
+        store.close()
     logging.info("Application stopped gracefully")
 
 
@@ -0,0 +1,76 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from pipeline import RENDERER_VERSION, ConversionResult
+
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(content: bytes, renderer_version: str = RENDERER_VERSION) -> str:
+    """Key a result by the uploaded bytes and the renderer that produced it."""
+    return f"{renderer_version}:{hashlib.sha256(content).hexdigest()}"
+
+
+class ResultCache:
+    """Size-bounded LRU cache of converted reports keyed by ``cache_key``."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, ConversionResult]" = OrderedDict()
+        # Results gain exports after they are cached, so remember the size
+        # each entry was accounted with.
+        self._sizes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[ConversionResult]:
+        result = self._entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def peek(self, key: str) -> Optional[ConversionResult]:
+        """Look up a result without counting it as a hit or a miss."""
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: ConversionResult) -> None:
+        """Add a result, or re-account an existing one after exports were added to it."""
+        if key in self._entries:
+            del self._entries[key]
+            self.current_bytes -= self._sizes.pop(key)
+        size = result.size
+        if size > self.max_bytes:
+            logging.info(f"Result {key} ({size} bytes) is larger than the cache, not cached")
+            return
+        self._entries[key] = result
+        self._sizes[key] = size
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.current_bytes -= self._sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,243 @@
+"""Convert an archive of PDF reports to charts without the bot.
+
+    python convert.py archive/ "more/*.pdf" -o charts/ [-j 8] [--formats png,pdf]
+
+Every report is parsed and plotted in a separate process, using all CPU cores
+by default. The outputs mirror the layout of the inputs under the output
+directory. Reports whose outputs already exist are skipped, so an interrupted
+run picks up where it stopped.
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pdf_processing import DEFAULT_TEXT_BACKEND, TEXT_BACKENDS
+from png_output import DEFAULT_PNG_PROFILE, PNG_PROFILES
+from pipeline import (
+    DEFAULT_PNG_RENDERER,
+    DEFAULT_ROWS_PER_PAGE,
+    OUTPUT_FORMATS,
+    PNG_RENDERERS,
+    convert_report,
+    output_pages,
+)
+from storage import write_atomically
+
+WORKER_CRASHED = "Процесс обработки аварийно завершился"
+Task = Tuple[str, Dict[str, str]]
+
+
+class FileOutcome(NamedTuple):
+    path: str
+    seconds: float
+    rows: int
+    error: Optional[str]
+
+
+def find_reports(inputs: Sequence[str]) -> List[str]:
+    """Return the PDF files of the given directories (searched recursively) and glob patterns.
+
+    In directories the extension is matched in any case, so REPORT.PDF is found too.
+    """
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            found = glob.glob(os.path.join(pattern, "**", "*"), recursive=True)
+            found = [path for path in found if path.lower().endswith(".pdf")]
+        else:
+            found = glob.glob(pattern, recursive=True)
+        paths.update(path for path in found if os.path.isfile(path))
+    return sorted(paths)
+
+
+def output_paths(path: str, root: str, output_dir: str, formats: Sequence[str]) -> Dict[str, str]:
+    stem = os.path.splitext(os.path.relpath(path, root))[0]
+    return {fmt: os.path.join(output_dir, f"{stem}.{fmt}") for fmt in formats}
+
+
+def convert_file(
+    path: str,
+    targets: Dict[str, str],
+    text_backend: str,
+    png_renderer: str = DEFAULT_PNG_RENDERER,
+    rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+) -> FileOutcome:
+    """Convert one report inside a worker process. Errors are returned, not raised.
+
+    Further pages of a paginated PNG go next to the target: report.png, report.2.png...
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            result = convert_report(
+                f.read(), list(targets), text_backend, png_renderer, rows_per_page, png_profile
+            )
+        if not result.rows:
+            return FileOutcome(path, time.perf_counter() - start, 0, "Нет данных в PDF файле")
+        for fmt, target in targets.items():
+            stem = os.path.splitext(target)[0]
+            # The target itself is written last, so a report is skipped only once all its pages exist.
+            for key in reversed(output_pages(result.outputs, fmt)):
+                write_atomically(f"{stem}.{key}", result.outputs[key])
+        return FileOutcome(path, time.perf_counter() - start, len(result.rows), None)
+    except Exception as e:
+        return FileOutcome(path, time.perf_counter() - start, 0, f"{type(e).__name__}: {e}")
+
+
+def _init_worker(log_level: int) -> None:
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=log_level)
+
+
+def _convert_until_crash(
+    todo: Deque[Task],
+    workers: int,
+    log_level: int,
+    args: Tuple,
+    record: Callable[[FileOutcome], None],
+) -> List[Task]:
+    """Convert the reports of ``todo`` with at most ``workers`` of them in flight, until done or a worker dies.
+
+    A dead worker breaks the whole pool. Only the reports in flight are lost
+    with it: they are returned, the rest stays in ``todo``.
+    """
+    crashed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_level,)) as executor:
+        running: Dict[Future, Task] = {}
+        while (todo or running) and not crashed:
+            while todo and len(running) < workers:
+                path, targets = task = todo.popleft()
+                running[executor.submit(convert_file, path, targets, *args)] = task
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                # The other reports in flight fail with the same error right away.
+                done, _ = wait(running)
+            for future in done:
+                task = running.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    crashed.append(task)
+                else:
+                    record(future.result())
+    return crashed
+
+
+def run_batch(
+    paths: Sequence[str],
+    output_dir: str,
+    formats: Sequence[str] = OUTPUT_FORMATS,
+    jobs: Optional[int] = None,
+    text_backend: str = DEFAULT_TEXT_BACKEND,
+    force: bool = False,
+    log_level: int = logging.ERROR,
+    png_renderer: str = DEFAULT_PNG_RENDERER,
+    rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+) -> Tuple[List[FileOutcome], int, float]:
+    """Convert the reports in parallel.
+
+    Returns the outcome of every converted report, the number of reports
+    skipped because their outputs exist, and the wall time in seconds.
+
+    When a worker dies (a crash in a PDF library, the OOM killer), the reports
+    it took down are converted again one at a time on fresh workers, so that
+    only the report that kills a worker again is recorded as a failure. The
+    rest of the archive goes on in a new pool.
+    """
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else ""
+    pending = []
+    for path in paths:
+        targets = output_paths(os.path.abspath(path), root, output_dir, formats)
+        if force or not all(os.path.exists(target) for target in targets.values()):
+            pending.append((path, targets))
+    skipped = len(paths) - len(pending)
+
+    outcomes: List[FileOutcome] = []
+
+    def record(outcome: FileOutcome) -> None:
+        outcomes.append(outcome)
+        status = "ошибка: " + outcome.error if outcome.error else f"{outcome.rows} строк"
+        print(f"[{len(outcomes)}/{len(pending)}] {outcome.path}: {status} ({outcome.seconds:.2f} с)", flush=True)
+
+    args = (text_backend, png_renderer, rows_per_page, png_profile)
+    workers = jobs or os.cpu_count() or 1
+    todo = deque(pending)
+    start = time.perf_counter()
+    while todo:
+        for task in _convert_until_crash(todo, workers, log_level, args, record):
+            logging.warning(f"A worker died while converting {task[0]}, converting it again on its own")
+            retry_start = time.perf_counter()
+            if _convert_until_crash(deque([task]), 1, log_level, args, record):
+                record(FileOutcome(task[0], time.perf_counter() - retry_start, 0, WORKER_CRASHED))
+    return outcomes, skipped, time.perf_counter() - start
+
+
+def print_summary(outcomes: Sequence[FileOutcome], skipped: int, wall_time: float, slowest: int = 5) -> None:
+    failures = [outcome for outcome in outcomes if outcome.error]
+    rate = len(outcomes) / wall_time if wall_time else 0.0
+    print(
+        f"Обработано файлов: {len(outcomes)}, пропущено готовых: {skipped}, ошибок: {len(failures)}. "
+        f"{wall_time:.1f} с, {rate:.2f} файлов/с."
+    )
+    for outcome in failures:
+        print(f"  Ошибка: {outcome.path}: {outcome.error}")
+    if outcomes and slowest:
+        print("Самые долгие файлы:")
+        for outcome in sorted(outcomes, key=lambda outcome: outcome.seconds, reverse=True)[:slowest]:
+            print(f"  {outcome.seconds:7.2f} с  {outcome.path}")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert PDF reports to charts without the bot.")
+    parser.add_argument("inputs", nargs="+", help="Directories or glob patterns of PDF reports.")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Worker processes (all cores).")
+    parser.add_argument("--formats", default=",".join(OUTPUT_FORMATS), help="Comma-separated: png, pdf.")
+    parser.add_argument("--text-backend", choices=TEXT_BACKENDS, default=DEFAULT_TEXT_BACKEND)
+    parser.add_argument("--png-renderer", choices=PNG_RENDERERS, default=DEFAULT_PNG_RENDERER)
+    parser.add_argument(
+        "--png-profile", choices=PNG_PROFILES, default=DEFAULT_PNG_PROFILE, help="Resolution and encoding of PNGs."
+    )
+    parser.add_argument(
+        "--rows-per-page", type=int, default=DEFAULT_ROWS_PER_PAGE, help="Split longer reports into pages (0: never)."
+    )
+    parser.add_argument("--force", action="store_true", help="Convert reports whose outputs already exist.")
+    parser.add_argument("--slowest", type=int, default=5, help="How many of the slowest files to list.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log unparsed lines and other details.")
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    unknown = set(formats) - set(OUTPUT_FORMATS)
+    if unknown or not formats:
+        parser.error(f"Unsupported output formats: {', '.join(sorted(unknown)) or args.formats}")
+
+    paths = find_reports(args.inputs)
+    if not paths:
+        print("PDF файлы не найдены.", file=sys.stderr)
+        return 1
+
+    log_level = logging.INFO if args.verbose else logging.ERROR
+    outcomes, skipped, wall_time = run_batch(
+        paths,
+        args.output_dir,
+        formats,
+        args.jobs,
+        args.text_backend,
+        args.force,
+        log_level,
+        args.png_renderer,
+        args.rows_per_page,
+        args.png_profile,
+    )
+    print_summary(outcomes, skipped, wall_time, args.slowest)
+    return 1 if any(outcome.error for outcome in outcomes) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,50 @@
+import asyncio
 import datetime
 import logging
-import os
+from typing import Any, Awaitable, List, Optional, Set, Tuple, TypeVar
 
-import pdfplumber
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.error import TimedOut
+from telegram.error import BadRequest, TimedOut
 from telegram.ext import CallbackContext
 
-from pdf_processing import create_dataframe, extract_data_from_all_pages
-from plotting import plot_scales_with_adjusted_ref_labels_spacing
+from cache import ResultCache, cache_key
+from history import AnalyteHistory
+from jobs import Job, JobIndex
+from metrics import Metrics
+from pipeline import ConversionResult, PipelineError, ProcessingPool, output_pages, page_format
+from profiles import get_profile
+from scheduler import JobRejected, JobScheduler
+from storage import ArtifactStore
 
 MAX_FILE_SIZE_MB = 10
+PROCESSING_MESSAGE = "Идет обработка данных, пожалуйста, подождите..."
+QUEUE_POSITION_MESSAGE = "Вы №{} в очереди. Обработка начнется автоматически."
+TRENDS_MIN_REPORTS = 2
+TRENDS_HINT = "Динамика показателей по всем вашим отчетам: /trends"
 LABS = [
     {"name": "Helix", "callback_data": "lab_helix"},
 ]
 
-# Ensure base directories exist
-os.makedirs("files", exist_ok=True)
+T = TypeVar("T")
+
+# Keep references to fire-and-forget persistence tasks until they finish
+_background_tasks: Set["asyncio.Task[None]"] = set()
 
 
 async def start(update: Update, context: CallbackContext) -> None:
     logging.info("Команда /start вызвана")
-    keyboard = [
-        [
-            InlineKeyboardButton(lab["name"], callback_data=lab["callback_data"])
-            for lab in LABS
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Выберите лабораторию:", reply_markup=reply_markup)
+    labs = ", ".join(lab["name"] for lab in LABS)
+    await update.message.reply_text(
+        f"Отправьте PDF файл с результатами анализов ({labs}). "
+        "Лаборатория и вид исследования определяются автоматически. "
+        "Команда /trends строит графики динамики по загруженным отчетам, "
+        "например /trends глюкоза."
+    )
 
 
 async def handle_lab_selection(update: Update, context: CallbackContext) -> None:
+    # Buttons sent by /start before labs were detected automatically
+    # can still be tapped in old chats.
     query = update.callback_query
     lab_choice = query.data
     logging.info(f"Лаборатория {lab_choice} выбрана")
@@ -47,36 +60,78 @@ async def handle_lab_selection(update: Update, context: CallbackContext) -> None
     )
 
 
-def save_file(
+def get_metrics(context: CallbackContext) -> Metrics:
+    return context.bot_data.setdefault("metrics", Metrics())
+
+
+def get_scheduler(context: CallbackContext) -> JobScheduler:
+    return context.bot_data.setdefault("scheduler", JobScheduler())
+
+
+async def timed(metrics: Metrics, stage: str, awaitable: Awaitable[T]) -> T:
+    with metrics.time(stage):
+        return await awaitable
+
+
+def get_job_index(context: CallbackContext) -> JobIndex:
+    index = context.bot_data.get("job_index")
+    if index is None:
+        index = context.bot_data["job_index"] = JobIndex()
+    return index
+
+
+def get_history(context: CallbackContext) -> AnalyteHistory:
+    history = context.bot_data.get("analyte_history")
+    if history is None:
+        history = context.bot_data["analyte_history"] = AnalyteHistory()
+    return history
+
+
+def get_store(context: CallbackContext) -> Optional[ArtifactStore]:
+    """Return the artifact store, or None when files are not kept on disk."""
+    return context.bot_data.get("artifact_store")
+
+
+async def _save_file_timed(metrics: Metrics, store: ArtifactStore, *args: Any) -> None:
+    with metrics.time("save_file"):
+        await asyncio.to_thread(store.put, *args)
+
+
+def save_file_in_background(
+    store: ArtifactStore,
     user_name: str,
-    file_content: bytes,
-    extension: str,
-    folder_type: str,
     current_time: str,
-) -> str:
-    # Create user folder
-    user_folder = os.path.join("files", user_name)
-    os.makedirs(user_folder, exist_ok=True)
+    folder_type: str,
+    extension: str,
+    file_content: bytes,
+    metrics: Optional[Metrics] = None,
+) -> None:
+    task = asyncio.create_task(
+        _save_file_timed(metrics or Metrics(), store, user_name, current_time, folder_type, extension, file_content)
+    )
+    _background_tasks.add(task)
+    task.add_done_callback(_finish_background_task)
 
-    # Create folder for upload or output
-    folder_path = os.path.join(user_folder, folder_type)
-    os.makedirs(folder_path, exist_ok=True)
 
-    # Create time-stamped subfolder
-    time_folder = os.path.join(folder_path, current_time)
-    os.makedirs(time_folder, exist_ok=True)
+async def finish_background_tasks() -> None:
+    """Wait until the files still being saved are written."""
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
 
-    # Save file
-    file_name = f"{current_time}.{extension}"
-    file_path = os.path.join(time_folder, file_name)
-    with open(file_path, "wb") as f:
-        f.write(file_content)
 
-    logging.info(f"File saved to {file_path}")
-    return file_path
+def _finish_background_task(task: "asyncio.Task[None]") -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Could not persist files", exc_info=task.exception())
 
 
 async def handle_file(update: Update, context: CallbackContext) -> None:
+    metrics = get_metrics(context)
+    metrics.inc("jobs", kind="upload")
+    with metrics.time("handle_file"):
+        await _handle_file(update, context, metrics)
+
+
+async def _handle_file(update: Update, context: CallbackContext, metrics: Metrics) -> None:
     logging.info("PDF файл получен")
     document = update.message.document
 
@@ -88,112 +143,327 @@ async def handle_file(update: Update, context: CallbackContext) -> None:
         return
 
     try:
-        file = await document.get_file()
+        with metrics.time("get_file"):
+            file = await document.get_file()
     except TimedOut:
+        metrics.inc("job_failures", kind="upload", reason="get_file")
         logging.error("Получение файла завершилось по таймауту.")
         await update.message.reply_text(
             "Получение файла завершилось по таймауту. Пожалуйста, попробуйте снова."
         )
         return
     except Exception as e:
+        metrics.inc("job_failures", kind="upload", reason="get_file")
         logging.error("An error occurred while getting the file.", exc_info=True)
         await update.message.reply_text(
             f"Произошла ошибка при получении файла: {str(e)}"
         )
         return
 
-    await update.message.reply_text("Идет обработка данных, пожалуйста, подождите...")
+    status = await update.message.reply_text(PROCESSING_MESSAGE)
+
+    async def show_position(position: int) -> None:
+        await status.edit_text(QUEUE_POSITION_MESSAGE.format(position) if position else PROCESSING_MESSAGE)
 
     user_name = update.message.from_user.username or update.message.from_user.full_name
     current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    file_content = await file.download_as_bytearray()
-    upload_path = save_file(user_name, file_content, "pdf", "upload", current_time)
+    with metrics.time("download"):
+        file_content = bytes(await file.download_as_bytearray())
+
+    pool: ProcessingPool = context.bot_data["processing_pool"]
+    cache: ResultCache = context.bot_data["result_cache"]
+    key = cache_key(file_content, pool.renderer_version)
 
     try:
-        with pdfplumber.open(upload_path) as pdf:
-            all_data, analysis_name = extract_data_from_all_pages(pdf)
+        result = cache.get(key)
+        if result is not None:
+            metrics.inc("result_cache_hits")
+            logging.info(f"Result cache hit for {key}: {cache.stats()}")
+        else:
+            result = await get_scheduler(context).run(
+                user_name, lambda: timed(metrics, "parse", pool.parse_report(file_content)), show_position
+            )
+            metrics.inc("rows_parsed", len(result.rows))
+            metrics.inc("pages_parsed", result.pages)
+            logging.info(f"{len(result.rows)} rows parsed for analysis {result.analysis_name}")
+            cache.put(key, result)
 
-        df_all = create_dataframe(all_data)
-        logging.info(f"DataFrame created: {df_all.to_string()}")
+        store = get_store(context)
+        if store is not None:
+            save_file_in_background(store, user_name, current_time, "upload", "pdf", file_content, metrics)
 
-        if df_all.empty:
+        if not result.rows:
+            metrics.inc("job_failures", kind="upload", reason="no_rows")
             logging.error("Нет данных в PDF файле")
             await update.message.reply_text("Нет данных в PDF файле.")
             return
 
-        output_png_path = save_file(user_name, b"", "png", "output", current_time)
-        output_pdf_path = save_file(user_name, b"", "pdf", "output", current_time)
-        plot_scales_with_adjusted_ref_labels_spacing(
-            df_all,
-            analysis_name,
-            save_path_png=output_png_path,
-            save_path_pdf=output_pdf_path,
+        jobs = get_job_index(context)
+        job_id = jobs.add(user_name, current_time, key)
+        jobs.set_rows(key, result.analysis_name, result.rows)
+        history = get_history(context)
+        report_date = result.report_date or current_time[:10]
+        await asyncio.to_thread(
+            history.add_report, user_name, report_date, result.rows, key, not result.report_date
         )
-
-        logging.info(f"Файлы сохранены как {output_png_path} и {output_pdf_path}")
+        report_dates = await asyncio.to_thread(history.report_dates, user_name)
 
         keyboard = [
             [
                 InlineKeyboardButton(
                     "Скачать PNG",
-                    callback_data=f"download_png_{user_name}_{current_time}",
+                    callback_data=f"download_png_{job_id}",
                 )
             ],
             [
                 InlineKeyboardButton(
                     "Скачать PDF",
-                    callback_data=f"download_pdf_{user_name}_{current_time}",
+                    callback_data=f"download_pdf_{job_id}",
                 )
             ],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
+        profile = get_profile(result.profile)
+        report = f"{profile.lab}, {result.analysis_name or profile.panel}. " if profile else ""
+        hint = f"\n{TRENDS_HINT}" if len(report_dates) >= TRENDS_MIN_REPORTS else ""
         await update.message.reply_text(
-            "Выберите формат для скачивания:", reply_markup=reply_markup
+            f"{report}Выберите формат для скачивания:{hint}", reply_markup=reply_markup
+        )
+    except JobRejected as e:
+        metrics.inc("job_failures", kind="upload", reason="rejected")
+        await update.message.reply_text(str(e))
+    except PipelineError as e:
+        metrics.inc("job_failures", kind="upload", reason=type(e).__name__)
+        logging.error(f"Processing pipeline failed: {e}")
+        await update.message.reply_text(
+            f"Произошла ошибка при обработке файла: {str(e)}"
         )
     except Exception as e:
+        metrics.inc("job_failures", kind="upload", reason="error")
         logging.error("An error occurred while processing the file.", exc_info=True)
         await update.message.reply_text(
             f"Произошла ошибка при обработке файла: {str(e)}"
         )
 
 
+def read_stored_pages(store: ArtifactStore, user_name: str, timestamp: str, extension: str) -> List[Tuple[str, bytes]]:
+    """Return every stored page of an export as ``(key, content)``, see ``pipeline.page_format``."""
+    pages = []
+    while True:
+        key = page_format(extension, len(pages) + 1)
+        content = store.get(user_name, timestamp, "output", key)
+        if content is None:
+            return pages
+        pages.append((key, content))
+
+
+async def load_output(context: CallbackContext, job: Job, extension: str) -> List[Tuple[str, bytes]]:
+    """Return the pages of the PNG or PDF export of a processed file, rendering it on first request.
+
+    Each page is a ``(key, content)`` pair; only long reports split into
+    pages have more than one PNG. The result cache is checked first, then
+    the outputs in the artifact store. Otherwise the chart is rendered from
+    the rows saved in the job index, or as a last resort from the upload
+    kept in the store, parsed again.
+    """
+    cache: Optional[ResultCache] = context.bot_data.get("result_cache")
+    pool: ProcessingPool = context.bot_data.get("processing_pool")
+    scheduler = get_scheduler(context)
+    metrics = get_metrics(context)
+    user_name, timestamp, key = job
+    result = cache.peek(key) if cache is not None and key else None
+    store = get_store(context)
+
+    if result is None and store is not None:
+        pages = await asyncio.to_thread(read_stored_pages, store, user_name, timestamp, extension)
+        if pages:
+            logging.info(f"{timestamp}.{extension} of {user_name} read from the artifact store")
+            return pages
+
+    if result is None:
+        saved = get_job_index(context).rows(key) if key else None
+        if saved is not None:
+            logging.info(f"Rows of {timestamp} read from the job index")
+            analysis_name, rows = saved
+            result = ConversionResult(rows, analysis_name)
+        else:
+            if store is None:
+                raise FileNotFoundError(f"{timestamp}.{extension}")
+            content = await asyncio.to_thread(store.get, user_name, timestamp, "upload", "pdf")
+            if content is None:
+                raise FileNotFoundError(f"{timestamp}.pdf")
+            key = cache_key(content, pool.renderer_version)
+            result = await scheduler.run(user_name, lambda: timed(metrics, "parse", pool.parse_report(content)))
+        if cache is not None:
+            cache.put(key, result)
+
+    if extension not in result.outputs:
+        logging.info(f"Rendering {extension} for {timestamp}")
+        outputs = await scheduler.run(
+            user_name,
+            lambda: timed(metrics, "render", pool.render_report(result.rows, result.analysis_name, [extension])),
+        )
+        result.outputs.update(outputs)
+        if cache is not None:
+            cache.put(key, result)
+        if store is not None:
+            for page_key, output in outputs.items():
+                save_file_in_background(store, user_name, timestamp, "output", page_key, output, metrics)
+    return [(page_key, result.outputs[page_key]) for page_key in output_pages(result.outputs, extension)]
+
+
+def cached_file_ids(jobs: JobIndex, result_key: str, extension: str) -> List[str]:
+    """Telegram file IDs of all pages of an export, empty unless every page was sent before.
+
+    The first page is recorded last, see ``_handle_download``.
+    """
+    file_ids: List[str] = []
+    while True:
+        file_id = jobs.file_id(result_key, page_format(extension, len(file_ids) + 1))
+        if file_id is None:
+            return file_ids
+        file_ids.append(file_id)
+
+
+async def send_cached_document(context: CallbackContext, chat_id: int, file_id: str, metrics: Metrics) -> bool:
+    """Send a document Telegram already has by its ``file_id``. Return False if Telegram no longer knows it."""
+    try:
+        with metrics.time("send_cached_document"):
+            await context.bot.send_document(chat_id=chat_id, document=file_id)
+    except BadRequest as e:
+        logging.warning(f"Cached file_id was rejected, sending the file again: {e}")
+        return False
+    return True
+
+
 async def handle_download(update: Update, context: CallbackContext) -> None:
+    metrics = get_metrics(context)
+    metrics.inc("jobs", kind="download")
+    with metrics.time("handle_download"):
+        await _handle_download(update, context, metrics)
+
+
+async def _handle_download(update: Update, context: CallbackContext, metrics: Metrics) -> None:
     query = update.callback_query
     await query.answer()
-    data = query.data.split("_")
-    action = data[1]
-    user_name = data[2]
-    timestamp = "_".join(data[3:])
-    logging.info(f"Действие {action}, user_name {user_name}, timestamp {timestamp}")
+    _, action, job_id = query.data.split("_", 2)
+    jobs = get_job_index(context)
+    job = jobs.get(job_id)
+    logging.info(f"Действие {action}, job {job_id}: {job}")
+    if job is None:
+        metrics.inc("job_failures", kind="download", reason="unknown_job")
+        await query.message.reply_text("Результат не найден. Пожалуйста, отправьте файл снова.")
+        return
 
-    folder_path = os.path.join("files", user_name, "output", timestamp)
+    file_name = f"{job.timestamp}.{action}"
+    chat_id = query.message.chat_id
 
     try:
-        if action == "png":
-            file_path = os.path.join(folder_path, f"{timestamp}.png")
-            logging.info(f"{file_path} запрошен")
-            await context.bot.send_document(
-                chat_id=query.message.chat_id, document=open(file_path, "rb")
-            )
-        elif action == "pdf":
-            file_path = os.path.join(folder_path, f"{timestamp}.pdf")
-            logging.info(f"{file_path} запрошен")
-            await context.bot.send_document(
-                chat_id=query.message.chat_id, document=open(file_path, "rb")
-            )
+        file_ids = cached_file_ids(jobs, job.result_key, action) if job.result_key else []
+        sent = bool(file_ids)
+        for file_id in file_ids:
+            if not await send_cached_document(context, chat_id, file_id, metrics):
+                sent = False
+                break
+        if sent:
+            metrics.inc("file_id_cache_hits")
+        else:
+            for page in range(1, len(file_ids) + 1):
+                jobs.forget_file_id(job.result_key, page_format(action, page))
+            pages = await load_output(context, job, action)
+            sent_ids = []
+            for page_key, document in pages:
+                with metrics.time("send_document"):
+                    message = await context.bot.send_document(
+                        chat_id=chat_id, document=document, filename=f"{job.timestamp}.{page_key}"
+                    )
+                if message.document is not None:
+                    sent_ids.append((page_key, message.document.file_id))
+            # The first page goes in last, so it marks an export whose pages were all sent.
+            if job.result_key and len(sent_ids) == len(pages):
+                for page_key, file_id in reversed(sent_ids):
+                    jobs.set_file_id(job.result_key, page_key, file_id)
         await query.message.reply_text(
             "Вы можете загрузить следующий файл для обработки."
         )
+    except JobRejected as e:
+        metrics.inc("job_failures", kind="download", reason="rejected")
+        await query.message.reply_text(str(e))
     except FileNotFoundError:
-        logging.error(f"File {file_path} not found", exc_info=True)
-        await query.message.reply_text(f"Файл {file_path} не найден.")
+        metrics.inc("job_failures", kind="download", reason="not_found")
+        logging.error(f"File {file_name} not found", exc_info=True)
+        await query.message.reply_text(f"Файл {file_name} не найден.")
+    except PipelineError as e:
+        metrics.inc("job_failures", kind="download", reason=type(e).__name__)
+        logging.error(f"Rendering {file_name} failed: {e}")
+        await query.message.reply_text(
+            f"Произошла ошибка при подготовке документа: {str(e)}"
+        )
     except Exception as e:
+        metrics.inc("job_failures", kind="download", reason="error")
         logging.error("An error occurred while sending the document.", exc_info=True)
         await query.message.reply_text(
             f"Произошла ошибка при отправке документа: {str(e)}"
         )
 
 
+async def handle_trends(update: Update, context: CallbackContext) -> None:
+    metrics = get_metrics(context)
+    metrics.inc("jobs", kind="trends")
+    with metrics.time("handle_trends"):
+        await _handle_trends(update, context, metrics)
+
+
+async def _handle_trends(update: Update, context: CallbackContext, metrics: Metrics) -> None:
+    """Send trend charts of the analytes found in at least two reports of the user.
+
+    Charts are built from the analyte history, so earlier reports are not
+    parsed again. A chart is rendered once per history revision and filter;
+    after that Telegram's ``file_id`` is sent until a new report arrives.
+    """
+    user_name = update.message.from_user.username or update.message.from_user.full_name
+    analyte = " ".join(context.args or [])
+    logging.info(f"Команда /trends вызвана, фильтр: {analyte!r}")
+    history = get_history(context)
+    series = await asyncio.to_thread(history.series, user_name, analyte, TRENDS_MIN_REPORTS)
+    if not series:
+        await update.message.reply_text(
+            "Для графика динамики нужны хотя бы два отчета с одинаковыми показателями. "
+            "Загрузите еще один PDF файл с результатами анализов."
+        )
+        return
+
+    jobs = get_job_index(context)
+    chat_id = update.message.chat_id
+    chart_key = f"trends:{user_name}:{history.revision(user_name)}:{analyte.casefold()}"
+    try:
+        file_id = jobs.file_id(chart_key, "png")
+        if file_id is not None and await send_cached_document(context, chat_id, file_id, metrics):
+            metrics.inc("file_id_cache_hits")
+            return
+        pool: ProcessingPool = context.bot_data["processing_pool"]
+        outputs = await get_scheduler(context).run(
+            user_name, lambda: timed(metrics, "render_trends", pool.render_trends(series))
+        )
+        with metrics.time("send_document"):
+            message = await context.bot.send_document(
+                chat_id=chat_id, document=outputs["png"], filename=f"trends_{user_name}.png"
+            )
+        if message.document is not None:
+            jobs.set_file_id(chart_key, "png", message.document.file_id)
+    except JobRejected as e:
+        metrics.inc("job_failures", kind="trends", reason="rejected")
+        await update.message.reply_text(str(e))
+    except PipelineError as e:
+        metrics.inc("job_failures", kind="trends", reason=type(e).__name__)
+        logging.error(f"Rendering trends failed: {e}")
+        await update.message.reply_text(f"Произошла ошибка при построении графиков: {str(e)}")
+    except Exception as e:
+        metrics.inc("job_failures", kind="trends", reason="error")
+        logging.error("An error occurred while sending the trends.", exc_info=True)
+        await update.message.reply_text(f"Произошла ошибка при построении графиков: {str(e)}")
+
+
 async def handle_non_pdf(update: Update, context: CallbackContext) -> None:
     logging.info("Получен файл не в формате PDF")
     await update.message.reply_text("Принимаются только файлы в формате PDF.")
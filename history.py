@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pdf_processing import ResultRow
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    user TEXT NOT NULL,
+    analyte TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    value REAL NOT NULL,
+    ref_min REAL,
+    ref_max REAL,
+    result_key TEXT NOT NULL,
+    -- The report date, or the result key of a report that gives no date.
+    report_id TEXT NOT NULL,
+    PRIMARY KEY (user, analyte, unit, report_id)
+);
+CREATE INDEX IF NOT EXISTS results_user_date ON results (user, report_date);
+"""
+# Histories written before undated reports were keyed by their result key.
+MIGRATE_REPORT_ID = f"""
+BEGIN;
+ALTER TABLE results RENAME TO results_old;
+DROP INDEX results_user_date;
+{SCHEMA}
+INSERT INTO results SELECT *, report_date FROM results_old;
+DROP TABLE results_old;
+COMMIT;
+"""
+
+
+class TrendPoint(NamedTuple):
+    report_date: str
+    value: float
+    ref_min: Optional[float]
+    ref_max: Optional[float]
+
+
+Series = Dict[Tuple[str, str], List[TrendPoint]]
+
+
+class AnalyteHistory:
+    """Parsed results of every report a user uploaded, keyed by analyte, unit and report date.
+
+    Each upload adds its rows once, so trend charts are built from the index
+    alone and old PDFs are never parsed again. Uploading the same report
+    twice replaces its rows instead of duplicating them. Reports without a
+    sample date are filed under their upload date but keyed by their result
+    key, so two of them uploaded on the same day are both kept.
+
+    With ``path`` the history is kept in SQLite on disk, otherwise in memory.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        if "report_id" not in [column[1] for column in self._db.execute("PRAGMA table_info(results)")]:
+            self._db.executescript(MIGRATE_REPORT_ID)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def add_report(
+        self, user: str, report_date: str, rows: Sequence[ResultRow], result_key: str, undated: bool = False
+    ) -> None:
+        """Add the rows of a report; ``undated`` means ``report_date`` is only the upload date.
+
+        Either all rows are added or none: on an error the transaction is rolled back.
+        """
+        report_id = result_key if undated else report_date
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(user, name, unit or "", report_date, value, ref_min, ref_max, result_key, report_id)
+                     for name, value, ref_min, ref_max, unit in rows],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+
+    def revision(self, user: str) -> int:
+        """Return a number that changes whenever rows of ``user`` are added or replaced."""
+        with self._lock:
+            row = self._db.execute("SELECT COALESCE(MAX(rowid), 0) FROM results WHERE user = ?", (user,)).fetchone()
+        return row[0]
+
+    def report_dates(self, user: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT report_date FROM results WHERE user = ? ORDER BY report_date", (user,)
+            ).fetchall()
+        return [report_date for report_date, in rows]
+
+    def series(self, user: str, analyte: str = "", min_points: int = 1) -> Series:
+        """Return the values of each analyte by report date, oldest first.
+
+        ``analyte`` keeps only analytes whose name contains it, ignoring case.
+        Analytes with fewer than ``min_points`` reports are left out.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT analyte, unit, report_date, value, ref_min, ref_max FROM results "
+                "WHERE user = ? ORDER BY analyte, unit, report_date, rowid",
+                (user,),
+            ).fetchall()
+        series: Series = {}
+        needle = analyte.casefold()
+        for name, unit, report_date, value, ref_min, ref_max in rows:
+            if needle in name.casefold():
+                series.setdefault((name, unit), []).append(TrendPoint(report_date, value, ref_min, ref_max))
+        return {key: points for key, points in series.items() if len(points) >= min_points}
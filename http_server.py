@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+DEFAULT_KEEP_ALIVE_TIMEOUT = 15.0
+# Long enough for a 10 MB upload at about 35 KB/s.
+DEFAULT_BODY_TIMEOUT = 300.0
+MAX_HEADER_SIZE = 16 * 1024
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    411: "Length Required",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    422: "Unprocessable Entity",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, list]
+    headers: Dict[str, str]
+    body: bytes
+
+
+class Response(NamedTuple):
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: Dict[str, str] = {}
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = "") -> None:
+        super().__init__(message or REASONS.get(status, ""))
+        self.status = status
+
+
+class HTTPServer:
+    """A small asyncio HTTP/1.1 server for the bot's local endpoints.
+
+    Routes map ``(method, path)`` to an async handler. Requests need a
+    ``Content-Length`` body of at most ``max_body_size`` bytes; larger ones are
+    rejected from the headers alone. Connections are kept alive between
+    requests until ``keep_alive_timeout`` seconds pass without the head of a
+    new request. Its body then has ``body_timeout`` seconds to arrive, or the
+    request is answered with 408.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[Tuple[str, str], Handler],
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+        keep_alive_timeout: float = DEFAULT_KEEP_ALIVE_TIMEOUT,
+        body_timeout: float = DEFAULT_BODY_TIMEOUT,
+    ) -> None:
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.keep_alive_timeout = keep_alive_timeout
+        self.body_timeout = body_timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set["asyncio.Task[None]"] = set()
+        self._busy: Set["asyncio.Task[None]"] = set()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=MAX_HEADER_SIZE
+        )
+        # Report the real port when an ephemeral one was requested.
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self, drain_timeout: float = 0.0) -> None:
+        """Stop accepting connections, give running requests ``drain_timeout`` seconds, then close the rest."""
+        if self._server is None:
+            return
+        self._server.close()
+        if drain_timeout and self._busy:
+            await asyncio.wait(set(self._busy), timeout=drain_timeout)
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as e:
+                    await self._write(writer, Response(e.status, str(e).encode()), keep_alive=False)
+                    break
+                if request is None:
+                    break
+                self._busy.add(task)
+                try:
+                    response = await self._dispatch(request)
+                finally:
+                    self._busy.discard(task)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keep_alive_timeout)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, "Headers too large")
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(411)
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPError(400, "Bad Content-Length")
+        if length > self.max_body_size:
+            raise HTTPError(413, f"The body must not exceed {self.max_body_size} bytes")
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), self.body_timeout) if length else b""
+        except asyncio.TimeoutError:
+            raise HTTPError(408, f"The body did not arrive within {self.body_timeout:g} s")
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                return Response(405, b"Method Not Allowed")
+            return Response(404, b"Not Found")
+        try:
+            return await handler(request)
+        except HTTPError as e:
+            return Response(e.status, str(e).encode())
+        except Exception:
+            logging.error(f"{request.method} {request.path} failed", exc_info=True)
+            return Response(500, b"Internal Server Error")
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+        writer.write(head.encode("latin-1") + response.body)
+        await writer.drain()
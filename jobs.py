@@ -0,0 +1,137 @@
+import json
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from pdf_processing import ResultRow
+
+JOB_ID_BYTES = 6
+DEFAULT_JOB_TTL = 30 * 24 * 3600
+# Callback data of buttons sent before job IDs: download_<format>_<user>_<timestamp>.
+LEGACY_JOB = re.compile(r"^(?P<user>.+)_(?P<timestamp>\d{4}-\d\d-\d\d_\d\d-\d\d-\d\d)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    result_key TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE TABLE IF NOT EXISTS telegram_files (
+    result_key TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (result_key, extension)
+);
+CREATE TABLE IF NOT EXISTS parsed_reports (
+    result_key TEXT PRIMARY KEY,
+    analysis_name TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+class Job(NamedTuple):
+    """An upload whose outputs can be downloaded.
+
+    ``timestamp`` names the files in the artifact store and ``result_key`` is
+    the ``cache_key`` of the upload, None for jobs from before the index.
+    """
+
+    user: str
+    timestamp: str
+    result_key: Optional[str]
+
+
+class JobIndex:
+    """Short opaque job IDs for callback data, and Telegram file IDs of sent outputs.
+
+    Telegram allows 64 bytes of callback data, so buttons carry a random ID
+    instead of the user name and timestamp. Once an output has been sent, its
+    ``file_id`` is remembered by result key and format, and sending it again
+    does not upload any bytes. The parsed rows of every report are kept as
+    well, so its charts can be rendered again when neither the result cache
+    nor the artifact store has them. Entries expire after ``ttl`` seconds.
+
+    With ``path`` the index is kept in SQLite on disk and survives restarts,
+    otherwise in memory. Queries are small lookups by primary key, so they
+    run directly on the event loop.
+    """
+
+    def __init__(self, path: str = ":memory:", ttl: float = DEFAULT_JOB_TTL) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def add(self, user: str, timestamp: str, result_key: str, now: Optional[float] = None) -> str:
+        """Register a job and return its ID. Expired entries are dropped on the way."""
+        now = time.time() if now is None else now
+        job_id = secrets.token_urlsafe(JOB_ID_BYTES)
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE created < ?", (now - self.ttl,))
+            self._db.execute("DELETE FROM telegram_files WHERE created < ?", (now - self.ttl,))
+            self._db.execute("DELETE FROM parsed_reports WHERE created < ?", (now - self.ttl,))
+            self._db.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?)", (job_id, user, timestamp, result_key, now))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT user, timestamp, result_key FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None:
+            return Job(*row)
+        legacy = LEGACY_JOB.match(job_id)
+        return Job(legacy["user"], legacy["timestamp"], None) if legacy else None
+
+    def file_id(self, result_key: str, extension: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id FROM telegram_files WHERE result_key = ? AND extension = ?", (result_key, extension)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_file_id(self, result_key: str, extension: str, file_id: str, now: Optional[float] = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO telegram_files VALUES (?, ?, ?, ?)",
+                (result_key, extension, file_id, time.time() if now is None else now),
+            )
+
+    def forget_file_id(self, result_key: str, extension: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM telegram_files WHERE result_key = ? AND extension = ?", (result_key, extension)
+            )
+
+    def set_rows(
+        self, result_key: str, analysis_name: str, rows: Sequence[ResultRow], now: Optional[float] = None
+    ) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO parsed_reports VALUES (?, ?, ?, ?)",
+                (result_key, analysis_name, json.dumps(rows, ensure_ascii=False), time.time() if now is None else now),
+            )
+
+    def rows(self, result_key: str) -> Optional[Tuple[str, List[ResultRow]]]:
+        """Return the analysis name and rows saved for ``result_key`` with ``set_rows``, if any."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT analysis_name, rows FROM parsed_reports WHERE result_key = ?", (result_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], [ResultRow(*values) for values in json.loads(row[1])]
@@ -0,0 +1,191 @@
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pdf_processing import ResultRow
+
+MAX_WORDS_PER_HEADER_LINE = 8
+FIGURE_WIDTH = 10
+FIGURE_HEIGHT_PER_PLOT = 0.5
+
+
+def split_title(title: str, max_words_per_line: int = MAX_WORDS_PER_HEADER_LINE) -> str:
+    """Split title into multiple lines if it exceeds the max number of words per line."""
+    title_lines = title.split(" ")
+    title_lines = [
+        " ".join(title_lines[i : i + max_words_per_line])
+        for i in range(0, len(title_lines), max_words_per_line)
+    ]
+    return "\n".join(title_lines)
+
+
+def build_gradient(width: int = 500) -> np.ndarray:
+    """Build the violet-blue-green-yellow-red bar gradient as a 1 x width RGB image."""
+    step = width // 5
+    gradient = np.zeros((1, width, 3))
+    ramp_up = np.linspace(0, 1, step)
+    ramp_down = np.linspace(1, 0, step)
+    gradient[0, 0:step, 0] = np.linspace(0.5, 0, step)
+    gradient[0, 0:step, 2] = 1
+    gradient[0, step : 2 * step, 1] = ramp_up
+    gradient[0, step : 2 * step, 2] = 1
+    gradient[0, 2 * step : 3 * step, 1] = 1
+    gradient[0, 2 * step : 3 * step, 2] = ramp_down
+    gradient[0, 3 * step : 4 * step, 0] = ramp_up
+    gradient[0, 3 * step : 4 * step, 1] = 1
+    gradient[0, 4 * step : 5 * step, 0] = 1
+    gradient[0, 4 * step : 5 * step, 1] = ramp_down
+    return gradient
+
+
+GRADIENT = build_gradient()
+# Colors where the five linear segments of ``GRADIENT`` begin and end, at 0, 0.2, ..., 1 of its width.
+GRADIENT_STOPS = np.vstack([GRADIENT[0, :: GRADIENT.shape[1] // 5], GRADIENT[0, -1:]])
+
+
+def scale_limits(value: float, ref_min: float, ref_max: float) -> Tuple[float, float]:
+    """Return the x range of a bar: the reference interval and the value plus 20% margins."""
+    scale_min = min(ref_min - 0.2 * (ref_max - ref_min), value - 0.2 * abs(value - ref_min))
+    scale_max = max(ref_max + 0.2 * (ref_max - ref_min), value + 0.2 * abs(value - ref_max))
+    if scale_max <= scale_min:
+        scale_min, scale_max = scale_min - 0.5, scale_max + 0.5
+    return scale_min, scale_max
+
+
+class ReportLayout(NamedTuple):
+    """Precomputed positions of a report, in figure fractions."""
+
+    name_x: float
+    value_x: float
+    unit_x: float
+    bar_x0: float
+    bar_x1: float
+    row_bottoms: List[float]
+    row_height: float
+
+
+class ReportTexts(NamedTuple):
+    """What ``compute_layout`` needs to know about the texts of a report.
+
+    Widths of the widest name, value and unit in inches, and which rows have
+    reference values printed under their bar.
+    """
+
+    name_width: float = 0.0
+    value_width: float = 0.0
+    unit_width: float = 0.0
+    labelled_rows: Tuple[bool, ...] = ()
+
+
+# Font sizes of the name, value and unit columns, in points.
+NAME_FONT_SIZE = 8
+VALUE_FONT_SIZE = 10
+UNIT_FONT_SIZE = 8
+# The legacy chart puts a name, a value and a bar axes in each row of a
+# gridspec with these width ratios, and places the texts at these fractions
+# of the width of their axes.
+WIDTH_RATIOS = (1, 0.5, 4)
+NAME_X = 0.1
+VALUE_X = 0.5
+UNIT_X = 1.7
+# Padding tight_layout adds around and between axes: 1.08 font sizes of 10 points, in inches.
+TIGHT_PAD = 1.08 * 10 / 72
+# Row spacing that tight_layout used to settle on, in inches. Below a row
+# with reference values it leaves room for them, below others only the padding.
+TIGHT_TOP_MARGIN = 0.5
+TIGHT_LABELLED_ROW_GAP = 0.345
+TITLE_HEIGHT_FRACTION = 0.04
+MIN_ROW_HEIGHT = 0.01
+# Matplotlib's default subplot parameters. tight_layout measures the texts
+# with the axes placed by them, and they are kept for reports it gives up on.
+DEFAULT_LEFT = 0.125
+DEFAULT_RIGHT = 0.9
+DEFAULT_WSPACE = 0.2
+DEFAULT_TOP = 0.88
+DEFAULT_BOTTOM = 0.11
+DEFAULT_HSPACE = 0.2
+
+
+def has_bar(row: ResultRow) -> bool:
+    """Whether a row is drawn as a bar with its reference values, rather than with a message."""
+    ref_min, ref_max = row[2], row[3]
+    return ref_min is not None and ref_max is not None and not (ref_min == 0.0 and ref_max == 0.0)
+
+
+def measure_texts(rows: Sequence[ResultRow], text_width: Callable[[str, float], float]) -> ReportTexts:
+    """Measure the texts of a report with ``text_width(text, points)``, which returns inches."""
+    return ReportTexts(
+        name_width=max((text_width(row[0], NAME_FONT_SIZE) for row in rows), default=0.0),
+        value_width=max((text_width(f"{row[1]:.5g}", VALUE_FONT_SIZE) for row in rows), default=0.0),
+        unit_width=max((text_width(f"{row[4]}", UNIT_FONT_SIZE) for row in rows if row[4]), default=0.0),
+        labelled_rows=tuple(has_bar(row) for row in rows),
+    )
+
+
+def grid_columns(left: float, right: float, wspace: float) -> List[Tuple[float, float]]:
+    """Left edge and width of each gridspec column, like ``GridSpec.get_grid_positions``."""
+    cell_width = (right - left) / (len(WIDTH_RATIOS) + wspace * (len(WIDTH_RATIOS) - 1))
+    norm = cell_width * len(WIDTH_RATIOS) / sum(WIDTH_RATIOS)
+    columns = []
+    x = left
+    for ratio in WIDTH_RATIOS:
+        columns.append((x, ratio * norm))
+        x += ratio * norm + wspace * cell_width
+    return columns
+
+
+def tight_columns(texts: ReportTexts) -> Optional[List[Tuple[float, float]]]:
+    """Columns as tight_layout would place them, or None where it would give up.
+
+    Like tight_layout, the texts are measured once with the default subplot
+    parameters. The space between columns is then widened by the furthest a
+    name, value or unit reaches past the right edge of its axes.
+    """
+    (name_x0, name_width), (value_x0, value_width), _ = grid_columns(DEFAULT_LEFT, DEFAULT_RIGHT, DEFAULT_WSPACE)
+    name_overhang = name_x0 + NAME_X * name_width + texts.name_width / FIGURE_WIDTH - (name_x0 + name_width)
+    value_right = value_x0 + VALUE_X * value_width + texts.value_width / FIGURE_WIDTH
+    if texts.unit_width:
+        value_right = max(value_right, value_x0 + UNIT_X * value_width + texts.unit_width / FIGURE_WIDTH)
+    value_overhang = value_right - (value_x0 + value_width)
+    pad = TIGHT_PAD / FIGURE_WIDTH
+    gap = max(name_overhang, value_overhang, 0.0) + pad
+    axes_width = (1 - 2 * pad - (len(WIDTH_RATIOS) - 1) * gap) / len(WIDTH_RATIOS)
+    if axes_width <= 0:
+        return None
+    return grid_columns(pad, 1 - pad, gap / axes_width)
+
+
+def compute_layout(num_rows: int, figure_height: float, texts: ReportTexts = ReportTexts()) -> ReportLayout:
+    """Lay out ``num_rows`` rows on a figure ``figure_height`` inches tall without tight_layout.
+
+    ``texts`` describes the report, see ``measure_texts``. Long names and
+    units push the value and bar columns to the right, and rows are spaced
+    further apart when reference values are printed between them. Without
+    ``labelled_rows`` every row is taken to have reference values.
+    """
+    labelled_rows = texts.labelled_rows or (True,) * num_rows
+    row_gap = TIGHT_LABELLED_ROW_GAP if any(labelled_rows[:-1]) else TIGHT_PAD
+    bottom_margin = TIGHT_LABELLED_ROW_GAP if labelled_rows[-1] else TIGHT_PAD
+    available = (1 - TITLE_HEIGHT_FRACTION) * figure_height - TIGHT_TOP_MARGIN - bottom_margin
+    row_height = (available - (num_rows - 1) * row_gap) / num_rows
+    columns = tight_columns(texts)
+    if row_height >= MIN_ROW_HEIGHT and columns is not None:
+        bottom = bottom_margin / figure_height
+        pitch = (row_height + row_gap) / figure_height
+        row_height /= figure_height
+    else:
+        columns = grid_columns(DEFAULT_LEFT, DEFAULT_RIGHT, DEFAULT_WSPACE)
+        row_height = (DEFAULT_TOP - DEFAULT_BOTTOM) / (num_rows + DEFAULT_HSPACE * (num_rows - 1))
+        bottom = DEFAULT_BOTTOM
+        pitch = row_height * (1 + DEFAULT_HSPACE)
+    (name_x0, name_width), (value_x0, value_width), (bar_x0, bar_width) = columns
+    row_bottoms = [bottom + (num_rows - 1 - i) * pitch for i in range(num_rows)]
+    return ReportLayout(
+        name_x=name_x0 + NAME_X * name_width,
+        value_x=value_x0 + VALUE_X * value_width,
+        unit_x=value_x0 + UNIT_X * value_width,
+        bar_x0=bar_x0,
+        bar_x1=bar_x0 + bar_width,
+        row_bottoms=row_bottoms,
+        row_height=row_height,
+    )
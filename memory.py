@@ -0,0 +1,62 @@
+import os
+import tracemalloc
+from typing import NamedTuple, Optional
+
+MB = 1024 * 1024
+
+
+class JobMemory(NamedTuple):
+    """Memory of the worker process that ran a job, in bytes.
+
+    ``rss`` is the resident set size once the job finished and ``rss_delta``
+    how much it grew during the job. ``traced_peak`` is the most Python
+    allocations took above their level at the start of the job, or None
+    when tracemalloc is not running.
+    """
+
+    pid: int
+    rss: int
+    rss_delta: int
+    traced_peak: Optional[int] = None
+
+    def describe(self) -> str:
+        text = f"RSS {self.rss / MB:.0f} MB ({self.rss_delta / MB:+.1f} MB)"
+        if self.traced_peak is not None:
+            text += f", Python allocations peaked at +{self.traced_peak / MB:.1f} MB"
+        return text
+
+
+def current_rss() -> int:
+    """Return the resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        # Without /proc only the peak is available, in kilobytes on Linux and bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class MemoryWatch:
+    """Measure how much memory the current process takes over a job.
+
+    Start it before the job and call ``stop`` after it. Python allocations
+    are only traced after ``tracemalloc.start()``, which slows them down,
+    so that is left to the caller.
+    """
+
+    def __init__(self) -> None:
+        self.rss = current_rss()
+        self.traced: Optional[int] = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.traced = tracemalloc.get_traced_memory()[0]
+
+    def stop(self) -> JobMemory:
+        rss = current_rss()
+        traced_peak = None
+        if self.traced is not None and tracemalloc.is_tracing():
+            traced_peak = tracemalloc.get_traced_memory()[1] - self.traced
+        return JobMemory(os.getpid(), rss, rss - self.rss, traced_peak)
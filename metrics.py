@@ -0,0 +1,145 @@
+import bisect
+import contextlib
+import math
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from http_server import HTTPServer, Request, Response
+
+# Upper bounds in seconds: Telegram calls take tens of milliseconds, parsing
+# and rendering a long report up to tens of seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PREFIX = "bot"
+DEFAULT_METRICS_PORT = 9108
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{escape_label(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    """Format a sample value exactly: integers without a fraction, other floats with every digit."""
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed bucket bounds, like a Prometheus histogram."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # The last count is for values above every bound, the "+Inf" bucket.
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, labels: Labels) -> List[str]:
+        lines = []
+        cumulative = 0
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for bound, bucket_count in zip(bounds, self.bucket_counts):
+            cumulative += bucket_count
+            le = f'le="{bound}"'
+            lines.append(f"{name}_bucket{format_labels(labels, le)} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum:.6f}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+
+class Metrics:
+    """Stage latency histograms and event counters of the bot.
+
+    Everything runs on the event loop, so no locking is needed. ``render``
+    produces the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.stages: Dict[Labels, Histogram] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        labels = (("stage", stage),)
+        histogram = self.stages.get(labels)
+        if histogram is None:
+            histogram = self.stages[labels] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def observe_all(self, timings: Dict[str, float]) -> None:
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Observe how long the block took, whether or not it raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self.counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def add_gauge(self, name: str, read: Callable[[], float]) -> None:
+        """Report the current value of ``read()`` on every scrape."""
+        self.gauges[name] = read
+
+    def histogram(self, stage: str) -> Optional[Histogram]:
+        return self.stages.get((("stage", stage),))
+
+    def render(self) -> str:
+        name = f"{METRICS_PREFIX}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of handling uploads and downloads.",
+            f"# TYPE {name} histogram",
+        ]
+        for labels, histogram in sorted(self.stages.items()):
+            lines.extend(histogram.render(name, labels))
+        for counter_name, series in sorted(self.counters.items()):
+            full_name = f"{METRICS_PREFIX}_{counter_name}_total"
+            lines.append(f"# TYPE {full_name} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{full_name}{format_labels(labels)} {format_value(value)}")
+        for gauge_name, read in sorted(self.gauges.items()):
+            full_name = f"{METRICS_PREFIX}_{gauge_name}"
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {format_value(read())}")
+        return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(metrics: Metrics, host: str, port: int) -> HTTPServer:
+    """Serve ``metrics`` in the Prometheus text format on ``GET /metrics``."""
+
+    async def handle_metrics(request: Request) -> Response:
+        return Response(body=metrics.render().encode(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    server = HTTPServer({("GET", "/metrics"): handle_metrics}, host, port)
+    await server.start()
+    return server
@@ -1,9 +1,54 @@
+import io
 import logging
 import re
-from typing import List, Tuple, Union
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
-import pandas as pd
-import pdfplumber
+if TYPE_CHECKING:
+    # Imported where they are used, so that the bot process, which only hands
+    # files to the workers, starts without loading them.
+    import pandas as pd
+    import pdfplumber
+    import pypdfium2 as pdfium
+
+TEXT_BACKENDS = ("pdfplumber", "pdfium")
+DEFAULT_TEXT_BACKEND = "pdfplumber"
+
+
+class ResultRow(NamedTuple):
+    """One parsed result line. Reference bounds are None when the report gives none.
+
+    Rows are plain tuples, so the renderer can read them column by column and
+    ``create_dataframe`` builds a DataFrame only for callers that want one.
+    """
+
+    name: str
+    value: float
+    ref_min: Optional[float]
+    ref_max: Optional[float]
+    unit: Optional[str]
+
+
+class ReportRegion(NamedTuple):
+    """Where the results of a report layout are and where the report ends.
+
+    ``table_bbox`` is ``(x0, top, x1, bottom)`` as fractions of the page size,
+    measured from the top left corner like pdfplumber's bounding boxes. Text
+    outside of it (lab header, patient block, footer) is not extracted.
+    ``end_marker`` starts the line after the last result of the report;
+    nothing after it is parsed and later pages are not read.
+    """
+
+    table_bbox: Tuple[float, float, float, float]
+    end_marker: str
+
+
+REPORT_REGIONS: Dict[str, ReportRegion] = {
+    # The lab and patient header takes the top ~9% of every Helix page, the
+    # legal notice and page number the bottom ~6%. The first page keeps the
+    # "Исследование (врач): ... Метод:" line, which is just below the header.
+    "helix": ReportRegion(table_bbox=(0.0, 0.095, 1.0, 0.93), end_marker="Исполнитель:"),
+}
+DEFAULT_REPORT_LAYOUT = "helix"
 
 PATTERN_GENERIC = re.compile(
     r"([A-Za-zА-Яа-яёЁ0-9\-\(\),;\.\s\/]+?)\s+(\d+.\d+)\s+(нмоль/мл|мкмоль/л|нмоль/л|ммоль/моль креат.|у.е./моль креат.|ммоль/л)?\s*([\d.]+)?\s*-\s*([\d.]+)?"  # noqa: E501
@@ -18,6 +63,41 @@ PATTERN_LESS_THAN = re.compile(
     r"([A-Za-zА-Яа-яёЁ0-9\-\(\),\.\s\/]+?)\s+(\d+.\d+)\s+(нмоль/мл|мкмоль/л|нмоль/л|ммоль/моль креат.|у.е./моль креат.|ммоль/л)?\s*<([\d.]+)?"  # noqa: E501
 )
 
+UNITS = r"(?:нмоль/мл|мкмоль/л|нмоль/л|ммоль/моль креат.|у.е./моль креат.|ммоль/л)"
+NUMBER = r"\d+(?:\.\d+)?"
+NAME_CHARS = r"A-Za-zА-Яа-яёЁ0-9\-\(\),;\.\/"
+NAME_WORD_START = r"A-Za-zА-Яа-яёЁ\-\(\),;\/"
+# Every pattern above needs a number right after whitespace, preceded only by
+# characters allowed in a name.
+PATTERN_NAME_PREFIX = re.compile(rf"[{NAME_CHARS}\s]*")
+PATTERN_NUMERIC_FIELD = re.compile(r"\s[\d.]")
+# A well-formed result line in a single scan. The name runs up to the first
+# number after whitespace; it is captured in a lookahead and then consumed by
+# a backreference, so it is never backtracked into. The value is followed by
+# an optional unit and then a reference range, an upper limit or the "no
+# reference values" note.
+PATTERN_NAME = rf"(?=(?P<name>[{NAME_CHARS}]+(?:\s+[{NAME_WORD_START}][{NAME_CHARS}]*)*))(?P=name)"
+PATTERN_RESULT_LINE = re.compile(
+    rf"{PATTERN_NAME}\s+(?P<value>\d+\.\d+)(?:\s+(?P<unit>{UNITS}))?"
+    rf"(?:(?(unit)\s*|\s+)(?P<ref_min>{NUMBER})\s*-\s*(?P<ref_max>{NUMBER})"
+    rf"|(?(unit)\s*|\s+)<(?P<less_than>{NUMBER})"
+    r"|\s+(?P<no_ref>Референсные значения не\D*))\s*$"
+)
+# Characters a name may contain in general but not on lines without a reference range.
+NAME_EXCLUDED_WITHOUT_REF = frozenset(".;/")
+
+
+PATTERN_SAMPLE_DATE = re.compile(r"Дата взятия образца:\s*(\d{2})\.(\d{2})\.(\d{4})")
+
+
+def extract_report_date(text: str) -> str:
+    """Return the sample date of a report as YYYY-MM-DD, or an empty string if it is not given."""
+    match = PATTERN_SAMPLE_DATE.search(text)
+    if match is None:
+        return ""
+    day, month, year = match.groups()
+    return f"{year}-{month}-{day}"
+
 
 def extract_analysis_name(text: str) -> str:
     if "(врач):" in text and "Метод:" in text:
@@ -27,70 +107,267 @@ def extract_analysis_name(text: str) -> str:
     return ""
 
 
+def parse_line_with_patterns(
+    line: str,
+) -> Optional[ResultRow]:
+    """Parse one line by trying each of the line patterns in turn."""
+    match = PATTERN_GENERIC.match(line)
+    if match and "Биоматериал" not in line:
+        name, value, unit, ref_min, ref_max = match.groups()
+        if ref_min and ref_max:
+            return ResultRow(name, float(value), float(ref_min), float(ref_max), unit)
+        return ResultRow(name, float(value), None, None, unit)
+    if "не обнаружено" in line:
+        parts = line.split("0.00")
+        return ResultRow(parts[0].strip(), 0.0, 0.0, 0.0, parts[1].split()[0])
+    match_no_ref = PATTERN_NO_REF.match(line)
+    if match_no_ref:
+        name, value, unit = match_no_ref.groups()[:3]
+        return ResultRow(name, float(value), None, None, unit)
+    match_ratio = PATTERN_RATIO.match(line)
+    if match_ratio:
+        name, value, ref_min, ref_max = match_ratio.groups()
+        return ResultRow(name, float(value), float(ref_min), float(ref_max), "")
+    match_less_than = PATTERN_LESS_THAN.match(line)
+    if match_less_than:
+        name, value, unit, ref_max = match_less_than.groups()
+        return ResultRow(name, float(value), 0.0, float(ref_max), unit)
+    return None
+
+
+def parse_line(
+    line: str,
+) -> Optional[ResultRow]:
+    """Parse one line of a results table, or return None if it holds no result.
+
+    Well-formed result lines are classified by a single scan of
+    ``PATTERN_RESULT_LINE``, and lines that cannot hold a number after a name
+    (headers, footers, comments) are rejected without trying any pattern. Everything else goes through
+    ``parse_line_with_patterns``, so the output is always the same as that of
+    the pattern cascade.
+    """
+    match = PATTERN_RESULT_LINE.match(line)
+    if match is None:
+        name_end = PATTERN_NAME_PREFIX.match(line).end()
+        if PATTERN_NUMERIC_FIELD.search(line, 0, name_end) is None and "не обнаружено" not in line:
+            return None
+        return parse_line_with_patterns(line)
+    if "не обнаружено" in line or "Биоматериал" in line:
+        return parse_line_with_patterns(line)
+
+    name, value, unit, ref_min, ref_max, less_than, no_ref = match.group(
+        "name", "value", "unit", "ref_min", "ref_max", "less_than", "no_ref"
+    )
+    if ref_min is not None:
+        return ResultRow(name, float(value), float(ref_min), float(ref_max), unit)
+    if less_than is not None and ";" not in name:
+        return ResultRow(name, float(value), 0.0, float(less_than), unit)
+    if no_ref is not None and unit is not None and not NAME_EXCLUDED_WITHOUT_REF.intersection(name):
+        # The pattern for lines without a reference range has a greedy name
+        # group, which keeps all but the last space before the value.
+        return ResultRow(line[: match.start("value") - 1], float(value), None, None, unit)
+    return parse_line_with_patterns(line)
+
+
 def extract_data_from_page(
     text: str,
-) -> List[Tuple[str, float, Union[float, None], Union[float, None], str]]:
-    all_data: List[Tuple[str, float, Union[float, None], Union[float, None], str]] = []
+    parse: Callable[[str], Optional[ResultRow]] = parse_line,
+) -> List[ResultRow]:
+    all_data: List[ResultRow] = []
     lines = text.split("\n")
 
     for line in lines:
-        match = PATTERN_GENERIC.match(line)
-        if match and "Биоматериал" not in line:
-            name, value, unit, ref_min, ref_max = match.groups()
-            if ref_min and ref_max:
-                all_data.append(
-                    (name, float(value), float(ref_min), float(ref_max), unit)
-                )
-            else:
-                all_data.append((name, float(value), None, None, unit))
-        elif "не обнаружено" in line:
-            parts = line.split("0.00")
-            all_data.append((parts[0].strip(), 0.0, 0.0, 0.0, parts[1].split()[0]))
+        row = parse(line)
+        if row is not None:
+            all_data.append(row)
         else:
-            match_no_ref = PATTERN_NO_REF.match(line)
-            if match_no_ref:
-                name, value, unit = match_no_ref.groups()[:3]
-                all_data.append((name, float(value), None, None, unit))
-            else:
-                match_ratio = PATTERN_RATIO.match(line)
-                if match_ratio:
-                    name, value, ref_min, ref_max = match_ratio.groups()
-                    all_data.append(
-                        (name, float(value), float(ref_min), float(ref_max), "")
-                    )
-                else:
-                    match_less_than = PATTERN_LESS_THAN.match(line)
-                    if match_less_than:
-                        name, value, unit, ref_max = match_less_than.groups()
-                        all_data.append((name, float(value), 0.0, float(ref_max), unit))
-                    else:
-                        logging.warning(f"Could not parse line: {line}")
+            logging.warning(f"Could not parse line: {line}")
 
     return all_data
 
 
+class PdfiumPage:
+    """A pypdfium2 page with the ``extract_text`` and ``crop`` methods of a pdfplumber page.
+
+    The text of the page is loaded once and shared with its crops until the
+    document is closed, so reading several regions of a page costs one load.
+    """
+
+    def __init__(
+        self,
+        pdf: "pdfium.PdfDocument",
+        index: int,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        source: Optional["PdfiumPage"] = None,
+    ) -> None:
+        self._pdf = pdf
+        self._index = index
+        self._source = source or self
+        self._page: Optional["pdfium.PdfPage"] = None
+        self._textpage: Optional["pdfium.PdfTextPage"] = None
+        self.width, self.height = pdf.get_page_size(index)
+        self.bbox = bbox or (0.0, 0.0, self.width, self.height)
+
+    def crop(self, bbox: Tuple[float, float, float, float]) -> "PdfiumPage":
+        return PdfiumPage(self._pdf, self._index, bbox, self._source)
+
+    def _get_textpage(self) -> "pdfium.PdfTextPage":
+        if self._textpage is None:
+            self._page = self._pdf[self._index]
+            self._textpage = self._page.get_textpage()
+        return self._textpage
+
+    def close(self) -> None:
+        if self._textpage is not None:
+            self._textpage.close()
+            self._page.close()
+            self._textpage = self._page = None
+
+    def extract_text(self) -> str:
+        x0, top, x1, bottom = self.bbox
+        textpage = self._source._get_textpage()
+        # PDFium measures from the bottom left corner of the page.
+        text = textpage.get_text_bounded(left=x0, bottom=self.height - bottom, right=x1, top=self.height - top)
+        return text.replace("\r\n", "\n")
+
+
+class PdfiumPDF:
+    """A pypdfium2 document that can stand in for ``pdfplumber.PDF`` during extraction."""
+
+    def __init__(self, source: Union[str, bytes, BinaryIO]) -> None:
+        import pypdfium2 as pdfium
+
+        self._pdf = pdfium.PdfDocument(source)
+        self.pages = [PdfiumPage(self._pdf, index) for index in range(len(self._pdf))]
+
+    def close(self) -> None:
+        for page in self.pages:
+            page.close()
+        self._pdf.close()
+
+    def __enter__(self) -> "PdfiumPDF":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def open_pdf(
+    source: Union[str, bytes, BinaryIO], backend: str = DEFAULT_TEXT_BACKEND
+) -> Union["pdfplumber.PDF", PdfiumPDF]:
+    """Open a PDF with the given text extraction backend.
+
+    ``pdfplumber`` runs pdfminer's layout analysis in pure Python; ``pdfium``
+    uses the PDFium library through pypdfium2 and is much faster. Both return
+    the same lines for Helix reports.
+    """
+    if backend == "pdfplumber":
+        import pdfplumber
+
+        return pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    if backend == "pdfium":
+        return PdfiumPDF(source)
+    raise ValueError(f"Unknown text backend: {backend}")
+
+
+def crop_text(page, bbox: Tuple[float, float, float, float]) -> str:
+    """Extract the text of a page inside ``bbox``, given as fractions of the page size."""
+    x0, top, x1, bottom = bbox
+    page_x0, page_top = page.bbox[:2]
+    return page.crop(
+        (
+            page_x0 + x0 * page.width,
+            page_top + top * page.height,
+            page_x0 + x1 * page.width,
+            page_top + bottom * page.height,
+        )
+    ).extract_text()
+
+
+def extract_region_text(page, region: Optional[ReportRegion]) -> str:
+    """Extract the text of a page, cropped to the results table if a region is given."""
+    if region is None:
+        return page.extract_text()
+    return crop_text(page, region.table_bbox)
+
+
+class PageBands(NamedTuple):
+    """Text of a page cut across at the results table of a layout: above it, in it and below it."""
+
+    header: str
+    table: str
+    footer: str
+
+    @property
+    def text(self) -> str:
+        return "\n".join(band for band in self if band)
+
+
+def extract_page_bands(page, region: ReportRegion) -> PageBands:
+    """Extract a page once as three bands, so the table is cropped and the whole page is still read.
+
+    The bands span the width of the page, so ``text`` has the lines of the
+    whole page in the same order as ``page.extract_text()``.
+    """
+    _, top, _, bottom = region.table_bbox
+    return PageBands(
+        crop_text(page, (0.0, 0.0, 1.0, top)),
+        extract_region_text(page, region),
+        crop_text(page, (0.0, bottom, 1.0, 1.0)),
+    )
+
+
 def extract_data_from_all_pages(
-    pdf: pdfplumber.PDF,
-) -> Tuple[List[Tuple[str, float, Union[float, None], Union[float, None], str]], str]:
-    all_data: List[Tuple[str, float, Union[float, None], Union[float, None], str]] = []
+    pdf: Union["pdfplumber.PDF", PdfiumPDF],
+    layout: Optional[str] = None,
+    parse: Callable[[str], Optional[ResultRow]] = parse_line,
+    first_page: Optional[PageBands] = None,
+) -> Tuple[List[ResultRow], str]:
+    """Extract the result rows and the analysis name from every page.
+
+    With a ``layout`` from ``REPORT_REGIONS`` only the results table of each
+    page is extracted and reading stops at the end marker. If the first page
+    yields neither rows nor the analysis name, the report does not have that
+    layout and whole pages are read instead. ``first_page`` is the first page
+    when the caller has already extracted it with ``extract_page_bands`` for
+    ``layout``; it is not extracted again.
+    """
+    all_data: List[ResultRow] = []
     analysis_name = ""
+    region = REPORT_REGIONS[layout] if layout is not None else None
 
-    for page in pdf.pages:
-        page_text = page.extract_text()
+    for page_number, page in enumerate(pdf.pages, start=1):
+        if page_number == 1 and first_page is not None:
+            page_text = first_page.table if region is not None else first_page.text
+        else:
+            page_text = extract_region_text(page, region)
+        end = page_text.find(region.end_marker) if region is not None else -1
+        if end != -1:
+            page_text = page_text[:end]
         # logging.info(f"Extracted text from page: {page_text}")
-        page_data = extract_data_from_page(page_text)
+        page_data = extract_data_from_page(page_text, parse)
+        check_layout = region is not None and page_number == 1
+        if check_layout and not page_data and not extract_analysis_name(page_text):
+            logging.info(f"The first page does not match the {layout} layout, reading whole pages")
+            region, end = None, -1
+            page_text = first_page.text if first_page is not None else page.extract_text()
+            page_data = extract_data_from_page(page_text, parse)
         all_data.extend(page_data)
         if not analysis_name:
             analysis_name = extract_analysis_name(page_text)
         # logging.info(f"Extracted data from page: {page_data}")
+        if end != -1:
+            logging.info(f"End of the report on page {page_number} of {len(pdf.pages)}")
+            break
 
     logging.info(f"Analysis name: {analysis_name}")
     return all_data, analysis_name
 
 
-def create_dataframe(
-    data: List[Tuple[str, float, Union[float, None], Union[float, None], str]]
-) -> pd.DataFrame:
+def create_dataframe(data: List[ResultRow]) -> "pd.DataFrame":
+    """Build a DataFrame of the rows for analysis; the conversion itself does not need one."""
+    import pandas as pd
+
     df = pd.DataFrame(data, columns=["Name", "Value", "Ref_Min", "Ref_Max", "Unit"])
     df["Value"] = df["Value"].astype(float)
     df["Ref_Min"] = pd.to_numeric(df["Ref_Min"], errors="coerce")
@@ -0,0 +1,521 @@
+import asyncio
+import contextlib
+import gc
+import io
+import logging
+import multiprocessing
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
+
+from history import Series
+from memory import MB, JobMemory, MemoryWatch
+from metrics import Metrics
+from pdf_processing import DEFAULT_TEXT_BACKEND, TEXT_BACKENDS, ResultRow, open_pdf
+from png_output import DEFAULT_PNG_PROFILE, get_png_profile
+from profiles import extract_report
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_JOB_TIMEOUT = 120
+# Worker processes are replaced after this many jobs each, or once one of them
+# grows past the RSS ceiling. A warmed-up worker takes 120-170 MB.
+DEFAULT_MAX_JOBS_PER_WORKER = 200
+DEFAULT_MAX_WORKER_RSS = 1024 * MB
+# Seconds ``ProcessingPool.prewarm`` waits before asking workers that have not answered yet again.
+PREWARM_RETRY_DELAY = 0.05
+OUTPUT_FORMATS = ("png", "pdf")
+# Libraries that can draw the PNG export: matplotlib, or Pillow through ``raster.plot_scales_raster``.
+PNG_RENDERERS = ("matplotlib", "pillow")
+DEFAULT_PNG_RENDERER = "matplotlib"
+# Longest report drawn as a single chart; 0 never splits reports into pages.
+DEFAULT_ROWS_PER_PAGE = 0
+# Bump whenever the rendered output changes so cached results are not reused.
+RENDERER_VERSION = "6"
+WARM_UP_ROW = ResultRow("Прогрев", 1.0, 0.5, 2.0, "ед.")
+
+# Seconds the warm-up took in this worker process, see ``warm_up_worker``.
+_warm_up_seconds: Optional[float] = None
+
+
+class PipelineError(Exception):
+    """Raised when a job could not be completed by the worker pool."""
+
+
+class PipelineTimeout(PipelineError):
+    """Raised when a job runs longer than the configured timeout."""
+
+
+class WorkerCrashed(PipelineError):
+    """Raised when a worker process died while running a job."""
+
+
+@dataclass
+class ConversionResult:
+    """Parsed rows of a report plus the chart exports rendered so far, by format.
+
+    ``profile`` is the key of the detected ``ReportProfile``, empty for unknown reports.
+    ``report_date`` is the sample date as YYYY-MM-DD, empty if the report does not give it.
+    """
+
+    rows: List[ResultRow]
+    analysis_name: str
+    outputs: Dict[str, bytes] = field(default_factory=dict)
+    profile: str = ""
+    pages: int = 0
+    report_date: str = ""
+
+    @property
+    def size(self) -> int:
+        rows_size = sum(len(row[0]) + len(row[4] or "") + 32 for row in self.rows)
+        return sum(len(output) for output in self.outputs.values()) + rows_size + len(self.analysis_name)
+
+
+def parse_report(
+    content: bytes, text_backend: str = DEFAULT_TEXT_BACKEND, timings: Optional[Dict[str, float]] = None
+) -> ConversionResult:
+    """Extract the result rows from an uploaded PDF held in memory. Runs inside a worker process.
+
+    The lab and panel are detected from the first page, see ``profiles.PROFILES``.
+    """
+    start = time.perf_counter()
+    with open_pdf(content, text_backend) as pdf:
+        all_data, analysis_name, profile, report_date = extract_report(pdf)
+        pages = len(pdf.pages)
+    if timings is not None:
+        timings["extract"] = time.perf_counter() - start
+    return ConversionResult(
+        all_data, analysis_name, profile=profile.key if profile else "", pages=pages, report_date=report_date
+    )
+
+
+def page_format(fmt: str, page: int) -> str:
+    """Key of page ``page`` (from 1) of an export in ``ConversionResult.outputs``: png, 2.png, 3.png..."""
+    return fmt if page == 1 else f"{page}.{fmt}"
+
+
+def output_pages(outputs: Dict[str, bytes], fmt: str) -> List[str]:
+    """Keys of all pages of the ``fmt`` export in ``outputs``, in page order."""
+    keys = []
+    while page_format(fmt, len(keys) + 1) in outputs:
+        keys.append(page_format(fmt, len(keys) + 1))
+    return keys
+
+
+def split_pages(rows: List[ResultRow], rows_per_page: int) -> List[List[ResultRow]]:
+    if rows_per_page <= 0 or len(rows) <= rows_per_page:
+        return [rows]
+    return [rows[start : start + rows_per_page] for start in range(0, len(rows), rows_per_page)]
+
+
+def draw_page(
+    rows: List[ResultRow],
+    title: str,
+    png: Optional[BinaryIO],
+    pdf: Any,
+    png_renderer: str,
+    png_profile: str,
+    timings: Optional[Dict[str, float]],
+) -> None:
+    """Draw one chart into ``png`` and ``pdf``, either of which may be None.
+
+    With the "pillow" renderer the PNG is drawn without matplotlib, which is
+    then only needed for the PDF. Both libraries are imported here rather than
+    at the top, so only worker processes load them. ``png_profile`` names the
+    ``PNG_PROFILES`` entry the PNG is encoded with.
+    """
+    profile = get_png_profile(png_profile)
+    if png is not None and png_renderer == "pillow":
+        from raster import plot_scales_raster
+
+        plot_scales_raster(rows, title, png, timings=timings, png_profile=profile)
+        png = None
+    if png is not None or pdf is not None:
+        from plotting import plot_scales
+
+        plot_scales(rows, title, save_path_png=png, save_path_pdf=pdf, timings=timings, png_profile=profile)
+
+
+def render_report(
+    rows: List[ResultRow],
+    analysis_name: str,
+    formats: Sequence[str],
+    png_renderer: str = DEFAULT_PNG_RENDERER,
+    rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dict[str, bytes]:
+    """Render the charts of parsed rows into memory, one export per requested format.
+
+    The matplotlib figure is built once however many formats are requested.
+    Reports longer than ``rows_per_page`` are split into pages, see ``render_pages``.
+    """
+    unknown = set(formats) - set(OUTPUT_FORMATS)
+    if unknown:
+        raise ValueError(f"Unsupported output formats: {', '.join(sorted(unknown))}")
+
+    pages = split_pages(rows, rows_per_page)
+    if len(pages) > 1:
+        return render_pages(pages, analysis_name, formats, png_renderer, png_profile, timings)
+    buffers = {fmt: io.BytesIO() for fmt in formats}
+    draw_page(rows, analysis_name, buffers.get("png"), buffers.get("pdf"), png_renderer, png_profile, timings)
+    return {fmt: buffer.getvalue() for fmt, buffer in buffers.items()}
+
+
+def render_pages(
+    pages: List[List[ResultRow]],
+    analysis_name: str,
+    formats: Sequence[str],
+    png_renderer: str = DEFAULT_PNG_RENDERER,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dict[str, bytes]:
+    """Render a long report page by page: one PNG per page and a single multi-page PDF.
+
+    Each page is written out before the next one is drawn, so the memory
+    taken by the figures does not grow with the length of the report. Stage
+    timings are summed over the pages.
+    """
+    outputs = {}
+    pdf = io.BytesIO() if "pdf" in formats else None
+    with contextlib.ExitStack() as stack:
+        pdf_pages = None
+        if pdf is not None:
+            from matplotlib.backends.backend_pdf import PdfPages
+
+            pdf_pages = stack.enter_context(PdfPages(pdf))
+        for page, page_rows in enumerate(pages, start=1):
+            png = io.BytesIO() if "png" in formats else None
+            page_timings: Dict[str, float] = {}
+            title = f"{analysis_name}, стр. {page} из {len(pages)}"
+            draw_page(page_rows, title, png, pdf_pages, png_renderer, png_profile, page_timings)
+            if png is not None:
+                outputs[page_format("png", page)] = png.getvalue()
+            if timings is not None:
+                for stage, seconds in page_timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+    if pdf is not None:
+        outputs["pdf"] = pdf.getvalue()
+    logging.info(f"{sum(map(len, pages))} rows rendered on {len(pages)} pages")
+    return outputs
+
+
+def render_trends(
+    series: Series,
+    formats: Sequence[str] = ("png",),
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dict[str, bytes]:
+    """Render the trend charts of a user's analyte history into memory, one export per format."""
+    from plotting import plot_trends
+
+    buffers = {fmt: io.BytesIO() for fmt in formats}
+    plot_trends(
+        series,
+        save_path_png=buffers.get("png"),
+        save_path_pdf=buffers.get("pdf"),
+        timings=timings,
+        png_profile=get_png_profile(png_profile),
+    )
+    return {fmt: buffer.getvalue() for fmt, buffer in buffers.items()}
+
+
+def convert_report(
+    content: bytes,
+    formats: Sequence[str] = OUTPUT_FORMATS,
+    text_backend: str = DEFAULT_TEXT_BACKEND,
+    png_renderer: str = DEFAULT_PNG_RENDERER,
+    rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    timings: Optional[Dict[str, float]] = None,
+) -> ConversionResult:
+    """Parse an uploaded PDF and render the requested formats in one go.
+
+    Nothing is rendered when no rows were found.
+    """
+    result = parse_report(content, text_backend, timings)
+    if result.rows and formats:
+        result.outputs.update(
+            render_report(
+                result.rows, result.analysis_name, formats, png_renderer, rows_per_page, png_profile, timings
+            )
+        )
+    return result
+
+
+def warm_up_worker(
+    text_backend: str = DEFAULT_TEXT_BACKEND,
+    png_renderer: str = DEFAULT_PNG_RENDERER,
+    trace_memory: bool = False,
+) -> None:
+    """Render and parse a dummy report. Runs once in every new worker process.
+
+    This loads matplotlib, its font cache and the PDF libraries before the first
+    upload arrives, instead of while a user waits for it. Everything loaded by
+    then is moved out of the garbage collector's way, which makes the collection
+    after each job cheap. With ``trace_memory`` Python allocations of every job
+    are traced from then on.
+    """
+    global _warm_up_seconds
+    start = time.perf_counter()
+    try:
+        outputs = render_report([WARM_UP_ROW], "", OUTPUT_FORMATS, png_renderer)
+        parse_report(outputs["pdf"], text_backend)
+    except Exception:
+        # A failed warm-up only makes the first job slower.
+        logging.error("Worker warm-up failed", exc_info=True)
+    _warm_up_seconds = time.perf_counter() - start
+    gc.collect()
+    gc.freeze()
+    if trace_memory:
+        tracemalloc.start()
+
+
+def warm_up_seconds() -> Tuple[int, Optional[float]]:
+    """Return the worker's PID and how long its warm-up took."""
+    return os.getpid(), _warm_up_seconds
+
+
+def run_timed(fn: Callable[..., Any], *args: Any) -> Tuple[Any, Dict[str, float], JobMemory]:
+    """Call ``fn(*args, timings)`` and return its result, the stage timings it recorded and its memory use.
+
+    Figures and parsed pages form reference cycles, so garbage is collected
+    before the worker's size is measured. Otherwise it would keep growing
+    between the collector's own, rare full passes.
+    """
+    timings: Dict[str, float] = {}
+    watch = MemoryWatch()
+    result = fn(*args, timings=timings)
+    gc.collect()
+    return result, timings, watch.stop()
+
+
+class ProcessingPool:
+    """Process pool that runs the CPU-bound parse and render steps off the event loop.
+
+    A job that exceeds ``job_timeout`` seconds has its worker processes terminated
+    and the pool is rebuilt. Jobs that were running next to it on the broken pool
+    are retried once on the fresh one.
+
+    Workers are also replaced once they ran ``max_jobs_per_worker`` jobs on
+    average, or as soon as one of them grows past ``max_worker_rss`` bytes.
+    Either limit is off when 0. Jobs already running finish on the old workers
+    while new ones go to a fresh pool, which is warmed up right away. The memory
+    each job took is logged and added to ``metrics``.
+    """
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        job_timeout: float = DEFAULT_JOB_TIMEOUT,
+        text_backend: str = DEFAULT_TEXT_BACKEND,
+        metrics: Optional[Metrics] = None,
+        png_renderer: str = DEFAULT_PNG_RENDERER,
+        rows_per_page: int = DEFAULT_ROWS_PER_PAGE,
+        png_profile: str = DEFAULT_PNG_PROFILE,
+        max_jobs_per_worker: int = DEFAULT_MAX_JOBS_PER_WORKER,
+        max_worker_rss: int = DEFAULT_MAX_WORKER_RSS,
+        trace_memory: bool = False,
+    ) -> None:
+        if size <= 0:
+            raise ValueError("The pool size must be greater than zero.")
+        if text_backend not in TEXT_BACKENDS:
+            raise ValueError(f"Unknown text backend: {text_backend}")
+        if png_renderer not in PNG_RENDERERS:
+            raise ValueError(f"Unknown PNG renderer: {png_renderer}")
+        get_png_profile(png_profile)
+        self.size = size
+        self.job_timeout = job_timeout
+        self.text_backend = text_backend
+        self.png_renderer = png_renderer
+        self.rows_per_page = rows_per_page
+        self.png_profile = png_profile
+        # Results are cached by renderer, PNG profile and page size, since all of them change the outputs.
+        self.renderer_version = RENDERER_VERSION
+        if png_renderer != DEFAULT_PNG_RENDERER:
+            self.renderer_version += f"-{png_renderer}"
+        if png_profile != DEFAULT_PNG_PROFILE:
+            self.renderer_version += f"-{png_profile}"
+        if rows_per_page > 0:
+            self.renderer_version += f"-p{rows_per_page}"
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_rss = max_worker_rss
+        self.trace_memory = trace_memory
+        self.metrics = metrics
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_jobs = 0
+        self._prewarm_task: Optional[asyncio.Task] = None
+        # Latest RSS reported by each worker of the current pool.
+        self.worker_rss: Dict[int, int] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # The bot process runs an event loop and HTTP client threads, which
+            # do not survive a fork, so workers are always spawned fresh.
+            # ``max_tasks_per_child`` is not used: on Python 3.11 the pool hangs
+            # once workers start exiting, so whole pools are recycled instead.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.size,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_worker,
+                initargs=(self.text_backend, self.png_renderer, self.trace_memory),
+            )
+            self._executor_jobs = 0
+            self.worker_rss = {}
+        return self._executor
+
+    def _worker_pids(self) -> List[int]:
+        return list(getattr(self._executor, "_processes", None) or {})
+
+    def _recycle(self, reason: str) -> None:
+        """Let the current workers finish their jobs and exit, and warm up a fresh pool in the background."""
+        executor = self._executor
+        if executor is None:
+            return
+        self._executor = None
+        executor.shutdown(wait=False)
+        if self.metrics is not None:
+            self.metrics.inc("worker_pool_recycles", reason=reason)
+        # Keep a reference, the event loop only holds weak ones to its tasks.
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+        self._prewarm_task = asyncio.get_running_loop().create_task(self.prewarm())
+
+    def _check_memory(self, job: str, memory: JobMemory) -> None:
+        logging.info(f"Job {job} in worker {memory.pid}: {memory.describe()}")
+        if self.metrics is not None:
+            self.metrics.inc("worker_rss_growth_bytes", max(memory.rss_delta, 0), job=job)
+            if memory.traced_peak is not None:
+                self.metrics.inc("worker_traced_peak_bytes", memory.traced_peak, job=job)
+        if memory.pid not in self._worker_pids():
+            # The job ran on a pool that has been replaced since.
+            return
+        self.worker_rss[memory.pid] = memory.rss
+        self._executor_jobs += 1
+        if self.max_worker_rss > 0 and memory.rss > self.max_worker_rss:
+            logging.warning(
+                f"Worker {memory.pid} takes {memory.rss / MB:.0f} MB, "
+                f"above the {self.max_worker_rss / MB:.0f} MB limit, replacing the worker pool"
+            )
+            self._recycle("memory")
+        elif self.max_jobs_per_worker > 0 and self._executor_jobs >= self.max_jobs_per_worker * self.size:
+            logging.info(f"Worker pool ran {self._executor_jobs} jobs, replacing it")
+            self._recycle("jobs")
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        if self._executor is not executor:
+            return
+        self._executor = None
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` in a worker process and await its result."""
+        loop = asyncio.get_running_loop()
+        job = args[0].__name__ if fn is run_timed else fn.__name__
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(executor, fn, *args), self.job_timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"Job {job} timed out after {self.job_timeout} s, restarting the pool")
+                self._discard(executor)
+                raise PipelineTimeout(f"Обработка заняла больше {self.job_timeout:g} с.")
+            except BrokenProcessPool:
+                logging.error(f"Worker crashed while running {job} (attempt {attempt + 1})")
+                self._discard(executor)
+        raise WorkerCrashed("Процесс обработки аварийно завершился.")
+
+    async def run_timed(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a pipeline step that records stage timings, and add them and its memory use to ``metrics``."""
+        result, timings, memory = await self.run(run_timed, fn, *args)
+        if self.metrics is not None:
+            self.metrics.observe_all(timings)
+        self._check_memory(fn.__name__, memory)
+        return result
+
+    def _count_outputs(self, outputs: Dict[str, bytes]) -> None:
+        if self.metrics is None:
+            return
+        for key, data in outputs.items():
+            fmt = key.rsplit(".", 1)[-1]
+            self.metrics.inc("outputs", format=fmt)
+            self.metrics.inc("output_bytes", len(data), format=fmt)
+
+    def max_rss(self) -> int:
+        """Return the largest RSS last reported by a worker of the current pool, in bytes."""
+        return max(self.worker_rss.values(), default=0)
+
+    async def prewarm(self) -> Optional[float]:
+        """Start all worker processes and wait until each of them is warmed up.
+
+        A spawned pool only starts a process for a job no idle worker can take,
+        so ``size`` jobs are sent at once. A worker that is ready first may run
+        several of them, so jobs are sent again until every worker answered.
+        Returns the slowest worker's warm-up time. Meant to run in the
+        background while the bot connects to Telegram.
+        """
+        start = time.perf_counter()
+        seconds: Dict[int, float] = {}
+        try:
+            while len(seconds) < self.size:
+                results = await asyncio.gather(*(self.run(warm_up_seconds) for _ in range(self.size - len(seconds))))
+                pids = self._worker_pids()
+                answered = {pid: s for pid, s in results if pid in pids and s is not None and pid not in seconds}
+                seconds.update(answered)
+                if time.perf_counter() - start > self.job_timeout:
+                    logging.warning(f"Only {len(seconds)} of {self.size} workers warmed up in {self.job_timeout} s")
+                    break
+                if not answered:
+                    await asyncio.sleep(PREWARM_RETRY_DELAY)
+        except PipelineError as e:
+            logging.error(f"Worker pool warm-up failed: {e}")
+            return None
+        times = ", ".join(f"{s:.2f}" for s in seconds.values())
+        logging.info(f"Worker pool ready in {time.perf_counter() - start:.2f} s, warm-up took {times} s per worker")
+        if self.metrics is not None:
+            for value in seconds.values():
+                self.metrics.observe("worker_warm_up", value)
+        return max(seconds.values(), default=None)
+
+    async def parse_report(self, content: bytes) -> ConversionResult:
+        return await self.run_timed(parse_report, content, self.text_backend)
+
+    async def render_report(
+        self,
+        rows: List[ResultRow],
+        analysis_name: str,
+        formats: Sequence[str],
+    ) -> Dict[str, bytes]:
+        outputs = await self.run_timed(
+            render_report, rows, analysis_name, formats, self.png_renderer, self.rows_per_page, self.png_profile
+        )
+        self._count_outputs(outputs)
+        return outputs
+
+    async def render_trends(self, series: Series, formats: Sequence[str] = ("png",)) -> Dict[str, bytes]:
+        outputs = await self.run_timed(render_trends, series, formats, self.png_profile)
+        self._count_outputs(outputs)
+        return outputs
+
+    async def convert_report(self, content: bytes, formats: Sequence[str] = OUTPUT_FORMATS) -> ConversionResult:
+        result = await self.run_timed(
+            convert_report,
+            content,
+            formats,
+            self.text_backend,
+            self.png_renderer,
+            self.rows_per_page,
+            self.png_profile,
+        )
+        self._count_outputs(result.outputs)
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
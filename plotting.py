@@ -1,185 +1,458 @@
-import matplotlib.pyplot as plt
-import pandas as pd
+import contextlib
+import datetime
+import functools
+import matplotlib
 import numpy as np
 import logging
+import time
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, Iterator, Optional, Sequence, Union
 
-MAX_WORDS_PER_HEADER_LINE = 8
-FIGURE_WIDTH = 10
-FIGURE_HEIGHT_PER_PLOT = 0.5
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.dates import DateFormatter
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties, findfont, get_font
+from matplotlib.ft2font import LOAD_NO_HINTING
+from matplotlib.path import Path
+from matplotlib.transforms import Affine2D
+from PIL import Image
 
+from layout import (
+    FIGURE_HEIGHT_PER_PLOT,
+    FIGURE_WIDTH,
+    GRADIENT,
+    GRADIENT_STOPS,
+    NAME_FONT_SIZE,
+    UNIT_FONT_SIZE,
+    VALUE_FONT_SIZE,
+    compute_layout,
+    measure_texts,
+    scale_limits,
+    split_title,
+)
+from pdf_processing import ResultRow
+from png_output import DEFAULT_PNG_PROFILE, PNG_PROFILES, PngProfile, encode_png, profile_dpi
 
-def split_title(title: str, max_words_per_line: int = MAX_WORDS_PER_HEADER_LINE) -> str:
-    """Split title into multiple lines if it exceeds the max number of words per line."""
-    title_lines = title.split(" ")
-    title_lines = [
-        " ".join(title_lines[i : i + max_words_per_line])
-        for i in range(0, len(title_lines), max_words_per_line)
-    ]
-    return "\n".join(title_lines)
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from history import Series, TrendPoint
+
+# Charts are only saved to files. Choosing the backend up front keeps pyplot
+# from probing for a display the first time it is used.
+matplotlib.use("Agg")
+
+# ``GRADIENT`` as a colormap. Colors interpolated linearly between its stops are
+# the gradient itself, so a Gouraud-shaded mesh with a vertex at every stop
+# draws it as a vector shading.
+GRADIENT_CMAP = LinearSegmentedColormap.from_list("bar_gradient", GRADIENT_STOPS)
+# Texts are measured for ``compute_layout`` at this size, like ``TextToPath``
+# does, and the widths of this many texts are kept between reports.
+TEXT_MEASURE_SIZE = 100
+TEXT_WIDTH_CACHE_SIZE = 4096
+
+
+@contextlib.contextmanager
+def owned_figure(**kwargs: Any) -> Iterator[Figure]:
+    """Create a figure owned by the caller alone and clear it when the block exits, even on error.
+
+    Unlike ``pyplot.figure`` the figure is not registered with pyplot, which
+    keeps every figure it created until ``pyplot.close``. Clearing frees the
+    artists right away instead of whenever the garbage collector gets to the
+    reference cycles between them and the figure.
+    """
+    fig = Figure(**kwargs)
+    try:
+        yield fig
+    finally:
+        fig.clear()
+
+
+@functools.lru_cache(maxsize=TEXT_WIDTH_CACHE_SIZE)
+def text_width(text: str, points: float) -> float:
+    """Width in inches of ``text`` in matplotlib's default font, as tight_layout measures it."""
+    font = get_font(findfont(FontProperties()))
+    font.set_size(TEXT_MEASURE_SIZE, 72)
+    font.set_text(text, 0.0, flags=LOAD_NO_HINTING)
+    width, _ = font.get_width_height()
+    return width / 64 / 72 * points / TEXT_MEASURE_SIZE
+
+
+def save_png(
+    fig: Figure,
+    save_path: Union[str, BinaryIO],
+    profile: PngProfile,
+    timings: Optional[Dict[str, float]] = None,
+) -> None:
+    """Draw ``fig`` with Agg at the resolution of ``profile`` and write it with ``encode_png``.
+
+    ``savefig`` would always write a full-color PNG with default compression.
+    """
+    original_dpi = fig.dpi
+    dpi = profile_dpi(profile, *fig.get_size_inches())
+    canvas = FigureCanvasAgg(fig)
+    try:
+        fig.set_dpi(dpi)
+        canvas.draw()
+        image = Image.fromarray(np.asarray(canvas.buffer_rgba()))
+    finally:
+        fig.set_dpi(original_dpi)
+    encode_png(image, save_path, profile, dpi, timings)
 
 
 def plot_scales_with_adjusted_ref_labels_spacing(
-    df_all: pd.DataFrame, analysis_name: str, save_path_png: str, save_path_pdf: str
+    df_all: "pd.DataFrame",
+    analysis_name: str,
+    save_path_png: Union[str, BinaryIO],
+    save_path_pdf: Union[str, BinaryIO],
 ) -> None:
-    """Plot scales with adjusted reference label spacing."""
+    """Plot scales with adjusted reference label spacing.
+
+    The outputs may be file paths or binary file objects such as ``io.BytesIO``.
+    """
+    import pandas as pd
+
     try:
         num_plots = len(df_all)
         if num_plots <= 0:
             raise ValueError("The number of plots must be greater than zero.")
 
-        fig = plt.figure(figsize=(FIGURE_WIDTH, num_plots * FIGURE_HEIGHT_PER_PLOT))
-        gs = plt.GridSpec(num_plots, 3, width_ratios=[1, 0.5, 4])
+        with owned_figure(figsize=(FIGURE_WIDTH, num_plots * FIGURE_HEIGHT_PER_PLOT)) as fig:
+            gs = fig.add_gridspec(num_plots, 3, width_ratios=[1, 0.5, 4])
 
-        for i, row in df_all.iterrows():
-            ax_name = fig.add_subplot(gs[i, 0])
-            ax_value = fig.add_subplot(gs[i, 1])
-            ax = fig.add_subplot(gs[i, 2])
+            for i, row in df_all.iterrows():
+                ax_name = fig.add_subplot(gs[i, 0])
+                ax_value = fig.add_subplot(gs[i, 1])
+                ax = fig.add_subplot(gs[i, 2])
 
-            value = row["Value"]
-            ref_min = row["Ref_Min"]
-            ref_max = row["Ref_Max"]
-            unit = row["Unit"]
+                value = row["Value"]
+                ref_min = row["Ref_Min"]
+                ref_max = row["Ref_Max"]
+                unit = row["Unit"]
 
-            if pd.isna(ref_min) and pd.isna(ref_max):
-                ax.text(
-                    0.5,
-                    0.5,
-                    "Референсные значения не определены",
+                if pd.isna(ref_min) and pd.isna(ref_max):
+                    ax.text(
+                        0.5,
+                        0.5,
+                        "Референсные значения не определены",
+                        fontsize=8,
+                        verticalalignment="center",
+                        horizontalalignment="center",
+                        transform=ax.transAxes,
+                    )
+                elif ref_min == 0.0 and ref_max == 0.0:
+                    ax.text(
+                        0.5,
+                        0.5,
+                        "Не обнаружено",
+                        fontsize=8,
+                        verticalalignment="center",
+                        horizontalalignment="center",
+                        transform=ax.transAxes,
+                    )
+                else:
+                    scale_min = min(
+                        ref_min - 0.2 * (ref_max - ref_min),
+                        value - 0.2 * abs(value - ref_min),
+                    )
+                    scale_max = max(
+                        ref_max + 0.2 * (ref_max - ref_min),
+                        value + 0.2 * abs(value - ref_max),
+                    )
+
+                    ax.imshow(
+                        GRADIENT,
+                        aspect="auto",
+                        extent=[scale_min, scale_max, 0, 1.5],
+                        interpolation="bilinear",
+                    )
+                    ax.axvline(ref_min, color="black", linestyle="-", lw=2)
+                    ax.axvline(ref_max, color="black", linestyle="-", lw=2)
+
+                    ax.plot(
+                        value,
+                        3.2,
+                        marker="v",
+                        color="black",
+                        markersize=12,
+                        linestyle="None",
+                    )
+
+                    ax.set_xlim(scale_min, scale_max)
+                    ax.set_ylim(0, 3)
+
+                    ax.text(
+                        ref_min,
+                        -0.5,
+                        f"{ref_min}",
+                        fontsize=10,
+                        verticalalignment="top",
+                        horizontalalignment="center",
+                        color="black",
+                    )
+                    ax.text(
+                        ref_max,
+                        -0.5,
+                        f"{ref_max}",
+                        fontsize=10,
+                        verticalalignment="top",
+                        horizontalalignment="center",
+                        color="black",
+                    )
+
+                for spine in ax.spines.values():
+                    spine.set_visible(False)
+
+                ax.set_xticks([])
+                ax.set_yticks([])
+
+                ax_name.text(
+                    0.1,
+                    0.3,
+                    row["Name"],
                     fontsize=8,
                     verticalalignment="center",
-                    horizontalalignment="center",
-                    transform=ax.transAxes,
+                    horizontalalignment="left",
                 )
-            elif ref_min == 0.0 and ref_max == 0.0:
-                ax.text(
-                    0.5,
+                ax_value.text(
                     0.5,
-                    "Не обнаружено",
-                    fontsize=8,
+                    0.3,
+                    f"{value:.5g}",
+                    fontsize=10,
                     verticalalignment="center",
-                    horizontalalignment="center",
-                    transform=ax.transAxes,
-                )
-            else:
-                scale_min = min(
-                    ref_min - 0.2 * (ref_max - ref_min),
-                    value - 0.2 * abs(value - ref_min),
-                )
-                scale_max = max(
-                    ref_max + 0.2 * (ref_max - ref_min),
-                    value + 0.2 * abs(value - ref_max),
+                    horizontalalignment="left",
                 )
+                if unit:
+                    ax_value.text(
+                        1.7,
+                        0.3,
+                        f"{unit}",
+                        fontsize=8,
+                        verticalalignment="center",
+                        horizontalalignment="left",
+                    )
 
-                gradient = np.zeros((1, 500, 3))
-                gradient[0, 0:100, 0] = np.linspace(0.5, 0, 100)
-                gradient[0, 0:100, 1] = 0
-                gradient[0, 0:100, 2] = np.linspace(1, 1, 100)
+                ax_name.axis("off")
+                ax_value.axis("off")
 
-                gradient[0, 100:200, 0] = 0
-                gradient[0, 100:200, 1] = np.linspace(0, 1, 100)
-                gradient[0, 100:200, 2] = 1
+            title_multiline = split_title(analysis_name)
+            fig.suptitle(title_multiline, fontsize=16, y=0.98, va="center")
+            fig.tight_layout(rect=[0, 0, 1, 0.96])
 
-                gradient[0, 200:300, 0] = 0
-                gradient[0, 200:300, 1] = 1
-                gradient[0, 200:300, 2] = np.linspace(1, 0, 100)
+            fig.savefig(save_path_png, format="png")
+            fig.savefig(save_path_pdf, format="pdf")
+            logging.info(f"Plots saved as {save_path_png} and {save_path_pdf}")
+    except Exception:
+        logging.error("An error occurred while plotting.", exc_info=True)
+        raise
+
+
+def plot_scales(
+    rows: Sequence[ResultRow],
+    analysis_name: str,
+    save_path_png: Optional[Union[str, BinaryIO]] = None,
+    save_path_pdf: Optional[Union[str, BinaryIO]] = None,
+    timings: Optional[Dict[str, float]] = None,
+    png_profile: PngProfile = PNG_PROFILES[DEFAULT_PNG_PROFILE],
+) -> None:
+    """Draw the same chart as ``plot_scales_with_adjusted_ref_labels_spacing`` on a single axes.
+
+    Only the outputs that are given are exported, so the figure is drawn once
+    per requested format. If ``timings`` is given, the seconds spent building
+    the figure and saving each format are stored in it. The PNG is drawn and
+    encoded as ``png_profile`` says.
+
+    All bars share one gradient image clipped to the bar rectangles, reference
+    ticks form one line collection and value markers one scatter collection.
+    Positions come from ``compute_layout`` instead of ``tight_layout``.
+    The rows are read column by column, without building a DataFrame.
+    """
+    timings = {} if timings is None else timings
+    try:
+        start = time.perf_counter()
+        num_plots = len(rows)
+        if num_plots <= 0:
+            raise ValueError("The number of plots must be greater than zero.")
 
-                gradient[0, 300:400, 0] = np.linspace(0, 1, 100)
-                gradient[0, 300:400, 1] = 1
-                gradient[0, 300:400, 2] = 0
+        figure_height = num_plots * FIGURE_HEIGHT_PER_PLOT
+        layout = compute_layout(num_plots, figure_height, measure_texts(rows, text_width))
+        with owned_figure(figsize=(FIGURE_WIDTH, figure_height)) as fig:
+            ax = fig.add_axes((0, 0, 1, 1))
+            ax.set_axis_off()
 
-                gradient[0, 400:500, 0] = 1
-                gradient[0, 400:500, 1] = np.linspace(1, 0, 100)
-                gradient[0, 400:500, 2] = 0
+            bar_width = layout.bar_x1 - layout.bar_x0
+            bar_center = (layout.bar_x0 + layout.bar_x1) / 2
+            row_height = layout.row_height
+            row_boxes = []
+            bars = []
+            ref_segments = []
+            marker_x = []
+            marker_y = []
 
-                ax.imshow(
-                    gradient,
+            names, values, ref_mins, ref_maxs, units = zip(*rows)
+
+            for bottom, name, value, ref_min, ref_max, unit in zip(
+                layout.row_bottoms, names, values, ref_mins, ref_maxs, units
+            ):
+                text_y = bottom + 0.3 * row_height
+                ax.text(layout.name_x, text_y, name, fontsize=NAME_FONT_SIZE, va="center", ha="left")
+                ax.text(layout.value_x, text_y, f"{value:.5g}", fontsize=VALUE_FONT_SIZE, va="center", ha="left")
+                if unit:
+                    ax.text(layout.unit_x, text_y, f"{unit}", fontsize=UNIT_FONT_SIZE, va="center", ha="left")
+
+                if ref_min is None or ref_max is None:
+                    ax.text(
+                        bar_center,
+                        bottom + 0.5 * row_height,
+                        "Референсные значения не определены",
+                        fontsize=8,
+                        va="center",
+                        ha="center",
+                    )
+                    continue
+                if ref_min == 0.0 and ref_max == 0.0:
+                    message = "Не обнаружено"
+                    ax.text(bar_center, bottom + 0.5 * row_height, message, fontsize=8, va="center", ha="center")
+                    continue
+
+                scale_min, scale_max = scale_limits(value, ref_min, ref_max)
+                scale = bar_width / (scale_max - scale_min)
+                row_box = Affine2D().scale(bar_width, row_height).translate(layout.bar_x0, bottom)
+                row_boxes.append(Path.unit_rectangle().transformed(row_box))
+                bars.append(Path.unit_rectangle().transformed(Affine2D().scale(1, 0.5) + row_box))
+                for ref in (ref_min, ref_max):
+                    ref_x = layout.bar_x0 + (ref - scale_min) * scale
+                    ref_segments.append([(ref_x, bottom), (ref_x, bottom + row_height)])
+                    ax.text(ref_x, bottom - row_height / 6, f"{ref}", fontsize=10, va="top", ha="center")
+                marker_x.append(layout.bar_x0 + (value - scale_min) * scale)
+                marker_y.append(bottom + row_height * 3.2 / 3)
+
+            image = shading = None
+            if bars:
+                bar_clip = Path.make_compound_path(*bars)
+                column = (layout.row_bottoms[-1], layout.row_bottoms[0] + row_height)
+                image = ax.imshow(
+                    GRADIENT,
                     aspect="auto",
-                    extent=[scale_min, scale_max, 0, 1.5],
+                    extent=(layout.bar_x0, layout.bar_x1, *column),
                     interpolation="bilinear",
                 )
-                ax.axvline(ref_min, color="black", linestyle="-", lw=2)
-                ax.axvline(ref_max, color="black", linestyle="-", lw=2)
-
-                ax.plot(
-                    value,
-                    3.2,
-                    marker="v",
-                    color="black",
-                    markersize=12,
-                    linestyle="None",
+                image.set_clip_path(bar_clip, ax.transData)
+                # Drawn instead of the image in PDFs, see below.
+                stops = np.linspace(0, 1, len(GRADIENT_STOPS))
+                shading = ax.pcolormesh(
+                    layout.bar_x0 + stops * bar_width,
+                    column,
+                    np.tile(stops, (2, 1)),
+                    shading="gouraud",
+                    cmap=GRADIENT_CMAP,
+                    vmin=0,
+                    vmax=1,
+                    visible=False,
                 )
+                shading.set_clip_path(bar_clip, ax.transData)
+                ax.add_collection(LineCollection(ref_segments, colors="black", linewidths=2))
+                # Markers sit just above each row and are clipped to it, as they
+                # were when every row had its own axes.
+                markers = ax.scatter(marker_x, marker_y, s=12**2, marker="v", color="black")
+                markers.set_clip_path(Path.make_compound_path(*row_boxes), ax.transData)
 
-                ax.set_xlim(scale_min, scale_max)
-                ax.set_ylim(0, 3)
+            ax.set_xlim(0, 1)
+            ax.set_ylim(0, 1)
 
-                ax.plot(
-                    [ref_min, ref_min], [0, 1.5], color="black", linestyle="-", lw=2
-                )
-                ax.plot(
-                    [ref_max, ref_max], [0, 1.5], color="black", linestyle="-", lw=2
-                )
+            title_multiline = split_title(analysis_name)
+            fig.suptitle(title_multiline, fontsize=16, y=0.98, va="center")
+            timings["figure"] = time.perf_counter() - start
 
-                ax.text(
-                    ref_min,
-                    -0.5,
-                    f"{ref_min}",
-                    fontsize=10,
-                    verticalalignment="top",
-                    horizontalalignment="center",
-                    color="black",
-                )
-                ax.text(
-                    ref_max,
-                    -0.5,
-                    f"{ref_max}",
-                    fontsize=10,
-                    verticalalignment="top",
-                    horizontalalignment="center",
-                    color="black",
-                )
+            for fmt, save_path in (("png", save_path_png), ("pdf", save_path_pdf)):
+                if save_path is not None:
+                    if fmt == "pdf" and image is not None:
+                        # A PDF gets the gradient as a shading of 20 triangles. It stays
+                        # smooth at any zoom, and no image is resampled and kept in
+                        # memory until a multi-page PDF is closed.
+                        image.set_visible(False)
+                        shading.set_visible(True)
+                    start = time.perf_counter()
+                    if fmt == "png":
+                        save_png(fig, save_path, png_profile, timings)
+                    else:
+                        fig.savefig(save_path, format=fmt)
+                    timings[f"savefig_{fmt}"] = time.perf_counter() - start
+        logging.info("Plots saved")
+    except Exception:
+        logging.error("An error occurred while plotting.", exc_info=True)
+        raise
 
-            for spine in ax.spines.values():
-                spine.set_visible(False)
 
-            ax.set_xticks([])
-            ax.set_yticks([])
+TREND_COLUMNS = 2
+TREND_ROW_HEIGHT = 2.0
+TREND_TITLE_HEIGHT = 0.8
 
-            ax_name.text(
-                0.1,
-                0.3,
-                row["Name"],
-                fontsize=8,
-                verticalalignment="center",
-                horizontalalignment="left",
-            )
-            ax_value.text(
-                0.5,
-                0.3,
-                f"{value:.5g}",
-                fontsize=10,
-                verticalalignment="center",
-                horizontalalignment="left",
+
+def is_out_of_range(point: "TrendPoint") -> bool:
+    if point.ref_min is None or point.ref_max is None:
+        return False
+    return not point.ref_min <= point.value <= point.ref_max
+
+
+def plot_trends(
+    series: "Series",
+    title: str = "Динамика показателей",
+    save_path_png: Optional[Union[str, BinaryIO]] = None,
+    save_path_pdf: Optional[Union[str, BinaryIO]] = None,
+    timings: Optional[Dict[str, float]] = None,
+    png_profile: PngProfile = PNG_PROFILES[DEFAULT_PNG_PROFILE],
+) -> None:
+    """Draw one small chart per analyte with its values over report dates.
+
+    ``series`` comes from ``AnalyteHistory.series``. The reference range of
+    the latest report is shaded and values outside of their own report's
+    range are drawn in red.
+    """
+    timings = {} if timings is None else timings
+    try:
+        start = time.perf_counter()
+        if not series:
+            raise ValueError("There are no analytes to plot.")
+        num_rows = -(-len(series) // TREND_COLUMNS)
+        figure_height = num_rows * TREND_ROW_HEIGHT + TREND_TITLE_HEIGHT
+        with owned_figure(figsize=(FIGURE_WIDTH, figure_height)) as fig:
+            axes = fig.subplots(num_rows, TREND_COLUMNS, squeeze=False).flatten()
+            fig.subplots_adjust(
+                left=0.07, right=0.98, bottom=0.3 / figure_height, top=1 - TREND_TITLE_HEIGHT / figure_height,
+                hspace=0.7, wspace=0.25,
             )
-            if unit:
-                ax_value.text(
-                    1.7,
-                    0.3,
-                    f"{unit}",
-                    fontsize=8,
-                    verticalalignment="center",
-                    horizontalalignment="left",
-                )
 
-            ax_name.axis("off")
-            ax_value.axis("off")
+            for ax, ((name, unit), points) in zip(axes, sorted(series.items())):
+                dates = [datetime.date.fromisoformat(point.report_date) for point in points]
+                values = [point.value for point in points]
+                latest = points[-1]
+                if latest.ref_min is not None and latest.ref_max is not None:
+                    ax.axhspan(latest.ref_min, latest.ref_max, color="#c8e6c9", zorder=0)
+                ax.plot(dates, values, color="black", linewidth=1, zorder=1)
+                colors = ["red" if is_out_of_range(point) else "black" for point in points]
+                ax.scatter(dates, values, c=colors, s=16, zorder=2)
+                ax.set_title(f"{name}, {unit}" if unit else name, fontsize=8)
+                ax.xaxis.set_major_formatter(DateFormatter("%m.%Y"))
+                ax.tick_params(labelsize=7)
+                for spine in ("top", "right"):
+                    ax.spines[spine].set_visible(False)
+            for ax in axes[len(series):]:
+                ax.set_axis_off()
 
-        title_multiline = split_title(analysis_name)
-        fig.suptitle(title_multiline, fontsize=16, y=0.98, va="center")
-        plt.tight_layout(rect=[0, 0, 1, 0.96])
+            fig.suptitle(split_title(title), fontsize=16, y=1 - TREND_TITLE_HEIGHT / 2 / figure_height, va="center")
+            timings["figure"] = time.perf_counter() - start
 
-        plt.savefig(save_path_png)
-        plt.savefig(save_path_pdf)
-        logging.info(f"Plots saved as {save_path_png} and {save_path_pdf}")
+            for fmt, save_path in (("png", save_path_png), ("pdf", save_path_pdf)):
+                if save_path is not None:
+                    start = time.perf_counter()
+                    if fmt == "png":
+                        save_png(fig, save_path, png_profile, timings)
+                    else:
+                        fig.savefig(save_path, format=fmt)
+                    timings[f"savefig_{fmt}"] = time.perf_counter() - start
+        logging.info(f"Trend charts of {len(series)} analytes saved")
     except Exception:
-        logging.error("An error occurred while plotting.", exc_info=True)
+        logging.error("An error occurred while plotting trends.", exc_info=True)
         raise
@@ -0,0 +1,83 @@
+import io
+import logging
+import time
+from typing import TYPE_CHECKING, BinaryIO, Dict, NamedTuple, Optional, Union
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class PngProfile(NamedTuple):
+    """How a chart is rasterized and encoded as PNG.
+
+    ``max_side`` caps the longer side of the image in pixels by lowering the
+    resolution of tall reports, 0 leaves it uncapped. ``colors`` is the size
+    of the palette the chart is quantized to, 0 keeps full color.
+    ``compress_level`` is zlib's, from 0 to 9.
+    """
+
+    dpi: float
+    max_side: int
+    colors: int
+    compress_level: int
+
+
+# Charts have a handful of flat colors, antialiased text and one smooth
+# gradient. 128 colors keep every pixel within 14 of full color and make the
+# file about four times smaller. Truecolor compresses best and fastest at
+# level 3; palette images gain little above level 6.
+PNG_PROFILES: Dict[str, PngProfile] = {
+    "preview": PngProfile(dpi=72, max_side=4096, colors=32, compress_level=6),
+    "standard": PngProfile(dpi=100, max_side=10000, colors=128, compress_level=6),
+    "print": PngProfile(dpi=200, max_side=20000, colors=0, compress_level=3),
+}
+DEFAULT_PNG_PROFILE = "standard"
+
+
+def get_png_profile(name: str) -> PngProfile:
+    profile = PNG_PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown PNG profile: {name}")
+    return profile
+
+
+def profile_dpi(profile: PngProfile, width: float, height: float) -> float:
+    """Return the resolution to draw a ``width`` x ``height`` inch chart at within the size cap."""
+    if profile.max_side <= 0:
+        return profile.dpi
+    return min(profile.dpi, profile.max_side / max(width, height))
+
+
+def encode_png(
+    image: "Image.Image",
+    save_path: Union[str, BinaryIO],
+    profile: PngProfile,
+    dpi: float,
+    timings: Optional[Dict[str, float]] = None,
+) -> None:
+    """Write a rendered chart as PNG, quantized and compressed as ``profile`` says.
+
+    The seconds it took are stored as ``encode_png`` in ``timings``, and the
+    time and size are logged. Pillow is imported here, so the bot process
+    can read the profiles without loading it.
+    """
+    from PIL import Image
+
+    start = time.perf_counter()
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if profile.colors:
+        image = image.quantize(profile.colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=profile.compress_level, dpi=(dpi, dpi))
+    seconds = time.perf_counter() - start
+    if timings is not None:
+        timings["encode_png"] = seconds
+    logging.info(
+        f"PNG of {image.width}x{image.height} encoded in {seconds * 1000:.0f} ms, {buffer.tell() / 1024:.0f} KiB"
+    )
+    if isinstance(save_path, str):
+        with open(save_path, "wb") as f:
+            f.write(buffer.getbuffer())
+    else:
+        save_path.write(buffer.getbuffer())
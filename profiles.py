@@ -0,0 +1,144 @@
+import logging
+import re
+from typing import TYPE_CHECKING, Callable, List, NamedTuple, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import pdfplumber
+
+from pdf_processing import (
+    NUMBER,
+    PATTERN_NAME,
+    PdfiumPDF,
+    DEFAULT_REPORT_LAYOUT,
+    REPORT_REGIONS,
+    ResultRow,
+    extract_data_from_all_pages,
+    extract_page_bands,
+    extract_report_date,
+    parse_line,
+)
+
+# Result lines of each panel in a single pattern without the alternatives the
+# panel never uses. Names are matched exactly like in PATTERN_RESULT_LINE; the
+# other groups are positional, since ``groups()`` is cheaper than looking
+# groups up by name.
+PATTERN_ORGANIC_ACID_LINE = re.compile(
+    rf"{PATTERN_NAME}\s+(\d+\.\d+)\s+(ммоль/моль креат.)\s+"
+    rf"(?:({NUMBER})\s*-\s*({NUMBER})|<({NUMBER}))\s*$"
+)
+PATTERN_AMINO_ACID_LINE = re.compile(
+    rf"{PATTERN_NAME}\s+(\d+\.\d+)\s+(мкмоль/л|нмоль/мл)\s+({NUMBER})\s*-\s*({NUMBER})\s*$"
+)
+
+
+def parse_organic_acid_line(
+    line: str,
+) -> Optional[ResultRow]:
+    """Parse a line of a Helix organic acids report.
+
+    Ranges and upper limits in ммоль/моль креат. are parsed here; ratios, rows
+    without reference values and anything else go to ``parse_line``.
+    """
+    match = PATTERN_ORGANIC_ACID_LINE.match(line)
+    if match is None or "не обнаружено" in line or "Биоматериал" in line:
+        return parse_line(line)
+    name, value, unit, ref_min, ref_max, less_than = match.groups()
+    if ref_min is not None:
+        return ResultRow(name, float(value), float(ref_min), float(ref_max), unit)
+    if ";" in name:
+        return parse_line(line)
+    return ResultRow(name, float(value), 0.0, float(less_than), unit)
+
+
+def parse_amino_acid_line(
+    line: str,
+) -> Optional[ResultRow]:
+    """Parse a line of a Helix amino acids report, where every result has a reference range."""
+    match = PATTERN_AMINO_ACID_LINE.match(line)
+    if match is None or "не обнаружено" in line or "Биоматериал" in line:
+        return parse_line(line)
+    name, value, unit, ref_min, ref_max = match.groups()
+    return ResultRow(name, float(value), float(ref_min), float(ref_max), unit)
+
+
+class ReportProfile(NamedTuple):
+    """A lab and panel the bot recognises from the text of the first page.
+
+    The profile matches when every string of ``fingerprint`` is on the first
+    page. ``layout`` is a key of ``REPORT_REGIONS``.
+    """
+
+    key: str
+    lab: str
+    panel: str
+    fingerprint: Tuple[str, ...]
+    layout: Optional[str]
+    parse_line: Callable[[str], Optional[ResultRow]]
+
+
+# Checked in order, so specific panels come before the catch-all profile of their lab.
+PROFILES: List[ReportProfile] = [
+    ReportProfile(
+        key="helix_organic_acids",
+        lab="Helix",
+        panel="Органические кислоты",
+        fingerprint=("Хеликс", "(врач): Органические кислоты"),
+        layout="helix",
+        parse_line=parse_organic_acid_line,
+    ),
+    ReportProfile(
+        key="helix_amino_acids",
+        lab="Helix",
+        panel="Аминокислоты",
+        fingerprint=("Хеликс", "(врач): Аминокислоты"),
+        layout="helix",
+        parse_line=parse_amino_acid_line,
+    ),
+    ReportProfile(
+        key="helix",
+        lab="Helix",
+        panel="",
+        fingerprint=("Хеликс",),
+        layout="helix",
+        parse_line=parse_line,
+    ),
+]
+
+
+def get_profile(key: str) -> Optional[ReportProfile]:
+    return next((profile for profile in PROFILES if profile.key == key), None)
+
+
+def detect_profile(first_page_text: str) -> Optional[ReportProfile]:
+    """Return the first profile whose fingerprint is on the first page, if any."""
+    for profile in PROFILES:
+        if all(marker in first_page_text for marker in profile.fingerprint):
+            return profile
+    return None
+
+
+def extract_report(
+    pdf: Union["pdfplumber.PDF", PdfiumPDF],
+) -> Tuple[List[ResultRow], str, Optional[ReportProfile], str]:
+    """Detect the profile of a report and extract its rows with the profile's parser.
+
+    Unknown reports are read as whole pages with the generic ``parse_line``.
+    Also returns the sample date from the first page, see ``extract_report_date``.
+    The first page is extracted once, in bands around the results table of the
+    default layout: the profile and the date are found in all of its text, its
+    rows only in the table.
+    """
+    if not pdf.pages:
+        return [], "", None, ""
+    first_page = extract_page_bands(pdf.pages[0], REPORT_REGIONS[DEFAULT_REPORT_LAYOUT])
+    first_page_text = first_page.text
+    profile = detect_profile(first_page_text)
+    if profile is None:
+        logging.info("Unknown report profile, using the generic parser")
+        all_data, analysis_name = extract_data_from_all_pages(pdf, first_page=first_page)
+    else:
+        logging.info(f"Report profile: {profile.key}")
+        # The bands only hold the table of the default layout.
+        reused = first_page if profile.layout in (None, DEFAULT_REPORT_LAYOUT) else None
+        all_data, analysis_name = extract_data_from_all_pages(pdf, profile.layout, profile.parse_line, reused)
+    return all_data, analysis_name, profile, extract_report_date(first_page_text)
@@ -0,0 +1,225 @@
+import functools
+import importlib.util
+import logging
+import os
+import time
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from layout import (
+    FIGURE_HEIGHT_PER_PLOT,
+    FIGURE_WIDTH,
+    GRADIENT,
+    NAME_FONT_SIZE,
+    UNIT_FONT_SIZE,
+    VALUE_FONT_SIZE,
+    compute_layout,
+    measure_texts,
+    scale_limits,
+    split_title,
+)
+from pdf_processing import ResultRow
+from png_output import DEFAULT_PNG_PROFILE, PNG_PROFILES, PngProfile, encode_png, profile_dpi
+
+FONT_NAME = "DejaVuSans.ttf"
+TEXT_CACHE_SIZE = 4096
+# Text is drawn this many times larger and scaled down. Hinting then barely
+# moves glyphs, so they are placed like matplotlib's unhinted text.
+TEXT_OVERSAMPLING = 4
+TITLE_LINE_SPACING = 1.2
+# Texts are measured for the layout at this resolution, where hinting no
+# longer changes their width, so columns land where matplotlib puts them.
+TEXT_MEASURE_DPI = 7200
+# Line widths and marker size of ``plot_scales``, in points.
+REF_LINE_WIDTH = 2
+MARKER_SIZE = 12
+MARKER_EDGE_WIDTH = 1.5
+
+
+def points_to_pixels(points: float, dpi: float) -> float:
+    return points * dpi / 72
+
+
+def find_font_path() -> Optional[str]:
+    """Return the DejaVu Sans font that matplotlib draws with, without importing matplotlib."""
+    spec = importlib.util.find_spec("matplotlib")
+    for location in spec.submodule_search_locations or [] if spec else []:
+        path = os.path.join(location, "mpl-data", "fonts", "ttf", FONT_NAME)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(points: float, dpi: float) -> ImageFont.FreeTypeFont:
+    size = points_to_pixels(points, dpi)
+    path = find_font_path()
+    if path is None:
+        logging.warning(f"{FONT_NAME} not found, PNG charts use Pillow's default font")
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_width(text: str, points: float) -> float:
+    """Width in inches of ``text`` at ``points`` without hinting, see ``layout.measure_texts``."""
+    return get_font(points, TEXT_MEASURE_DPI).getlength(text) / TEXT_MEASURE_DPI
+
+
+@functools.lru_cache(maxsize=None)
+def baseline_offsets(points: float, dpi: float) -> Dict[str, float]:
+    """Distance from the anchor to the baseline for matplotlib's ``va="center"`` and ``va="top"``.
+
+    matplotlib aligns every line by the box of "lp", not by the glyphs of the text itself.
+    """
+    _, top, _, bottom = get_font(points * TEXT_OVERSAMPLING, dpi).getbbox("lp", anchor="ls")
+    return {"center": -(top + bottom) / 2 / TEXT_OVERSAMPLING, "top": -top / TEXT_OVERSAMPLING}
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text: str, points: float, dpi: float, anchor: str) -> Tuple[Image.Image, int, int]:
+    """Rasterize ``text`` once and return its coverage mask with the offset of its corner from the anchor.
+
+    Reference values, units and analyte names repeat across rows and reports,
+    so most labels of a chart are pasted from this cache.
+    """
+    font = get_font(points * TEXT_OVERSAMPLING, dpi)
+    left, top, right, bottom = font.getbbox(text, anchor=anchor)
+    # Whole output pixels around the glyphs, so scaling down keeps the anchor in place.
+    left, top = left // TEXT_OVERSAMPLING, top // TEXT_OVERSAMPLING
+    width = max(-(-right // TEXT_OVERSAMPLING) - left, 1)
+    height = max(-(-bottom // TEXT_OVERSAMPLING) - top, 1)
+    mask = Image.new("L", (width * TEXT_OVERSAMPLING, height * TEXT_OVERSAMPLING))
+    origin = (-left * TEXT_OVERSAMPLING, -top * TEXT_OVERSAMPLING)
+    ImageDraw.Draw(mask).text(origin, text, fill=255, font=font, anchor=anchor)
+    return mask.resize((width, height), Image.BOX), left, top
+
+
+def draw_text(
+    image: Image.Image,
+    xy: Tuple[float, float],
+    text: str,
+    points: float,
+    dpi: float,
+    ha: str = "left",
+    va: str = "center",
+) -> None:
+    """Draw black text aligned like ``matplotlib.axes.Axes.text`` with the same ``ha`` and ``va``."""
+    mask, left, top = render_text(text, points, dpi, "ls" if ha == "left" else "ms")
+    baseline = xy[1] + baseline_offsets(points, dpi)[va]
+    image.paste((0, 0, 0), (round(xy[0]) + left, round(baseline) + top), mask)
+
+
+@functools.lru_cache(maxsize=16)
+def gradient_bar(width: int, height: int) -> Image.Image:
+    """Return ``GRADIENT`` resampled to a ``width`` x ``height`` bar with linear interpolation.
+
+    Every bar of a chart has the same size, so the bitmap is built once and pasted per row.
+    """
+    source = np.linspace(0, GRADIENT.shape[1] - 1, width)
+    channels = [np.interp(source, np.arange(GRADIENT.shape[1]), GRADIENT[0, :, c]) for c in range(3)]
+    pixels = np.rint(np.stack(channels, axis=-1) * 255).astype(np.uint8)
+    return Image.fromarray(np.repeat(pixels[np.newaxis, :, :], height, axis=0), "RGB")
+
+
+def marker_polygon(x: float, y: float, clip_top: float, dpi: float) -> List[Tuple[float, float]]:
+    """A downward triangle centred on ``(x, y)``, cut off above ``clip_top`` like the clipped scatter marker."""
+    size = points_to_pixels(MARKER_SIZE + MARKER_EDGE_WIDTH, dpi)
+    tip = y + size / 2
+    top = max(y - size / 2, clip_top)
+    half_width = (tip - top) / 2
+    return [(x - half_width, top), (x + half_width, top), (x, tip)]
+
+
+def plot_scales_raster(
+    rows: Sequence[ResultRow],
+    analysis_name: str,
+    save_path_png: Union[str, BinaryIO],
+    timings: Optional[Dict[str, float]] = None,
+    png_profile: PngProfile = PNG_PROFILES[DEFAULT_PNG_PROFILE],
+) -> None:
+    """Draw the PNG chart of ``plotting.plot_scales`` directly onto a Pillow image.
+
+    The layout comes from the same ``compute_layout``, so the two renderers
+    differ only by antialiasing and glyph hinting. Gradient bars and text
+    bitmaps are cached between charts and matplotlib is never imported. PDF
+    exports still go through ``plot_scales``.
+    """
+    timings = {} if timings is None else timings
+    try:
+        start = time.perf_counter()
+        num_plots = len(rows)
+        if num_plots <= 0:
+            raise ValueError("The number of plots must be greater than zero.")
+
+        figure_height = num_plots * FIGURE_HEIGHT_PER_PLOT
+        dpi = profile_dpi(png_profile, FIGURE_WIDTH, figure_height)
+        layout = compute_layout(num_plots, figure_height, measure_texts(rows, text_width))
+        width, height = round(FIGURE_WIDTH * dpi), round(figure_height * dpi)
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+
+        def x_px(x: float) -> float:
+            return x * width
+
+        def y_px(y: float) -> float:
+            return (1 - y) * height
+
+        bar_x0, bar_x1 = round(x_px(layout.bar_x0)), round(x_px(layout.bar_x1))
+        bar_center = x_px((layout.bar_x0 + layout.bar_x1) / 2)
+        row_height = layout.row_height
+        bar_height = max(round(0.5 * row_height * height), 1)
+        gradient = gradient_bar(bar_x1 - bar_x0, bar_height)
+        ref_line_width = max(round(points_to_pixels(REF_LINE_WIDTH, dpi)), 1)
+
+        # Text is drawn over the bars, as matplotlib orders text above images and lines.
+        labels: List[Tuple[Tuple[float, float], str, float, float, str, str]] = []
+        for bottom, (name, value, ref_min, ref_max, unit) in zip(layout.row_bottoms, rows):
+            text_y = y_px(bottom + 0.3 * row_height)
+            labels.append(((x_px(layout.name_x), text_y), name, NAME_FONT_SIZE, dpi, "left", "center"))
+            labels.append(((x_px(layout.value_x), text_y), f"{value:.5g}", VALUE_FONT_SIZE, dpi, "left", "center"))
+            if unit:
+                labels.append(((x_px(layout.unit_x), text_y), f"{unit}", UNIT_FONT_SIZE, dpi, "left", "center"))
+
+            if ref_min is None or ref_max is None:
+                message = "Референсные значения не определены"
+                labels.append(((bar_center, y_px(bottom + 0.5 * row_height)), message, 8, dpi, "center", "center"))
+                continue
+            if ref_min == 0.0 and ref_max == 0.0:
+                message = "Не обнаружено"
+                labels.append(((bar_center, y_px(bottom + 0.5 * row_height)), message, 8, dpi, "center", "center"))
+                continue
+
+            row_top, row_bottom = y_px(bottom + row_height), y_px(bottom)
+            image.paste(gradient, (bar_x0, round(row_bottom) - bar_height))
+
+            scale_min, scale_max = scale_limits(value, ref_min, ref_max)
+            scale = (bar_x1 - bar_x0) / (scale_max - scale_min)
+            for ref in (ref_min, ref_max):
+                ref_x = bar_x0 + (ref - scale_min) * scale
+                draw.line([(ref_x, row_top), (ref_x, row_bottom)], fill="black", width=ref_line_width)
+                labels.append(((ref_x, y_px(bottom - row_height / 6)), f"{ref}", 10, dpi, "center", "top"))
+            marker_x = bar_x0 + (value - scale_min) * scale
+            draw.polygon(marker_polygon(marker_x, y_px(bottom + row_height * 3.2 / 3), row_top, dpi), fill="black")
+
+        for label in labels:
+            draw_text(image, *label)
+
+        title_lines = split_title(analysis_name).split("\n")
+        ascent, descent = get_font(16, dpi).getmetrics()
+        pitch = TITLE_LINE_SPACING * (ascent + descent)
+        first_line_y = y_px(0.98) - pitch * (len(title_lines) - 1) / 2
+        for i, line in enumerate(title_lines):
+            if line:
+                draw_text(image, (width / 2, first_line_y + i * pitch), line, 16, dpi, "center")
+        timings["figure_raster"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        encode_png(image, save_path_png, png_profile, dpi, timings)
+        timings["savefig_png"] = time.perf_counter() - start
+        logging.info("Plots saved")
+    except Exception:
+        logging.error("An error occurred while plotting.", exc_info=True)
+        raise
@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import Awaitable, Callable, Counter, Deque, Hashable, Optional, Set, TypeVar
+
+from metrics import Metrics
+
+DEFAULT_MAX_CONCURRENT_JOBS = 2
+DEFAULT_MAX_JOBS_PER_USER = 3
+DEFAULT_MAX_QUEUE_LENGTH = 20
+
+T = TypeVar("T")
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class JobRejected(Exception):
+    """Raised when a job is not admitted. The message is meant for the user."""
+
+
+class QueueFull(JobRejected):
+    """Raised when the queue already holds ``max_queue_length`` waiting jobs."""
+
+
+class UserLimitReached(JobRejected):
+    """Raised when a user already has ``max_jobs_per_user`` jobs running or waiting."""
+
+
+class _Waiter:
+    def __init__(self, on_position: Optional[PositionCallback]) -> None:
+        self.on_position = on_position
+        self.admitted: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self.position: Optional[int] = None
+        self.notifier: Optional["asyncio.Task[None]"] = None
+
+
+class JobScheduler:
+    """Admission control in front of the processing pool.
+
+    At most ``max_concurrent`` jobs run at once and the rest wait in a FIFO
+    queue of at most ``max_queue_length`` jobs. A user may have at most
+    ``max_jobs_per_user`` jobs running or waiting. Jobs beyond either limit are
+    rejected right away, so bursts do not pile up memory and timeouts.
+
+    A waiting job's ``on_position`` callback is called with its place in the
+    queue whenever that changes, and with 0 once the job starts.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT_JOBS,
+        max_jobs_per_user: int = DEFAULT_MAX_JOBS_PER_USER,
+        max_queue_length: int = DEFAULT_MAX_QUEUE_LENGTH,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        if max_concurrent <= 0:
+            raise ValueError("At least one job must be allowed to run.")
+        self.max_concurrent = max_concurrent
+        self.max_jobs_per_user = max_jobs_per_user
+        self.max_queue_length = max_queue_length
+        self.metrics = metrics
+        self.running = 0
+        self._waiting: Deque[_Waiter] = collections.deque()
+        self._user_jobs: Counter[Hashable] = collections.Counter()
+        self._notifiers: Set["asyncio.Task[None]"] = set()
+        if metrics is not None:
+            metrics.add_gauge("jobs_running", lambda: self.running)
+            metrics.add_gauge("jobs_waiting", lambda: len(self._waiting))
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def jobs_of(self, user: Hashable) -> int:
+        return self._user_jobs[user]
+
+    async def run(
+        self, user: Hashable, job: Callable[[], Awaitable[T]], on_position: Optional[PositionCallback] = None
+    ) -> T:
+        """Run ``job()`` once a slot is free, or raise ``JobRejected``."""
+        self._admit(user)
+        self._user_jobs[user] += 1
+        try:
+            await self._acquire(on_position)
+            try:
+                return await job()
+            finally:
+                self._release()
+        finally:
+            self._user_jobs[user] -= 1
+            if not self._user_jobs[user]:
+                del self._user_jobs[user]
+
+    def _admit(self, user: Hashable) -> None:
+        if self._user_jobs[user] >= self.max_jobs_per_user:
+            self._reject("user_limit")
+            raise UserLimitReached(
+                f"Ваши файлы уже обрабатываются (в работе и в очереди: {self._user_jobs[user]}). "
+                "Дождитесь результата и отправьте файл снова."
+            )
+        if self.running >= self.max_concurrent and len(self._waiting) >= self.max_queue_length:
+            self._reject("queue_full")
+            raise QueueFull("Сейчас бот перегружен, очередь заполнена. Пожалуйста, попробуйте через несколько минут.")
+
+    def _reject(self, reason: str) -> None:
+        logging.warning(f"Job rejected: {reason}, {self.running} running, {len(self._waiting)} waiting")
+        if self.metrics is not None:
+            self.metrics.inc("jobs_rejected", reason=reason)
+
+    async def _acquire(self, on_position: Optional[PositionCallback]) -> None:
+        if self.running < self.max_concurrent and not self._waiting:
+            self.running += 1
+            return
+        waiter = _Waiter(on_position)
+        self._waiting.append(waiter)
+        self._notify(waiter, len(self._waiting))
+        start = time.perf_counter()
+        try:
+            await waiter.admitted
+        except asyncio.CancelledError:
+            if waiter.admitted.done() and not waiter.admitted.cancelled():
+                # The slot was handed over just before the cancellation.
+                self._release()
+            else:
+                self._waiting.remove(waiter)
+                self._notify_positions()
+            raise
+        if self.metrics is not None:
+            self.metrics.observe("queue_wait", time.perf_counter() - start)
+        self._notify(waiter, 0)
+
+    def _release(self) -> None:
+        if self._waiting:
+            # The slot goes straight to the next job, so ``running`` stays the same.
+            self._waiting.popleft().admitted.set_result(None)
+            self._notify_positions()
+        else:
+            self.running -= 1
+
+    def _notify_positions(self) -> None:
+        for position, waiter in enumerate(self._waiting, start=1):
+            self._notify(waiter, position)
+
+    def _notify(self, waiter: _Waiter, position: int) -> None:
+        if waiter.on_position is None or waiter.position == position:
+            return
+        waiter.position = position
+        # One notifier per job sends positions in order and skips the ones
+        # that are already out of date.
+        if waiter.notifier is None or waiter.notifier.done():
+            waiter.notifier = asyncio.create_task(self._send_positions(waiter))
+            self._notifiers.add(waiter.notifier)
+            waiter.notifier.add_done_callback(self._notifiers.discard)
+
+    @staticmethod
+    async def _send_positions(waiter: _Waiter) -> None:
+        sent = None
+        while sent != waiter.position:
+            sent = waiter.position
+            try:
+                await waiter.on_position(sent)
+            except Exception as e:
+                logging.warning(f"Could not update the queue position: {e}")
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple
+
+DEFAULT_STORE_ROOT = "files"
+DEFAULT_MAX_USER_BYTES = 100 * 1024 * 1024
+DEFAULT_MAX_TOTAL_BYTES = 1024 * 1024 * 1024
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_SWEEP_INTERVAL = 3600
+INDEX_NAME = "index.sqlite3"
+# Folders of the layout used before the index, files/<user>/<kind>/<job>/<job>.<extension>.
+LEGACY_KINDS = ("upload", "output")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    user TEXT NOT NULL,
+    job TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (user, job, kind, extension)
+);
+CREATE INDEX IF NOT EXISTS artifacts_created ON artifacts (created);
+CREATE INDEX IF NOT EXISTS artifacts_user_created ON artifacts (user, created);
+"""
+
+
+def write_atomically(path: str, content: bytes) -> None:
+    """Write through a temporary file, so readers never see a truncated file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ArtifactStore:
+    """Uploads and rendered outputs on disk, indexed by user and job in SQLite.
+
+    Files live in ``root/<user>/<job>_<kind>.<extension>`` and are added to the
+    index only once completely written, so a reader never gets a partial file.
+    Files older than ``ttl`` seconds are removed by ``sweep``. When a user holds
+    more than ``max_user_bytes``, or all users more than ``max_total_bytes``,
+    the oldest files are removed first; the job being written is kept.
+
+    Methods block on disk and SQLite, so the bot calls them through
+    ``asyncio.to_thread``. A lock serializes access to the index.
+    """
+
+    def __init__(
+        self,
+        root: str = DEFAULT_STORE_ROOT,
+        max_user_bytes: int = DEFAULT_MAX_USER_BYTES,
+        max_total_bytes: int = DEFAULT_MAX_TOTAL_BYTES,
+        ttl: float = DEFAULT_TTL,
+    ) -> None:
+        self.root = root
+        self.max_user_bytes = max_user_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        index_path = os.path.join(root, INDEX_NAME)
+        new_index = not os.path.exists(index_path)
+        self._db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        if new_index:
+            self.adopt_legacy_files()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def path_for(self, user: str, job: str, kind: str, extension: str) -> str:
+        return os.path.join(self.root, user, f"{job}_{kind}.{extension}")
+
+    def put(self, user: str, job: str, kind: str, extension: str, content: bytes, now: Optional[float] = None) -> str:
+        """Store a file of a job and return its path. Quotas are enforced right away."""
+        path = self.path_for(user, job, kind, extension)
+        write_atomically(path, content)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user, job, kind, extension, path, len(content), time.time() if now is None else now),
+            )
+            removed = self._over_quota(user, job)
+        self._remove_files(removed, "quota")
+        logging.info(f"File saved to {path}")
+        return path
+
+    def get(self, user: str, job: str, kind: str, extension: str) -> Optional[bytes]:
+        """Return the content of a stored file, or None if there is none."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path FROM artifacts WHERE user = ? AND job = ? AND kind = ? AND extension = ?",
+                (user, job, kind, extension),
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(row[0], "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Removed by the sweeper after the lookup, or deleted by hand.
+            return None
+
+    def usage(self, user: Optional[str] = None) -> int:
+        """Return the bytes stored by ``user``, or by everyone."""
+        with self._lock:
+            if user is None:
+                row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+            else:
+                row = self._db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE user = ?", (user,)
+                ).fetchone()
+        return row[0]
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Remove expired files and the oldest files over the global quota. Return how many were removed."""
+        cutoff = (time.time() if now is None else now) - self.ttl
+        with self._lock:
+            expired = self._delete_rows("SELECT rowid, path FROM artifacts WHERE created < ?", (cutoff,))
+            over_quota = self._over_quota()
+        self._remove_files(expired, "ttl")
+        self._remove_files(over_quota, "quota")
+        return len(expired) + len(over_quota)
+
+    def adopt_legacy_files(self) -> int:
+        """Index files saved before the index existed, so they expire like the rest."""
+        rows = []
+        for user in os.listdir(self.root):
+            for kind in LEGACY_KINDS:
+                kind_dir = os.path.join(self.root, user, kind)
+                if not os.path.isdir(kind_dir):
+                    continue
+                for job in os.listdir(kind_dir):
+                    job_dir = os.path.join(kind_dir, job)
+                    for name in os.listdir(job_dir) if os.path.isdir(job_dir) else []:
+                        stem, _, extension = name.rpartition(".")
+                        if stem != job:
+                            continue
+                        path = os.path.join(job_dir, name)
+                        stat = os.stat(path)
+                        rows.append((user, job, kind, extension, path, stat.st_size, stat.st_mtime))
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        if rows:
+            logging.info(f"Indexed {len(rows)} files saved before the artifact index")
+        return len(rows)
+
+    def _over_quota(self, user: Optional[str] = None, keep_job: Optional[str] = None) -> List[str]:
+        """Delete the index rows of the oldest files over the quotas and return their paths. Needs the lock."""
+        removed = []
+        keep = (user, keep_job)
+        if user is not None:
+            removed += self._delete_oldest(self.max_user_bytes, "WHERE user = ?", (user,), keep)
+        removed += self._delete_oldest(self.max_total_bytes, "", (), keep)
+        return removed
+
+    def _delete_oldest(
+        self, limit: int, where: str, params: Tuple, keep: Tuple[Optional[str], Optional[str]]
+    ) -> List[str]:
+        total = self._db.execute(f"SELECT COALESCE(SUM(size), 0) FROM artifacts {where}", params).fetchone()[0]
+        if total <= limit:
+            return []
+        victims = []
+        for rowid, row_user, job, path, size in self._db.execute(
+            f"SELECT rowid, user, job, path, size FROM artifacts {where} ORDER BY created", params
+        ).fetchall():
+            if total <= limit:
+                break
+            if (row_user, job) == keep:
+                continue
+            victims.append((rowid, path))
+            total -= size
+        self._db.executemany("DELETE FROM artifacts WHERE rowid = ?", [(rowid,) for rowid, _ in victims])
+        return [path for _, path in victims]
+
+    def _delete_rows(self, query: str, params: Tuple) -> List[str]:
+        rows = self._db.execute(query, params).fetchall()
+        self._db.executemany("DELETE FROM artifacts WHERE rowid = ?", [(rowid,) for rowid, _ in rows])
+        return [path for _, path in rows]
+
+    @staticmethod
+    def _remove_files(paths: List[str], reason: str) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if paths:
+            logging.info(f"Removed {len(paths)} stored files ({reason})")
+
+
+async def run_sweeper(store: ArtifactStore, interval: float = DEFAULT_SWEEP_INTERVAL) -> None:
+    """Call ``store.sweep`` every ``interval`` seconds until cancelled."""
+    while True:
+        try:
+            await asyncio.to_thread(store.sweep)
+        except Exception:
+            logging.error("Artifact sweep failed", exc_info=True)
+        await asyncio.sleep(interval)
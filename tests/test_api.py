@@ -0,0 +1,104 @@
+import asyncio
+
+import httpx
+
+from api import ConversionAPI
+from benchmarks.synthetic_report import build_report_pdf, synthetic_rows
+from cache import ResultCache
+from metrics import Metrics
+from pipeline import ConversionResult, ProcessingPool
+from scheduler import JobScheduler
+
+TOKEN = "s3cret"
+
+
+class BlockedPool:
+    """Stands in for ``ProcessingPool`` with conversions that wait until ``release`` is set."""
+
+    renderer_version = "test"
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def convert_report(self, content, formats):
+        await self.release.wait()
+        return ConversionResult([], "")
+
+
+def serve(api, requests):
+    """Start ``api``, run ``requests(client, url)`` and stop it again."""
+
+    async def main():
+        await api.start()
+        try:
+            async with httpx.AsyncClient(headers={"Authorization": f"Bearer {TOKEN}"}) as client:
+                return await requests(client, f"http://127.0.0.1:{api.port}")
+        finally:
+            await api.stop(0)
+
+    return asyncio.run(main())
+
+
+def test_convert_over_one_keep_alive_connection():
+    metrics = Metrics()
+    pool = ProcessingPool(size=1, job_timeout=60, text_backend="pdfium", metrics=metrics)
+    api = ConversionAPI(pool, JobScheduler(), ResultCache(), metrics, port=0, token=TOKEN)
+    content = build_report_pdf(synthetic_rows(10))
+
+    async def requests(client, url):
+        rows = await client.post(f"{url}/convert?format=json", content=content)
+        png = await client.post(f"{url}/convert", content=content)
+        return rows, png, len(api.server._connections)
+
+    try:
+        rows, png, connections = serve(api, requests)
+    finally:
+        pool.shutdown()
+
+    assert rows.status_code == 200
+    document = rows.json()
+    assert len(document["rows"]) == 10
+    assert set(document["rows"][0]) == {"name", "value", "ref_min", "ref_max", "unit"}
+    assert png.status_code == 200 and png.headers["content-type"] == "image/png"
+    assert png.content.startswith(b"\x89PNG") and png.headers["x-pages"] == "1"
+    assert connections == 1
+    # The PNG is rendered from the rows parsed for the JSON request.
+    assert metrics.counter("result_cache_hits") == 1
+
+
+def test_invalid_requests_are_rejected():
+    api = ConversionAPI(BlockedPool(), JobScheduler(), port=0, max_upload_size=1000, token=TOKEN)
+
+    async def requests(client, url):
+        return [
+            await client.post(f"{url}/convert", content=b"%PDF", headers={"Authorization": "Bearer wrong"}),
+            await client.post(f"{url}/convert?format=svg", content=b"%PDF"),
+            await client.post(f"{url}/convert?page=last", content=b"%PDF"),
+            await client.post(f"{url}/convert", content=b"GIF89a"),
+            await client.post(f"{url}/convert", content=b"%PDF" + b"0" * 1000),
+            await client.get(f"{url}/health"),
+        ]
+
+    statuses = [response.status_code for response in serve(api, requests)]
+
+    assert statuses == [401, 400, 400, 415, 413, 200]
+
+
+def test_full_queue_is_answered_with_retry_after():
+    pool = BlockedPool()
+    scheduler = JobScheduler(max_concurrent=1, max_jobs_per_user=10, max_queue_length=0)
+    api = ConversionAPI(pool, scheduler, port=0, token=TOKEN)
+
+    async def requests(client, url):
+        first = asyncio.create_task(client.post(f"{url}/convert", content=b"%PDF-1"))
+        while not scheduler.running:
+            await asyncio.sleep(0.01)
+        second = await client.post(f"{url}/convert", content=b"%PDF-2")
+        pool.release.set()
+        return await first, second
+
+    first, second = serve(api, requests)
+
+    assert second.status_code == 503 and second.headers["retry-after"] == "5"
+    # The report had no rows.
+    assert first.status_code == 422
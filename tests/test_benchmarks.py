@@ -0,0 +1,47 @@
+from benchmarks.stages import find_regressions, parse_case
+from benchmarks.startup import measure_import
+from benchmarks.synthetic_report import build_report_pdf, synthetic_rows
+from pdf_processing import extract_data_from_all_pages, open_pdf
+
+
+def test_synthetic_report_has_every_row_kind():
+    rows = synthetic_rows(14)
+    references = [row[3] for row in rows]
+    assert any(reference.startswith("<") for reference in references)
+    assert "не обнаружено" in references
+    assert any(reference.startswith("Референсные значения не") for reference in references)
+    assert any(row[2] == "" for row in rows)
+
+    with open_pdf(build_report_pdf(rows, rows_per_page=5), "pdfium") as pdf:
+        data, _ = extract_data_from_all_pages(pdf)
+        assert len(pdf.pages) == 3
+    assert len(data) == 14
+
+
+def test_find_regressions():
+    baseline = {"cases": {"10x1": {"create_dataframe": 0.010, "plot_scales": 0.200}}}
+    results = {"cases": {"10x1": {"create_dataframe": 0.012, "plot_scales": 0.300}, "40x2": {"plot_scales": 1.0}}}
+
+    regressions = find_regressions(results, baseline, threshold=0.25)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith("10x1 plot_scales: 300.0 ms")
+    # A stage the baseline has no timing for fails until the baseline is recorded again.
+    assert find_regressions(results, baseline, threshold=0.6) == ["40x2 plot_scales: 1000.0 ms, no baseline timing"]
+
+
+def test_find_regressions_ignores_noise():
+    baseline = {"cases": {"10x1": {"extract_data_from_page": 0.0001}}}
+    results = {"cases": {"10x1": {"extract_data_from_page": 0.0004}}}
+    assert find_regressions(results, baseline) == []
+
+
+def test_parse_case():
+    assert parse_case("80x3") == (80, 3)
+    assert parse_case("20") == (20, 1)
+
+
+def test_bot_starts_without_heavy_libraries():
+    seconds, loaded = measure_import("handlers")
+    assert seconds > 0
+    assert loaded == []
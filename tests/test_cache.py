@@ -0,0 +1,53 @@
+from cache import ResultCache, cache_key
+from pipeline import ConversionResult
+
+ROWS = [("Молочная кислота (лактат, E270)", 5.1160, 4.5000, 9.0000, "ммоль/моль креат.")]
+
+
+def make_result(size):
+    return ConversionResult(ROWS, "Анализ", {"png": b"p" * size})
+
+
+def test_cache_key_depends_on_content_and_renderer_version():
+    assert cache_key(b"pdf") == cache_key(b"pdf")
+    assert cache_key(b"pdf") != cache_key(b"other pdf")
+    assert cache_key(b"pdf", "1") != cache_key(b"pdf", "2")
+
+
+def test_result_cache_counts_hits_and_misses():
+    cache = ResultCache()
+    assert cache.get("a") is None
+    cache.put("a", make_result(10))
+    assert cache.get("a").rows == ROWS
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_result_cache_evicts_least_recently_used():
+    entry_size = make_result(1000).size
+    cache = ResultCache(max_bytes=entry_size * 2)
+    cache.put("a", make_result(1000))
+    cache.put("b", make_result(1000))
+    cache.get("a")
+    cache.put("c", make_result(1000))
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.evictions == 1
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_result_cache_skips_oversized_results():
+    cache = ResultCache(max_bytes=100)
+    cache.put("a", make_result(1000))
+    assert len(cache) == 0
+
+
+def test_result_cache_reaccounts_grown_results():
+    cache = ResultCache()
+    result = ConversionResult(ROWS, "Анализ")
+    cache.put("a", result)
+    result.outputs["pdf"] = b"p" * 1000
+    cache.put("a", result)
+    assert cache.current_bytes == result.size
@@ -0,0 +1,73 @@
+import os
+
+import convert
+from benchmarks.synthetic_report import AMINO_ACIDS, build_report_pdf, synthetic_rows
+from convert import WORKER_CRASHED, find_reports, main, run_batch
+
+
+def test_batch_convert_resumes(tmp_path, capsys):
+    archive = tmp_path / "archive"
+    (archive / "2023").mkdir(parents=True)
+    (archive / "a.pdf").write_bytes(build_report_pdf(synthetic_rows(10)))
+    (archive / "2023" / "b.pdf").write_bytes(build_report_pdf(synthetic_rows(12), AMINO_ACIDS))
+    (archive / "broken.pdf").write_bytes(b"not a pdf")
+    output = tmp_path / "charts"
+
+    assert main([str(archive), "-o", str(output), "-j", "2", "--text-backend", "pdfium"]) == 1
+    assert os.path.exists(output / "a.png") and os.path.exists(output / "a.pdf")
+    assert (output / "2023" / "b.png").read_bytes().startswith(b"\x89PNG")
+    assert not os.path.exists(output / "broken.png")
+    summary = capsys.readouterr().out
+    assert "Обработано файлов: 3, пропущено готовых: 0, ошибок: 1." in summary
+
+    # Failed reports are retried, finished ones are skipped.
+    (output / "a.pdf").unlink()
+    assert main([str(archive), "-o", str(output), "-j", "2", "--formats", "pdf"]) == 1
+    assert "Обработано файлов: 2, пропущено готовых: 1, ошибок: 1." in capsys.readouterr().out
+
+
+def test_find_reports_accepts_globs(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"%PDF")
+    (tmp_path / "b.txt").write_bytes(b"")
+    assert find_reports([str(tmp_path / "*.pdf"), str(tmp_path)]) == [str(tmp_path / "a.pdf")]
+
+
+def test_find_reports_matches_the_extension_in_any_case(tmp_path):
+    (tmp_path / "2023").mkdir()
+    for name in ("a.pdf", "B.PDF", "2023/c.Pdf", "d.txt"):
+        (tmp_path / name).write_bytes(b"%PDF")
+    assert find_reports([str(tmp_path)]) == [str(tmp_path / name) for name in ("2023/c.Pdf", "B.PDF", "a.pdf")]
+
+
+def test_batch_convert_survives_a_crashed_worker(tmp_path, monkeypatch, capsys):
+    convert_report = convert.convert_report
+
+    def crash_on_marker(content, *args):
+        if content.startswith(b"CRASH"):
+            os._exit(1)
+        return convert_report(content, *args)
+
+    # Workers are forked, so they inherit the patched function.
+    monkeypatch.setattr(convert, "convert_report", crash_on_marker)
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"{i}.pdf"
+        path.write_bytes(b"CRASH" if i == 2 else build_report_pdf(synthetic_rows(5)))
+        paths.append(str(path))
+
+    outcomes, skipped, _ = run_batch(paths, str(tmp_path / "charts"), ["pdf"], jobs=2, text_backend="pdfium")
+
+    assert sorted(outcome.path for outcome in outcomes) == paths
+    assert [outcome.path for outcome in outcomes if outcome.error] == [paths[2]]
+    assert [outcome.error for outcome in outcomes if outcome.error] == [WORKER_CRASHED]
+    assert all(outcome.rows == 5 for outcome in outcomes if not outcome.error)
+
+
+def test_batch_convert_writes_every_page(tmp_path, capsys):
+    (tmp_path / "a.pdf").write_bytes(build_report_pdf(synthetic_rows(12)))
+    output = tmp_path / "charts"
+
+    args = [str(tmp_path / "a.pdf"), "-o", str(output), "-j", "1", "--formats", "png", "--rows-per-page", "5"]
+    assert main(args) == 0
+
+    assert sorted(os.listdir(output)) == ["a.2.png", "a.3.png", "a.png"]
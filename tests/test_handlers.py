@@ -1,19 +1,27 @@
 import asyncio
 import os
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from telegram import CallbackQuery, Document, Message, Update, User
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
+from cache import ResultCache
+from history import AnalyteHistory
+from pdf_processing import ResultRow
+from pipeline import ConversionResult
+from scheduler import JobScheduler
 from handlers import (
+    get_job_index,
     handle_download,
     handle_file,
     handle_lab_selection,
     handle_non_pdf,
-    save_file,
+    handle_trends,
     start,
 )
+from storage import ArtifactStore
 
 
 @pytest.fixture
@@ -37,6 +45,11 @@ def update():
 def context():
     context = MagicMock(spec=CallbackContext)
     context.bot = MagicMock()
+    sent = MagicMock(spec=Message)
+    sent.document = Document(file_id="file-1", file_unique_id="unique-file-1")
+    context.bot.send_document = AsyncMock(return_value=sent)
+    context.bot_data = {}
+    context.user_data = {}
     return context
 
 
@@ -56,18 +69,6 @@ def test_handle_non_pdf(update, context):
     update.message.reply_text.assert_called_once()
 
 
-def test_save_file():
-    user_name = "test_user"
-    file_content = b"test_content"
-    extension = "pdf"
-    folder_type = "upload"
-    current_time = "2024-01-01_12-00-00"
-
-    file_path = save_file(user_name, file_content, extension, folder_type, current_time)
-
-    assert os.path.exists(file_path)
-
-
 def test_handle_file(update, context):
     document = Document(
         file_id="1234",
@@ -81,14 +82,210 @@ def test_handle_file(update, context):
     update.message.reply_text.assert_called_once()
 
 
-def test_handle_download(update, context):
+def test_handle_download(update, context, tmp_path):
     query = update.callback_query
-    query.data = "download_pdf_test_user_2024-01-01_12-00-00"
+    query.data = "download_pdf_tester_2024-01-01_12-00-00"
     query.message.chat_id = 12345
+    store = ArtifactStore(str(tmp_path))
+    store.put("tester", "2024-01-01_12-00-00", "output", "pdf", b"%PDF")
+    context.bot_data = {"artifact_store": store}
+
+    asyncio.run(handle_download(update, context))
+
+    query.answer.assert_called_once()
+    context.bot.send_document.assert_called_once()
+    assert context.bot.send_document.call_args.kwargs["document"] == b"%PDF"
+    query.message.reply_text.assert_called_once()
+
+
+def test_handle_download_with_a_user_name_containing_underscores(update, context, tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    store.put("user_name_", "2024-01-01_12-00-00", "output", "pdf", b"%PDF")
+    context.bot_data = {"artifact_store": store, "result_cache": ResultCache()}
+    job_id = get_job_index(context).add("user_name_", "2024-01-01_12-00-00", "key")
+    update.callback_query.data = f"download_pdf_{job_id}"
+    update.callback_query.message.chat_id = 12345
+
+    asyncio.run(handle_download(update, context))
+
+    assert context.bot.send_document.call_args.kwargs["document"] == b"%PDF"
+    assert context.bot.send_document.call_args.kwargs["filename"] == "2024-01-01_12-00-00.pdf"
+    assert get_job_index(context).file_id("key", "pdf") == "file-1"
+
+
+def test_rejected_file_id_falls_back_to_the_file(update, context):
+    result = ConversionResult([("Кислота", 1.0, 0.5, 2.0, "ед.")], "Анализ", outputs={"png": b"png"})
+    cache = ResultCache()
+    cache.put("key", result)
+    context.bot_data = {"result_cache": cache}
+    jobs = get_job_index(context)
+    jobs.set_file_id("key", "png", "stale")
+    update.callback_query.data = f"download_png_{jobs.add('tester', '2024-01-01_12-00-00', 'key')}"
+    sent = context.bot.send_document.return_value
+    context.bot.send_document.side_effect = [BadRequest("Wrong file identifier"), sent]
+
+    asyncio.run(handle_download(update, context))
+
+    assert context.bot.send_document.call_args.kwargs["document"] == b"png"
+    assert jobs.file_id("key", "png") == "file-1"
+
+
+def test_handle_download_of_paginated_png(update, context, tmp_path):
+    outputs = {"png": b"page 1", "2.png": b"page 2"}
+    result = ConversionResult([("Кислота", 1.0, 0.5, 2.0, "ед.")], "Анализ", outputs=dict(outputs))
+    cache = ResultCache()
+    cache.put("key", result)
+    context.bot_data = {"result_cache": cache}
+    jobs = get_job_index(context)
+    update.callback_query.data = f"download_png_{jobs.add('tester', '2024-01-01_12-00-00', 'key')}"
+
+    asyncio.run(handle_download(update, context))
+    asyncio.run(handle_download(update, context))
+
+    calls = context.bot.send_document.call_args_list
+    assert [call.kwargs["document"] for call in calls[:2]] == [b"page 1", b"page 2"]
+    assert [call.kwargs["filename"] for call in calls[:2]] == ["2024-01-01_12-00-00.png", "2024-01-01_12-00-00.2.png"]
+    # Both pages are sent again by file_id, without uploading them.
+    assert [call.kwargs["document"] for call in calls[2:]] == ["file-1", "file-1"]
+
+    store = ArtifactStore(str(tmp_path))
+    for key, content in outputs.items():
+        store.put("tester", "2024-01-01_12-00-00", "output", key, content)
+    context.bot_data = {"artifact_store": store}
+    context.bot.send_document.reset_mock()
+    update.callback_query.data = "download_png_tester_2024-01-01_12-00-00"
+
+    asyncio.run(handle_download(update, context))
+
+    assert [call.kwargs["document"] for call in context.bot.send_document.call_args_list] == [b"page 1", b"page 2"]
+
+
+def test_download_without_stored_files_renders_the_saved_rows(update, context):
+    rows = [ResultRow("Молочная кислота", 5.1, 4.5, 9.0, "ммоль/моль креат.")]
+    pool = MagicMock()
+    pool.render_report = AsyncMock(return_value={"pdf": b"%PDF"})
+    # Without an artifact store and with the result evicted from the cache.
+    context.bot_data = {"processing_pool": pool, "result_cache": ResultCache()}
+    jobs = get_job_index(context)
+    jobs.set_rows("key", "Анализ", rows)
+    update.callback_query.data = f"download_pdf_{jobs.add('tester', '2024-01-01_12-00-00', 'key')}"
+
+    asyncio.run(handle_download(update, context))
+
+    pool.render_report.assert_awaited_once_with(rows, "Анализ", ["pdf"])
+    assert context.bot.send_document.call_args.kwargs["document"] == b"%PDF"
+
+
+def test_handle_download_of_unknown_job(update, context):
+    update.callback_query.data = "download_pdf_abcdefgh"
+
+    asyncio.run(handle_download(update, context))
+
+    context.bot.send_document.assert_not_called()
+    assert "не найден" in update.callback_query.message.reply_text.call_args.args[0]
+
+
+def test_handle_download_of_missing_file(update, context, tmp_path):
+    update.callback_query.data = "download_png_tester_2024-01-01_12-00-00"
+    context.bot_data = {"artifact_store": ArtifactStore(str(tmp_path))}
+
+    asyncio.run(handle_download(update, context))
+
+    context.bot.send_document.assert_not_called()
+    assert "не найден" in update.callback_query.message.reply_text.call_args.args[0]
+
+
+def test_handle_file_runs_pool(update, context, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    file = MagicMock()
+    file.download_as_bytearray = AsyncMock(return_value=bytearray(b"%PDF"))
+    document = MagicMock(spec=Document)
+    document.file_size = 1000
+    document.get_file = AsyncMock(return_value=file)
+    update.message.document = document
+    pool = MagicMock()
+    rows = [("Молочная кислота", 5.1, 4.5, 9.0, "ммоль/моль креат.")]
+    pool.parse_report = AsyncMock(return_value=ConversionResult(rows, "Анализ", profile="helix_organic_acids"))
+    pool.render_report = AsyncMock(return_value={"png": b"png"})
+    context.bot_data = {"processing_pool": pool, "result_cache": ResultCache()}
+
+    asyncio.run(handle_file(update, context))
+    asyncio.run(handle_file(update, context))
+
+    pool.parse_report.assert_awaited_once()
+    pool.render_report.assert_not_awaited()
+    assert context.bot_data["result_cache"].hits == 1
+    assert update.message.reply_text.call_count == 4
+    assert "reply_markup" in update.message.reply_text.call_args.kwargs
+    assert update.message.reply_text.call_args.args[0].startswith("Helix, Анализ.")
+    assert not os.path.exists("files")
+
+    button = update.message.reply_text.call_args.kwargs["reply_markup"].inline_keyboard[0][0]
+    assert len(button.callback_data.encode()) <= 64
+    update.callback_query.data = button.callback_data
+    asyncio.run(handle_download(update, context))
+    asyncio.run(handle_download(update, context))
+    pool.render_report.assert_awaited_once_with(rows, "Анализ", ["png"])
+    first, second = context.bot.send_document.call_args_list
+    assert first.kwargs["document"] == b"png"
+    # The second download sends the file Telegram already has.
+    assert second.kwargs["document"] == "file-1"
+
+    metrics = context.bot_data["metrics"]
+    assert metrics.counter("jobs", kind="upload") == 2
+    assert metrics.counter("jobs", kind="download") == 2
+    assert metrics.counter("rows_parsed") == 1
+    assert metrics.histogram("parse").count == 1
+    assert metrics.histogram("render").count == 1
+    assert metrics.histogram("send_document").count == 1
+    assert metrics.counter("file_id_cache_hits") == 1
+
+
+def test_handle_file_rejected_when_queue_is_full(update, context, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    file = MagicMock()
+    file.download_as_bytearray = AsyncMock(return_value=bytearray(b"%PDF"))
+    document = MagicMock(spec=Document)
+    document.file_size = 1000
+    document.get_file = AsyncMock(return_value=file)
+    update.message.document = document
+    pool = MagicMock()
+    pool.parse_report = AsyncMock()
+    scheduler = JobScheduler(max_concurrent=1, max_queue_length=0)
+    scheduler.running = 1
+    context.bot_data = {"processing_pool": pool, "result_cache": ResultCache(), "scheduler": scheduler}
+
+    asyncio.run(handle_file(update, context))
+
+    pool.parse_report.assert_not_called()
+    assert "очередь заполнена" in update.message.reply_text.call_args.args[0]
+
+
+def test_handle_trends(update, context):
+    row = ResultRow("Молочная кислота", 5.1, 4.5, 9.0, "ммоль/моль креат.")
+    history = AnalyteHistory()
+    pool = MagicMock()
+    pool.render_trends = AsyncMock(return_value={"png": b"png"})
+    context.args = []
+    context.bot_data = {"processing_pool": pool, "analyte_history": history}
+    update.message.from_user = User(id=1, is_bot=False, first_name="Test", username="tester")
+
+    history.add_report("tester", "2024-01-10", [row], "k1")
+    asyncio.run(handle_trends(update, context))
+    assert "хотя бы два отчета" in update.message.reply_text.call_args.args[0]
+    pool.render_trends.assert_not_awaited()
+
+    history.add_report("tester", "2024-03-15", [row._replace(value=9.5)], "k2")
+    asyncio.run(handle_trends(update, context))
+    asyncio.run(handle_trends(update, context))
+    pool.render_trends.assert_awaited_once()
+    first, second = context.bot.send_document.call_args_list
+    assert first.kwargs["document"] == b"png"
+    assert second.kwargs["document"] == "file-1"
 
-    with patch("handlers.os.path.exists", return_value=True):
-        with patch("builtins.open", new_callable=MagicMock):
-            asyncio.run(handle_download(update, context))
-            query.answer.assert_called_once()
-            context.bot.send_document.assert_called_once()
-            query.message.reply_text.assert_called_once()
+    # A new report changes the chart, so it is rendered again.
+    history.add_report("tester", "2024-05-20", [row], "k3")
+    asyncio.run(handle_trends(update, context))
+    assert pool.render_trends.await_count == 2
+    series = pool.render_trends.call_args.args[0]
+    assert [point.report_date for point in series[(row.name, row.unit)]] == ["2024-01-10", "2024-03-15", "2024-05-20"]
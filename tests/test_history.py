@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+from history import AnalyteHistory, TrendPoint
+from pdf_processing import ResultRow
+
+LACTATE = ResultRow("Молочная кислота (лактат, E270)", 5.1, 4.5, 9.0, "ммоль/моль креат.")
+CITRATE = ResultRow("Лимонная кислота", 120.0, None, None, None)
+
+
+def test_series_by_analyte_and_date():
+    history = AnalyteHistory()
+    history.add_report("alice", "2024-03-15", [LACTATE, CITRATE], "k2")
+    history.add_report("alice", "2024-01-10", [LACTATE._replace(value=9.5)], "k1")
+    history.add_report("bob", "2024-02-01", [LACTATE], "k3")
+
+    series = history.series("alice")
+
+    assert series[(LACTATE.name, LACTATE.unit)] == [
+        TrendPoint("2024-01-10", 9.5, 4.5, 9.0),
+        TrendPoint("2024-03-15", 5.1, 4.5, 9.0),
+    ]
+    assert series[(CITRATE.name, "")] == [TrendPoint("2024-03-15", 120.0, None, None)]
+    assert history.report_dates("alice") == ["2024-01-10", "2024-03-15"]
+    assert list(history.series("alice", min_points=2)) == [(LACTATE.name, LACTATE.unit)]
+    assert list(history.series("alice", analyte="ЛИМОН")) == [(CITRATE.name, "")]
+
+
+def test_same_report_twice_replaces_rows_and_changes_revision():
+    history = AnalyteHistory()
+    assert history.revision("alice") == 0
+    history.add_report("alice", "2024-03-15", [LACTATE], "k1")
+    first = history.revision("alice")
+
+    history.add_report("alice", "2024-03-15", [LACTATE._replace(value=6.0)], "k1")
+
+    assert history.revision("alice") != first
+    assert history.series("alice")[(LACTATE.name, LACTATE.unit)] == [TrendPoint("2024-03-15", 6.0, 4.5, 9.0)]
+
+
+def test_undated_reports_of_one_day_are_kept_apart():
+    history = AnalyteHistory()
+    history.add_report("alice", "2024-03-15", [LACTATE], "k1", undated=True)
+    history.add_report("alice", "2024-03-15", [LACTATE._replace(value=6.0)], "k2", undated=True)
+    history.add_report("alice", "2024-03-15", [LACTATE._replace(value=7.0)], "k2", undated=True)
+
+    assert history.series("alice")[(LACTATE.name, LACTATE.unit)] == [
+        TrendPoint("2024-03-15", 5.1, 4.5, 9.0),
+        TrendPoint("2024-03-15", 7.0, 4.5, 9.0),
+    ]
+
+
+def test_failed_report_is_rolled_back():
+    history = AnalyteHistory()
+    with pytest.raises(sqlite3.IntegrityError):
+        history.add_report("alice", "2024-03-15", [CITRATE, LACTATE._replace(value=None)], "k1")
+
+    history.add_report("alice", "2024-04-01", [LACTATE], "k2")
+
+    assert history.report_dates("alice") == ["2024-04-01"]
+
+
+def test_history_survives_reopening(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    history = AnalyteHistory(path)
+    history.add_report("alice", "2024-03-15", [LACTATE], "k1")
+    history.close()
+    assert AnalyteHistory(path).report_dates("alice") == ["2024-03-15"]
+
+
+def test_history_keys_old_rows_by_report_date(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    db = sqlite3.connect(path)
+    db.executescript(
+        "CREATE TABLE results (user TEXT NOT NULL, analyte TEXT NOT NULL, unit TEXT NOT NULL, "
+        "report_date TEXT NOT NULL, value REAL NOT NULL, ref_min REAL, ref_max REAL, result_key TEXT NOT NULL, "
+        "PRIMARY KEY (user, analyte, unit, report_date));"
+        "CREATE INDEX results_user_date ON results (user, report_date);"
+    )
+    db.execute("INSERT INTO results VALUES ('alice', ?, ?, '2024-03-15', 5.1, 4.5, 9.0, 'k1')", LACTATE[::4])
+    db.commit()
+    db.close()
+
+    history = AnalyteHistory(path)
+    history.add_report("alice", "2024-03-15", [LACTATE._replace(value=6.0)], "k2")
+
+    assert history.series("alice")[(LACTATE.name, LACTATE.unit)] == [TrendPoint("2024-03-15", 6.0, 4.5, 9.0)]
@@ -0,0 +1,75 @@
+import asyncio
+
+from http_server import HTTPServer, Response
+
+
+async def echo(request):
+    return Response(body=request.body or request.path.encode())
+
+
+async def request(port, raw):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    responses = []
+    try:
+        while True:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 2)
+            headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n")[1:] if line)
+            body = await reader.readexactly(int(headers["Content-Length"]))
+            responses.append((int(head.split()[1]), body))
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        pass
+    writer.close()
+    return responses
+
+
+def run_with_server(scenario, **kwargs):
+    async def main():
+        server = HTTPServer({("POST", "/echo"): echo, ("GET", "/echo"): echo}, **kwargs)
+        await server.start()
+        try:
+            return await scenario(server.port)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_keep_alive_serves_several_requests():
+    raw = (
+        b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+        b"GET /echo?x=1 HTTP/1.1\r\n\r\n"
+        b"GET /missing HTTP/1.1\r\n\r\n"
+        b"DELETE /echo HTTP/1.1\r\nConnection: close\r\n\r\n"
+    )
+    responses = run_with_server(lambda port: request(port, raw))
+    assert responses == [(200, b"hello"), (200, b"/echo"), (404, b"Not Found"), (405, b"Method Not Allowed")]
+
+
+def test_body_over_limit_is_rejected_before_reading():
+    raw = b"POST /echo HTTP/1.1\r\nContent-Length: 100\r\n\r\n"
+    responses = run_with_server(lambda port: request(port, raw), max_body_size=10)
+    assert responses[0][0] == 413
+
+
+async def slow_upload(port, pause):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 10\r\nConnection: close\r\n\r\nhello")
+    await writer.drain()
+    await asyncio.sleep(pause)
+    writer.write(b"world")
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), 2)
+    writer.close()
+    return response
+
+
+def test_slow_body_is_not_cut_off_by_the_keep_alive_timeout():
+    response = run_with_server(lambda port: slow_upload(port, 0.3), keep_alive_timeout=0.1)
+    assert response.startswith(b"HTTP/1.1 200 OK") and response.endswith(b"helloworld")
+
+
+def test_body_timeout_is_answered_with_408():
+    response = run_with_server(lambda port: slow_upload(port, 0.3), body_timeout=0.1)
+    assert response.startswith(b"HTTP/1.1 408 Request Timeout")
@@ -0,0 +1,53 @@
+from jobs import Job, JobIndex
+from pdf_processing import ResultRow
+
+
+def test_job_ids_are_short_and_unique():
+    index = JobIndex()
+    ids = {index.add("user_name", "2024-01-01_12-00-00", "2:abc") for _ in range(100)}
+    assert len(ids) == 100
+    assert max(len(job_id) for job_id in ids) <= 8
+    assert index.get(ids.pop()) == Job("user_name", "2024-01-01_12-00-00", "2:abc")
+
+
+def test_unknown_and_legacy_job_ids():
+    index = JobIndex()
+    assert index.get("abcdefgh") is None
+    assert index.get("user_name_2024-01-01_12-00-00") == Job("user_name", "2024-01-01_12-00-00", None)
+
+
+def test_expired_jobs_are_dropped():
+    index = JobIndex(ttl=100)
+    old = index.add("alice", "t1", "k1", now=1000)
+    index.set_file_id("k1", "png", "file-1", now=1000)
+    index.set_rows("k1", "Анализ", [], now=1000)
+    new = index.add("alice", "t2", "k2", now=1200)
+    assert index.get(old) is None
+    assert index.file_id("k1", "png") is None
+    assert index.rows("k1") is None
+    assert index.get(new) is not None
+
+
+def test_file_ids(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    index = JobIndex(path)
+    index.set_file_id("k1", "png", "file-1")
+    index.close()
+
+    index = JobIndex(path)
+    assert index.file_id("k1", "png") == "file-1"
+    assert index.file_id("k1", "pdf") is None
+    index.forget_file_id("k1", "png")
+    assert index.file_id("k1", "png") is None
+
+
+def test_rows(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    rows = [ResultRow("Лактат", 5.1, 4.5, 9.0, "ммоль/л"), ResultRow("Соотношение", 0.3, None, None, None)]
+    index = JobIndex(path)
+    index.set_rows("k1", "Анализ", rows)
+    index.close()
+
+    index = JobIndex(path)
+    assert index.rows("k1") == ("Анализ", rows)
+    assert index.rows("k2") is None
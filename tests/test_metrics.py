@@ -0,0 +1,70 @@
+import asyncio
+import urllib.request
+
+from metrics import Histogram, Metrics, format_value, start_metrics_server
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    lines = histogram.render("latency", (("stage", "parse"),))
+
+    assert lines[:3] == [
+        'latency_bucket{stage="parse",le="0.1"} 2',
+        'latency_bucket{stage="parse",le="1"} 3',
+        'latency_bucket{stage="parse",le="+Inf"} 4',
+    ]
+    assert lines[-1] == 'latency_count{stage="parse"} 4'
+
+
+def test_metrics_render():
+    metrics = Metrics()
+    with metrics.time("get_file"):
+        pass
+    metrics.observe_all({"extract": 0.2, "savefig_png": 0.3})
+    metrics.inc("jobs", kind="upload")
+    metrics.inc("jobs", kind="upload")
+    metrics.inc("rows_parsed", 40)
+    metrics.add_gauge("result_cache_bytes", lambda: 1024)
+
+    text = metrics.render()
+
+    assert metrics.histogram("get_file").count == 1
+    assert 'bot_stage_duration_seconds_count{stage="savefig_png"} 1' in text
+    assert 'bot_jobs_total{kind="upload"} 2' in text
+    assert "bot_rows_parsed_total 40" in text
+    assert "bot_result_cache_bytes 1024" in text
+
+
+def test_metrics_render_exact_values():
+    metrics = Metrics()
+    metrics.inc("output_bytes", 123456789)
+    metrics.inc("output_bytes", 1)
+    metrics.add_gauge("worker_rss_bytes", lambda: 2.0 ** 40)
+
+    text = metrics.render()
+
+    assert "bot_output_bytes_total 123456790" in text
+    assert "bot_worker_rss_bytes 1099511627776" in text
+    assert format_value(0.1 + 0.2) == "0.30000000000000004"
+    assert format_value(float("inf")) == "+Inf"
+
+
+def test_metrics_endpoint():
+    metrics = Metrics()
+    metrics.inc("jobs", kind="download")
+
+    async def scenario():
+        server = await start_metrics_server(metrics, "127.0.0.1", 0)
+        try:
+            url = f"http://127.0.0.1:{server.port}/metrics"
+            response = await asyncio.to_thread(urllib.request.urlopen, url)
+            return response.headers["Content-Type"], response.read().decode()
+        finally:
+            await server.stop()
+
+    content_type, body = asyncio.run(scenario())
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert 'bot_jobs_total{kind="download"} 1' in body
@@ -1,10 +1,20 @@
+import logging
+import os
+
 import pytest
 
+from benchmarks.synthetic_report import AMINO_ACIDS, ORGANIC_ACIDS, build_report_pdf, expected_line, synthetic_rows
 from pdf_processing import (
+    TEXT_BACKENDS,
+    ResultRow,
     create_dataframe,
     extract_analysis_name,
     extract_data_from_all_pages,
     extract_data_from_page,
+    extract_report_date,
+    open_pdf,
+    parse_line,
+    parse_line_with_patterns,
 )
 
 sample_text = """
@@ -30,6 +40,11 @@ def test_extract_analysis_name():
     assert analysis_name == "Доктор Айболит"
 
 
+def test_extract_report_date():
+    assert extract_report_date("ИНЗ: 1234567890 Дата взятия образца: 15.03.2024 09:40") == "2024-03-15"
+    assert extract_report_date("Дата рождения: 12.03.1986") == ""
+
+
 def test_extract_data_from_page():
     data = extract_data_from_page(sample_text)
     assert len(data) == 1
@@ -60,6 +75,12 @@ def test_extract_data_from_page_ratio():
     assert data[0] == ("Лимонная кислота/Янтарная кислота", 1.23, 0.9, 1.5, None)
 
 
+def test_parsed_rows_are_result_records():
+    row = extract_data_from_page(sample_text_less_than)[0]
+    assert isinstance(row, ResultRow)
+    assert (row.name, row.value, row.ref_min, row.ref_max) == ("Молочная кислота (лактат, E270)", 5.116, 0.0, 1.38)
+
+
 @pytest.fixture
 def mock_pdf(mocker):
     pdf = mocker.MagicMock()
@@ -105,3 +126,101 @@ def test_extract_data_from_page_less_than():
         1.38,
         "ммоль/моль креат.",
     )
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "helix_pages.txt")
+
+tricky_lines = [
+    "",
+    "Страница 1 из 3",
+    "Биоматериал: моча, разовая порция 12.5 мл",
+    "Молочная кислота  5.1160 ммоль/моль креат.  Референсные значения не определены",
+    "Молочная кислота/лактат 5.1160 ммоль/моль креат. Референсные значения не определены",
+    "Кислота; вариант 5.1160 ммоль/моль креат. <1.38",
+    "Кислота 5.1160<1.38",
+    "Кислота 5,1160 ммоль/л 1.0 - 2.0",
+    "Кислота 2 типа 5.1 ммоль/л 1.0 - 2.0",
+    "Кислота 1 0.9 - 1.5",
+    "Кислота 5.1160 ммоль/л 4.5 - 9.0 *",
+    "Кислота 5.1160 ммоль/л 4.5 -",
+    "  Кислота 5.1160 ммоль/л 4.5 - 9.0",
+    "Пировиноградная кислота 0.00 ммоль/моль креат. не обнаружено",
+]
+
+
+def outcome(parse, line):
+    try:
+        return parse(line)
+    except Exception as e:
+        return type(e)
+
+
+def test_parse_line_matches_pattern_cascade():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        lines = f.read().replace("\f", "").split("\n") + tricky_lines
+    for line in lines:
+        assert outcome(parse_line, line) == outcome(parse_line_with_patterns, line), line
+
+
+def test_parse_line_rejects_header_lines():
+    assert parse_line("Пациент: Иванова Мария Петровна ИНЗ: 1234567890") is None
+    assert parse_line("Результаты исследований не являются диагнозом.") is None
+
+
+@pytest.mark.parametrize("analysis_name", [ORGANIC_ACIDS, AMINO_ACIDS])
+def test_text_backends_extract_the_same_rows(analysis_name):
+    content = build_report_pdf(synthetic_rows(60), analysis_name)
+    pages = {}
+    for backend in TEXT_BACKENDS:
+        with open_pdf(content, backend) as pdf:
+            pages[backend] = [extract_data_from_page(page.extract_text()) for page in pdf.pages]
+    assert len(pages["pdfium"]) == 2
+    assert pages["pdfium"] == pages["pdfplumber"]
+
+
+def test_pdfium_backend_reads_table_lines():
+    rows = synthetic_rows(10)
+    with open_pdf(build_report_pdf(rows), "pdfium") as pdf:
+        data, analysis_name = extract_data_from_all_pages(pdf)
+        text = pdf.pages[0].extract_text()
+    assert analysis_name == ORGANIC_ACIDS
+    lines = text.split("\n")
+    assert all(expected_line(row) in lines for row in rows)
+    assert len(data) == len(rows)
+
+
+def test_open_pdf_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        open_pdf(b"%PDF", "pdfminer")
+
+
+@pytest.mark.parametrize("backend", TEXT_BACKENDS)
+def test_report_region_skips_header_footer_and_appendix(backend, caplog):
+    rows = synthetic_rows(50)
+    content = build_report_pdf(rows, appendix_pages=2)
+    with open_pdf(content, backend) as pdf:
+        with caplog.at_level(logging.WARNING):
+            full_data, _ = extract_data_from_all_pages(pdf)
+        full_warnings = len(caplog.records)
+        caplog.clear()
+        with caplog.at_level(logging.WARNING):
+            data, analysis_name = extract_data_from_all_pages(pdf, "helix")
+    assert analysis_name == ORGANIC_ACIDS
+    assert len(data) == len(rows)
+    # The example result on the appendix pages is only picked up when reading past the end marker.
+    assert full_data[: len(rows)] == data
+    assert len(full_data) == len(rows) + 2
+    assert len(caplog.records) < full_warnings / 3
+
+
+def test_report_region_falls_back_to_whole_pages(mocker):
+    page = mocker.MagicMock(width=595, height=842, bbox=(0, 0, 595, 842))
+    page.crop.return_value.extract_text.return_value = "Пациент: Иванова Мария Петровна"
+    page.extract_text.return_value = sample_text
+    pdf = mocker.MagicMock()
+    pdf.pages = [page]
+
+    data, analysis_name = extract_data_from_all_pages(pdf, "helix")
+
+    assert analysis_name == "Доктор Айболит"
+    assert len(data) == 1
@@ -0,0 +1,284 @@
+import asyncio
+import io
+import os
+import time
+import tracemalloc
+
+import pdfplumber
+import pytest
+from PIL import Image
+
+from benchmarks.synthetic_report import AMINO_ACIDS, build_report_pdf, synthetic_rows
+from metrics import Metrics
+from pipeline import (
+    WARM_UP_ROW,
+    PipelineTimeout,
+    ProcessingPool,
+    WorkerCrashed,
+    convert_report,
+    output_pages,
+    parse_report,
+    render_report,
+    run_timed,
+)
+from tests.test_raster import report_rows
+
+
+def square(x):
+    return x * x
+
+
+def sleep_forever():
+    time.sleep(60)
+
+
+def crash():
+    os._exit(1)
+
+
+def worker_pid(timings):
+    return os.getpid()
+
+
+def test_processing_pool_runs_job():
+    pool = ProcessingPool(size=1, job_timeout=30)
+    try:
+        assert asyncio.run(pool.run(square, 7)) == 49
+    finally:
+        pool.shutdown()
+
+
+def test_processing_pool_timeout_restarts_pool():
+    pool = ProcessingPool(size=1, job_timeout=0.5)
+
+    async def scenario():
+        with pytest.raises(PipelineTimeout):
+            await pool.run(sleep_forever)
+        pool.job_timeout = 30
+        return await pool.run(square, 3)
+
+    try:
+        assert asyncio.run(scenario()) == 9
+    finally:
+        pool.shutdown()
+
+
+def test_processing_pool_crashed_worker():
+    pool = ProcessingPool(size=1, job_timeout=30)
+
+    async def scenario():
+        with pytest.raises(WorkerCrashed):
+            await pool.run(crash)
+        return await pool.run(square, 4)
+
+    try:
+        assert asyncio.run(scenario()) == 16
+    finally:
+        pool.shutdown()
+
+
+def test_processing_pool_rejects_empty_size():
+    with pytest.raises(ValueError):
+        ProcessingPool(size=0)
+
+
+def test_convert_report_without_rows(mocker):
+    pdf = mocker.MagicMock()
+    pdf.pages = []
+    mocker.patch("pdfplumber.open").return_value.__enter__.return_value = pdf
+
+    result = convert_report(b"%PDF")
+
+    assert result.rows == []
+    assert result.outputs == {}
+
+
+def test_convert_report_renders_in_memory(mocker):
+    page = mocker.MagicMock(bbox=(0, 0, 600, 800), width=600, height=800)
+    # The first page is read as the bands above, in and below the results table.
+    page.crop.return_value.extract_text.side_effect = [
+        "",
+        "(врач): Органические кислоты Метод: ВЭЖХ\n"
+        "Молочная кислота (лактат, E270) 5.1160 ммоль/моль креат. 4.5000 - 9.0000\n",
+        "",
+    ]
+    pdf = mocker.MagicMock()
+    pdf.pages = [page]
+    mocker.patch("pdfplumber.open").return_value.__enter__.return_value = pdf
+
+    result = convert_report(b"%PDF")
+
+    assert len(result.rows) == 1
+    assert result.analysis_name == "Органические кислоты"
+    assert result.profile == ""
+    assert result.outputs["png"].startswith(b"\x89PNG")
+    assert result.outputs["pdf"].startswith(b"%PDF")
+
+
+def test_render_report_only_requested_format():
+    rows = [("Молочная кислота (лактат, E270)", 5.1160, 4.5000, 9.0000, "ммоль/моль креат.")]
+    outputs = render_report(rows, "Анализ", ["pdf"])
+    assert list(outputs) == ["pdf"]
+    with pytest.raises(ValueError):
+        render_report(rows, "Анализ", ["svg"])
+
+
+def test_render_report_with_pillow():
+    rows = [("Молочная кислота (лактат, E270)", 5.1160, 4.5000, 9.0000, "ммоль/моль креат.")]
+    timings = {}
+
+    outputs = render_report(rows, "Анализ", ["png"], "pillow", timings=timings)
+
+    assert outputs["png"].startswith(b"\x89PNG")
+    assert "figure_raster" in timings
+    assert "figure" not in timings
+
+    outputs = render_report(rows, "Анализ", ["png", "pdf"], "pillow")
+    assert outputs["png"].startswith(b"\x89PNG")
+    assert outputs["pdf"].startswith(b"%PDF")
+
+
+def test_processing_pool_rejects_unknown_png_renderer():
+    with pytest.raises(ValueError):
+        ProcessingPool(png_renderer="cairo")
+    assert ProcessingPool(png_renderer="pillow").renderer_version != ProcessingPool().renderer_version
+
+
+def test_render_report_splits_long_reports_into_pages():
+    outputs = render_report(report_rows(12), "Анализ", ["png", "pdf"], rows_per_page=5)
+
+    assert output_pages(outputs, "png") == ["png", "2.png", "3.png"]
+    assert output_pages(outputs, "pdf") == ["pdf"]
+    with pdfplumber.open(io.BytesIO(outputs["pdf"])) as pdf:
+        assert len(pdf.pages) == 3
+    heights = [Image.open(io.BytesIO(outputs[key])).height for key in ("png", "2.png", "3.png")]
+    assert heights[0] == heights[1] > heights[2]
+
+
+def peak_rendering_memory(rows, rows_per_page):
+    """Peak traced memory of rendering, without the outputs themselves."""
+    tracemalloc.start()
+    try:
+        outputs = render_report(rows, "Анализ", ["png", "pdf"], rows_per_page=rows_per_page)
+        return tracemalloc.get_traced_memory()[1] - sum(map(len, outputs.values()))
+    finally:
+        tracemalloc.stop()
+
+
+def test_paginated_rendering_caps_peak_memory():
+    # Load fonts and caches first, so they are not counted for the first report.
+    render_report(report_rows(8), "Анализ", ["png", "pdf"])
+
+    one_page = peak_rendering_memory(report_rows(8), rows_per_page=8)
+    five_pages = peak_rendering_memory(report_rows(40), rows_per_page=8)
+
+    assert five_pages < 1.5 * one_page
+
+
+def test_prewarm_warms_up_every_worker():
+    metrics = Metrics()
+    pool = ProcessingPool(size=3, job_timeout=60, text_backend="pdfium", metrics=metrics)
+
+    try:
+        seconds = asyncio.run(pool.prewarm())
+        pids = pool._worker_pids()
+    finally:
+        pool.shutdown()
+
+    assert seconds > 0
+    assert len(pids) == 3
+    assert metrics.histogram("worker_warm_up").count == 3
+
+
+def test_processing_pool_records_stage_timings():
+    metrics = Metrics()
+    pool = ProcessingPool(size=1, job_timeout=60, text_backend="pdfium", metrics=metrics)
+    content = build_report_pdf(synthetic_rows(10))
+
+    try:
+        result = asyncio.run(pool.convert_report(content, ["png"]))
+    finally:
+        pool.shutdown()
+
+    assert result.pages == 1
+    for stage in ("extract", "figure", "savefig_png"):
+        assert metrics.histogram(stage).count == 1
+    assert metrics.histogram("savefig_pdf") is None
+
+
+def test_run_timed_reports_job_memory():
+    result, timings, memory = run_timed(render_report, [WARM_UP_ROW], "", ["png"])
+
+    assert result["png"].startswith(b"\x89PNG") and "savefig_png" in timings
+    assert memory.pid == os.getpid() and memory.rss > 0
+    assert memory.traced_peak is None
+
+    tracemalloc.start()
+    try:
+        _, _, memory = run_timed(render_report, report_rows(20), "", ["png"])
+    finally:
+        tracemalloc.stop()
+    assert memory.traced_peak > 1024 * 1024
+
+
+def test_processing_pool_recycles_workers_after_max_jobs():
+    metrics = Metrics()
+    pool = ProcessingPool(size=1, job_timeout=60, metrics=metrics, max_jobs_per_worker=2)
+
+    async def run_jobs():
+        return [await pool.run_timed(worker_pid) for _ in range(3)]
+
+    try:
+        pids = asyncio.run(run_jobs())
+    finally:
+        pool.shutdown()
+
+    assert pids[0] == pids[1] != pids[2]
+    assert metrics.counter("worker_pool_recycles", reason="jobs") == 1
+
+
+def test_processing_pool_warms_up_the_replacement_pool():
+    metrics = Metrics()
+    pool = ProcessingPool(size=1, job_timeout=60, metrics=metrics, max_jobs_per_worker=1)
+
+    async def recycle():
+        first = await pool.run_timed(worker_pid)
+        await pool._prewarm_task
+        warmed = pool._worker_pids()
+        return first, warmed, await pool.run_timed(worker_pid)
+
+    try:
+        first, warmed, second = asyncio.run(recycle())
+    finally:
+        pool.shutdown()
+
+    assert warmed == [second] and second != first
+    assert metrics.histogram("worker_warm_up").count == 1
+
+
+def test_processing_pool_recycles_workers_over_memory_limit():
+    metrics = Metrics()
+    pool = ProcessingPool(size=1, job_timeout=60, metrics=metrics, max_worker_rss=1, trace_memory=True)
+
+    async def run_jobs():
+        return [await pool.run_timed(worker_pid) for _ in range(2)]
+
+    try:
+        pids = asyncio.run(run_jobs())
+    finally:
+        pool.shutdown()
+
+    assert pids[0] != pids[1]
+    assert metrics.counter("worker_pool_recycles", reason="memory") == 2
+    assert metrics.counter("worker_traced_peak_bytes", job="worker_pid") > 0
+    assert pool.max_rss() > 0
+
+
+def test_parse_report_detects_profile():
+    content = build_report_pdf(synthetic_rows(40), AMINO_ACIDS, appendix_pages=1)
+
+    result = parse_report(content, "pdfium")
+
+    assert result.profile == "helix_amino_acids"
+    assert result.analysis_name == AMINO_ACIDS
+    assert len(result.rows) == 40
@@ -1,9 +1,25 @@
+import io
 import os
+import warnings
 
+import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+import pypdfium2
 import pytest
+from matplotlib.figure import Figure
+from PIL import Image
 
-from plotting import plot_scales_with_adjusted_ref_labels_spacing
+from history import TrendPoint
+from layout import FIGURE_HEIGHT_PER_PLOT, ReportTexts, compute_layout, scale_limits
+from pdf_processing import ResultRow, create_dataframe
+from plotting import (
+    is_out_of_range,
+    owned_figure,
+    plot_scales,
+    plot_scales_with_adjusted_ref_labels_spacing,
+    plot_trends,
+)
 
 
 @pytest.fixture
@@ -26,3 +42,138 @@ def test_plot_scales_with_adjusted_ref_labels_spacing(sample_dataframe):
     # Дополнительно, можно проверить наличие файлов test.png и test.pdf
     assert os.path.exists("test.png")
     assert os.path.exists("test.pdf")
+
+
+@pytest.fixture
+def report_rows():
+    rows = []
+    for i in range(20):
+        kind = i % 4
+        if kind == 0:
+            rows.append((f"Молочная кислота {i} (лактат, E270)", 5.116 + i, 4.5, 9.0, "ммоль/моль креат."))
+        elif kind == 1:
+            rows.append((f"Кислота {i}", 1.2, None, None, "мкмоль/л"))
+        elif kind == 2:
+            rows.append((f"Не найдено {i}", 0.0, 0.0, 0.0, "ммоль/л"))
+        else:
+            rows.append((f"Соотношение {i}", 0.3, 0.0, 1.38, None))
+    return rows
+
+
+def test_legacy_renderer_does_not_keep_pyplot_figures(sample_dataframe):
+    plot_scales_with_adjusted_ref_labels_spacing(sample_dataframe, "Анализ", io.BytesIO(), io.BytesIO())
+    assert plt.get_fignums() == []
+
+
+def test_figures_are_released_when_saving_fails(mocker):
+    savefig = mocker.patch.object(Figure, "savefig", autospec=True, side_effect=OSError("disk full"))
+    with pytest.raises(OSError):
+        plot_scales([ResultRow("Лактат", 5.1, 4.5, 9.0, "ммоль/л")], "Анализ", save_path_pdf=io.BytesIO())
+    failed_figure = savefig.call_args.args[0]
+    assert failed_figure.axes == []
+
+    with pytest.raises(RuntimeError):
+        with owned_figure() as fig:
+            fig.add_subplot()
+            raise RuntimeError
+    assert fig.axes == []
+
+
+def test_plot_scales_writes_png_and_pdf():
+    rows = [ResultRow("Молочная кислота (лактат, E270)", 5.116, 4.5, 9.0, "ммоль/моль креат.")]
+    png, pdf = io.BytesIO(), io.BytesIO()
+    plot_scales(rows, "Анализ", save_path_png=png, save_path_pdf=pdf)
+    assert png.getvalue().startswith(b"\x89PNG")
+    assert pdf.getvalue().startswith(b"%PDF")
+
+
+def test_pdf_draws_bars_as_vector_shading(report_rows):
+    png, pdf = io.BytesIO(), io.BytesIO()
+    plot_scales(report_rows[:6], "Анализ", save_path_png=png, save_path_pdf=pdf)
+
+    assert b"/ShadingType 4" in pdf.getvalue()
+    assert b"/Subtype /Image" not in pdf.getvalue()
+    page = pypdfium2.PdfDocument(pdf.getvalue())[0]
+    pdf_pixels = np.asarray(page.render(scale=100 / 72).to_pil().convert("RGB"), dtype=int)
+    png_pixels = np.asarray(Image.open(png).convert("RGB"), dtype=int)
+    assert pdf_pixels.shape == png_pixels.shape
+    assert (np.abs(pdf_pixels - png_pixels).max(axis=2) > 64).mean() < 0.03
+
+
+@pytest.mark.parametrize("long_names", [False, True])
+def test_plot_scales_matches_gridspec_renderer(report_rows, long_names):
+    if long_names:
+        # Long ratio names widen the name column, and without a bar in the last row the bottom margin shrinks.
+        ratio = "Гомованилиновая кислота/Ванилилминдальная кислота"
+        report_rows = [(f"{ratio} {i}", *row[1:]) if i % 4 == 3 else row for i, row in enumerate(report_rows[:-1])]
+    legacy, new = io.BytesIO(), io.BytesIO()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        plot_scales_with_adjusted_ref_labels_spacing(create_dataframe(report_rows), "Анализ", legacy, io.BytesIO())
+    plot_scales(report_rows, "Анализ", new, io.BytesIO())
+
+    legacy_pixels = np.asarray(Image.open(legacy).convert("RGB"), dtype=int)
+    new_pixels = np.asarray(Image.open(new).convert("RGB"), dtype=int)
+    assert legacy_pixels.shape == new_pixels.shape
+    diff = np.abs(legacy_pixels - new_pixels).max(axis=2)
+    assert (diff > 64).mean() < 0.01
+
+
+def test_compute_layout_keeps_rows_inside_figure():
+    for num_rows in (1, 3, 20, 80):
+        layout = compute_layout(num_rows, num_rows * FIGURE_HEIGHT_PER_PLOT)
+        assert len(layout.row_bottoms) == num_rows
+        assert layout.row_height > 0
+        assert min(layout.row_bottoms) > 0
+        assert max(layout.row_bottoms) + layout.row_height < 1
+        assert layout.row_bottoms == sorted(layout.row_bottoms, reverse=True)
+
+
+def test_compute_layout_makes_room_for_long_texts():
+    short = compute_layout(20, 10, ReportTexts(name_width=1.5, value_width=0.3, unit_width=1.1))
+    long_name = compute_layout(20, 10, ReportTexts(name_width=3.5, value_width=0.3, unit_width=1.1))
+    assert long_name.value_x - long_name.name_x > 0.35 > short.value_x - short.name_x
+    assert long_name.bar_x0 > short.bar_x0 and long_name.bar_x1 == short.bar_x1
+
+    # Rows are spaced by the padding alone when no reference values are printed below them.
+    unlabelled = compute_layout(20, 10, ReportTexts(labelled_rows=(False,) * 20))
+    assert unlabelled.row_height > short.row_height
+    assert unlabelled.row_bottoms[-1] < short.row_bottoms[-1]
+
+
+def test_scale_limits_cover_reference_and_value():
+    assert scale_limits(5.0, 4.5, 9.0) == pytest.approx((3.6, 9.9))
+    scale_min, scale_max = scale_limits(1.0, 1.0, 1.0)
+    assert scale_min < 1.0 < scale_max
+
+
+def test_plot_trends_writes_one_chart_per_analyte():
+    series = {
+        ("Молочная кислота", "ммоль/моль креат."): [
+            TrendPoint("2024-01-10", 9.5, 4.5, 9.0),
+            TrendPoint("2024-03-15", 5.1, 4.5, 9.0),
+        ],
+        ("Лимонная кислота", ""): [
+            TrendPoint("2024-01-10", 120.0, None, None),
+            TrendPoint("2024-03-15", 110.0, None, None),
+        ],
+        ("Янтарная кислота", ""): [TrendPoint("2024-01-10", 1.0, 0.0, 2.0), TrendPoint("2024-03-15", 1.5, 0.0, 2.0)],
+    }
+    png, pdf = io.BytesIO(), io.BytesIO()
+    timings = {}
+
+    plot_trends(series, save_path_png=png, save_path_pdf=pdf, timings=timings)
+
+    single = io.BytesIO()
+    plot_trends(dict(list(series.items())[:1]), save_path_png=single)
+    # Three analytes take two rows of charts, one analyte a single row.
+    assert Image.open(png).height > Image.open(single).height
+    assert pdf.getvalue().startswith(b"%PDF")
+    assert "savefig_png" in timings
+
+
+def test_is_out_of_range():
+    assert is_out_of_range(TrendPoint("2024-01-10", 9.5, 4.5, 9.0))
+    assert is_out_of_range(TrendPoint("2024-01-10", 4.0, 4.5, 9.0))
+    assert not is_out_of_range(TrendPoint("2024-01-10", 5.0, 4.5, 9.0))
+    assert not is_out_of_range(TrendPoint("2024-01-10", 5.0, None, None))
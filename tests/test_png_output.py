@@ -0,0 +1,57 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pdf_processing import ResultRow
+from pipeline import render_report
+from plotting import plot_scales
+from png_output import PNG_PROFILES, PngProfile, encode_png, get_png_profile, profile_dpi
+from raster import plot_scales_raster
+
+ROWS = [ResultRow(f"Молочная кислота {i}", 5.116 + i, 4.5, 9.0, "ммоль/моль креат.") for i in range(12)]
+
+
+def test_palette_png_is_smaller_and_close_to_full_color():
+    full_color, palette = io.BytesIO(), io.BytesIO()
+    plot_scales(ROWS, "Органические кислоты в моче", full_color, png_profile=PNG_PROFILES["print"]._replace(dpi=100))
+    timings = {}
+    plot_scales(ROWS, "Органические кислоты в моче", palette, timings=timings)
+
+    assert Image.open(palette).mode == "P"
+    assert len(palette.getvalue()) < len(full_color.getvalue()) / 2
+    assert 0 < timings["encode_png"] < timings["savefig_png"]
+    reference = np.asarray(Image.open(full_color).convert("RGB"), dtype=int)
+    quantized = np.asarray(Image.open(palette).convert("RGB"), dtype=int)
+    assert reference.shape == quantized.shape
+    assert np.abs(reference - quantized).max() <= 32
+
+
+def test_profiles_set_resolution_within_the_size_cap():
+    assert profile_dpi(PngProfile(dpi=100, max_side=1000, colors=0, compress_level=6), 10, 5) == 100
+    assert profile_dpi(PngProfile(dpi=100, max_side=1000, colors=0, compress_level=6), 10, 40) == 25
+    assert profile_dpi(PngProfile(dpi=100, max_side=0, colors=0, compress_level=6), 10, 400) == 100
+
+    sizes = {}
+    for name in ("preview", "standard"):
+        matplotlib_png, raster_png = io.BytesIO(), io.BytesIO()
+        plot_scales(ROWS, "Анализ", matplotlib_png, png_profile=PNG_PROFILES[name])
+        plot_scales_raster(ROWS, "Анализ", raster_png, png_profile=PNG_PROFILES[name])
+        sizes[name] = Image.open(matplotlib_png).size
+        assert Image.open(raster_png).size == sizes[name]
+    assert sizes["preview"] == (720, 432)
+    assert sizes["standard"] == (1000, 600)
+
+
+def test_encode_png_writes_files_and_rejects_unknown_profiles(tmp_path):
+    path = tmp_path / "chart.png"
+    encode_png(Image.new("RGBA", (40, 30), "red"), str(path), get_png_profile("preview"), 72)
+
+    with Image.open(path) as image:
+        assert image.size == (40, 30) and image.mode == "P"
+        assert round(image.info["dpi"][0]) == 72
+    with pytest.raises(ValueError):
+        get_png_profile("huge")
+    with pytest.raises(ValueError):
+        render_report(ROWS, "Анализ", ["png"], png_profile="huge")
@@ -0,0 +1,98 @@
+import pytest
+
+from benchmarks.parser_throughput import load_pages
+from benchmarks.synthetic_report import AMINO_ACIDS, ORGANIC_ACIDS, build_report_pdf, synthetic_rows
+from pdf_processing import (
+    REPORT_REGIONS,
+    TEXT_BACKENDS,
+    extract_data_from_all_pages,
+    extract_page_bands,
+    open_pdf,
+    parse_line,
+)
+from profiles import (
+    PROFILES,
+    detect_profile,
+    extract_report,
+    get_profile,
+    parse_amino_acid_line,
+    parse_organic_acid_line,
+)
+
+corpus_lines = [line for page in load_pages() for line in page.split("\n")]
+tricky_lines = [
+    "Фенилаланин; тирозин 1.2000 ммоль/моль креат. <2.0000",
+    "Фумаровая кислота 0.00 ммоль/моль креат. не обнаружено",
+    "Биоматериал: кровь 3.00 мкмоль/л 1.00 - 2.00",
+    "Биоматериал кровь 3.00 мкмоль/л 1.00 - 2.00",
+    "Биоматериал моча 1.2000 ммоль/моль креат. 0.50 - 2.00",
+    "Биоматериал моча 1.2000 ммоль/моль креат. <2.0000",
+    "Глицин 1.00 мкмоль/л 1 - 2 не обнаружено",
+    "Аланин 356.12 мкмоль/л200.00 - 480.00",
+    "Креатинин 7.4000 ммоль/л Референсные значения не определены",
+    "Исследование Результат Единицы Референсные значения",
+]
+
+
+@pytest.mark.parametrize("parse", [parse_organic_acid_line, parse_amino_acid_line])
+def test_panel_parsers_match_generic_parser(parse):
+    synthetic_lines = [" ".join(text for text in row if text) for row in synthetic_rows(200)]
+    for line in corpus_lines + synthetic_lines + tricky_lines:
+        assert parse(line) == parse_line(line), line
+
+
+@pytest.mark.parametrize(
+    "analysis_name, key",
+    [(ORGANIC_ACIDS, "helix_organic_acids"), (AMINO_ACIDS, "helix_amino_acids"), ("Витамин D", "helix")],
+)
+def test_detect_profile(analysis_name, key):
+    content = build_report_pdf(synthetic_rows(5), analysis_name)
+    with open_pdf(content, "pdfium") as pdf:
+        assert detect_profile(pdf.pages[0].extract_text()).key == key
+
+
+def test_detect_profile_unknown_lab():
+    assert detect_profile("ООО «Инвитро» (врач): Органические кислоты Метод: ВЭЖХ") is None
+
+
+def test_profile_keys_are_unique():
+    assert len({profile.key for profile in PROFILES}) == len(PROFILES)
+    assert get_profile("helix").lab == "Helix"
+    assert get_profile("") is None
+
+
+@pytest.mark.parametrize("analysis_name", [ORGANIC_ACIDS, AMINO_ACIDS])
+def test_extract_report_matches_generic_extraction(analysis_name):
+    content = build_report_pdf(synthetic_rows(80), analysis_name, appendix_pages=1)
+    with open_pdf(content, "pdfium") as pdf:
+        data, name, profile, report_date = extract_report(pdf)
+        generic_data, generic_name = extract_data_from_all_pages(pdf, "helix")
+    assert profile.panel in analysis_name
+    assert (data, name) == (generic_data, generic_name)
+    assert report_date == "2024-03-15"
+    assert len(data) == 80
+
+
+def test_extract_report_crops_the_first_page(caplog):
+    content = build_report_pdf(synthetic_rows(10), ORGANIC_ACIDS)
+    with open_pdf(content, "pdfium") as pdf:
+        extract_data_from_all_pages(pdf, "helix")
+        cropped = caplog.messages
+        caplog.clear()
+        extract_report(pdf)
+    assert caplog.messages == cropped
+    assert not any("Пациент" in message for message in caplog.messages)
+
+
+@pytest.mark.parametrize("backend", TEXT_BACKENDS)
+def test_extract_report_reads_the_first_page_once(backend, mocker):
+    content = build_report_pdf(synthetic_rows(10), ORGANIC_ACIDS)
+    with open_pdf(content, backend) as pdf:
+        first_page = pdf.pages[0]
+        whole_page_text = first_page.extract_text()
+        crop = mocker.spy(first_page, "crop")
+        mocker.patch.object(first_page, "extract_text", side_effect=AssertionError("whole page extracted"))
+        rows, _, profile, report_date = extract_report(pdf)
+        assert crop.call_count == 3
+        assert extract_page_bands(first_page, REPORT_REGIONS["helix"]).text == whole_page_text
+    assert profile.key == "helix_organic_acids" and report_date and len(rows) == 10
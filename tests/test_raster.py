@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmarks.startup import measure_import
+from layout import compute_layout, measure_texts
+from pdf_processing import ResultRow
+from plotting import plot_scales
+from plotting import text_width as matplotlib_text_width
+from raster import gradient_bar, plot_scales_raster, render_text, text_width
+
+
+def report_rows(count):
+    rows = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            rows.append(ResultRow(f"Молочная кислота {i} (лактат, E270)", 5.116 + i, 4.5, 9.0, "ммоль/моль креат."))
+        elif kind == 1:
+            rows.append(ResultRow(f"Кислота {i}", 1.2, None, None, "мкмоль/л"))
+        elif kind == 2:
+            rows.append(ResultRow(f"Не найдено {i}", 0.0, 0.0, 0.0, "ммоль/л"))
+        else:
+            rows.append(ResultRow(f"Соотношение {i}", 0.3, 0.0, 1.38, None))
+    return rows
+
+
+def test_raster_matches_matplotlib_renderer():
+    for count in (1, 3, 20):
+        rows = report_rows(count)
+        reference, raster = io.BytesIO(), io.BytesIO()
+        plot_scales(rows, "Органические кислоты в моче", reference)
+        plot_scales_raster(rows, "Органические кислоты в моче", raster)
+
+        reference_pixels = np.asarray(Image.open(reference).convert("RGB"), dtype=int)
+        raster_pixels = np.asarray(Image.open(raster).convert("RGB"), dtype=int)
+        assert reference_pixels.shape == raster_pixels.shape
+        diff = np.abs(reference_pixels - raster_pixels).max(axis=2)
+        # Only glyph edges differ, since Pillow hints fonts and matplotlib does not.
+        assert (diff > 64).mean() < 0.035
+        assert np.abs(reference_pixels - raster_pixels).mean() < 5
+
+
+def test_raster_lays_out_long_names_like_matplotlib():
+    ratio = "Гомованилиновая кислота/Ванилилминдальная кислота"
+    rows = [row._replace(name=f"{ratio} {i}") for i, row in enumerate(report_rows(7))]
+    layout = compute_layout(len(rows), 3.5, measure_texts(rows, matplotlib_text_width))
+    raster_layout = compute_layout(len(rows), 3.5, measure_texts(rows, text_width))
+    assert raster_layout[:5] == pytest.approx(layout[:5], abs=1e-3)
+
+    reference, raster = io.BytesIO(), io.BytesIO()
+    plot_scales(rows, "Анализ", reference)
+    plot_scales_raster(rows, "Анализ", raster)
+    reference_pixels = np.asarray(Image.open(reference).convert("RGB"), dtype=int)
+    raster_pixels = np.asarray(Image.open(raster).convert("RGB"), dtype=int)
+    # Past the names, which are mostly glyph edges here, values, units and bars line up.
+    right_of_names = round(layout.value_x * reference_pixels.shape[1])
+    diff = np.abs(reference_pixels - raster_pixels)[:, right_of_names:].max(axis=2)
+    assert (diff > 64).mean() < 0.035
+
+
+def test_text_and_gradient_are_rendered_once():
+    render_text.cache_clear()
+    gradient_bar.cache_clear()
+    rows = report_rows(8)
+
+    plot_scales_raster(rows, "Анализ", io.BytesIO())
+    plot_scales_raster(rows, "Анализ", io.BytesIO())
+
+    assert gradient_bar.cache_info().misses == 1
+    assert render_text.cache_info().hits >= render_text.cache_info().misses
+
+
+def test_raster_does_not_load_matplotlib():
+    _, loaded = measure_import("raster")
+    assert "matplotlib" not in loaded
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from metrics import Metrics
+from scheduler import JobScheduler, QueueFull, UserLimitReached
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_scheduler_caps_concurrency_and_reports_positions():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=1, max_jobs_per_user=5, max_queue_length=5)
+        gate = asyncio.Event()
+        positions = {"b": [], "c": []}
+        order = []
+
+        async def job(name):
+            order.append(name)
+            await gate.wait()
+            return name
+
+        async def report(name, position):
+            positions[name].append(position)
+
+        tasks = [asyncio.create_task(scheduler.run("a", lambda: job("a")))]
+        await settle()
+        for name in ("b", "c"):
+            run = scheduler.run(name, lambda name=name: job(name), lambda p, name=name: report(name, p))
+            tasks.append(asyncio.create_task(run))
+            await settle()
+        assert (scheduler.running, scheduler.waiting) == (1, 2)
+        gate.set()
+        assert await asyncio.gather(*tasks) == ["a", "b", "c"]
+        await settle()
+        assert (scheduler.running, scheduler.waiting) == (0, 0)
+        return order, positions
+
+    order, positions = asyncio.run(scenario())
+    assert order == ["a", "b", "c"]
+    assert positions == {"b": [1, 0], "c": [2, 1, 0]}
+
+
+def test_scheduler_rejects_over_limits():
+    async def scenario():
+        metrics = Metrics()
+        scheduler = JobScheduler(max_concurrent=1, max_jobs_per_user=2, max_queue_length=2, metrics=metrics)
+        gate = asyncio.Event()
+        tasks = [asyncio.create_task(scheduler.run(user, gate.wait)) for user in ("a", "a", "b")]
+        await settle()
+        with pytest.raises(UserLimitReached):
+            await scheduler.run("a", gate.wait)
+        with pytest.raises(QueueFull):
+            await scheduler.run("c", gate.wait)
+        gate.set()
+        await asyncio.gather(*tasks)
+        return metrics
+
+    metrics = asyncio.run(scenario())
+    assert metrics.counter("jobs_rejected", reason="user_limit") == 1
+    assert metrics.counter("jobs_rejected", reason="queue_full") == 1
+    assert metrics.histogram("queue_wait").count == 2
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=1)
+        gate = asyncio.Event()
+        positions = []
+
+        async def report(position):
+            positions.append(position)
+
+        first = asyncio.create_task(scheduler.run("a", gate.wait))
+        second = asyncio.create_task(scheduler.run("b", gate.wait))
+        third = asyncio.create_task(scheduler.run("c", gate.wait, report))
+        await settle()
+        second.cancel()
+        await settle()
+        assert scheduler.waiting == 1
+        assert scheduler.jobs_of("b") == 0
+        gate.set()
+        await asyncio.gather(first, third)
+        return positions, scheduler.running
+
+    positions, running = asyncio.run(scenario())
+    assert positions == [2, 1, 0]
+    assert running == 0
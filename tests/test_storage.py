@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+from storage import ArtifactStore, run_sweeper, write_atomically
+
+
+def test_put_and_get(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+
+    path = store.put("alice", "2024-01-01_12-00-00", "output", "png", b"png")
+
+    assert path == os.path.join(str(tmp_path), "alice", "2024-01-01_12-00-00_output.png")
+    assert store.get("alice", "2024-01-01_12-00-00", "output", "png") == b"png"
+    assert store.get("alice", "2024-01-01_12-00-00", "output", "pdf") is None
+    assert store.get("bob", "2024-01-01_12-00-00", "output", "png") is None
+    assert store.usage("alice") == 3
+
+
+def test_index_survives_reopening(tmp_path):
+    ArtifactStore(str(tmp_path)).put("alice", "job", "upload", "pdf", b"%PDF")
+    assert ArtifactStore(str(tmp_path)).get("alice", "job", "upload", "pdf") == b"%PDF"
+
+
+def test_write_atomically_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / "out" / "chart.png")
+    write_atomically(path, b"first")
+    write_atomically(path, b"second")
+    assert os.listdir(tmp_path / "out") == ["chart.png"]
+    with open(path, "rb") as f:
+        assert f.read() == b"second"
+
+
+def test_user_quota_removes_oldest_files_of_that_user(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_user_bytes=10)
+    store.put("alice", "job1", "upload", "pdf", b"x" * 4, now=1)
+    store.put("bob", "job1", "upload", "pdf", b"x" * 4, now=2)
+    store.put("alice", "job2", "upload", "pdf", b"x" * 4, now=3)
+
+    store.put("alice", "job3", "upload", "pdf", b"x" * 4, now=4)
+
+    assert store.get("alice", "job1", "upload", "pdf") is None
+    assert not os.path.exists(store.path_for("alice", "job1", "upload", "pdf"))
+    assert store.get("alice", "job2", "upload", "pdf") is not None
+    assert store.get("bob", "job1", "upload", "pdf") is not None
+
+
+def test_quota_keeps_the_job_being_written(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_user_bytes=10)
+    store.put("alice", "job1", "upload", "pdf", b"x" * 8, now=1)
+    store.put("alice", "job1", "output", "png", b"x" * 8, now=2)
+    assert store.usage("alice") == 16
+
+
+def test_global_quota(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_total_bytes=10)
+    store.put("alice", "job1", "upload", "pdf", b"x" * 4, now=1)
+    store.put("bob", "job1", "upload", "pdf", b"x" * 4, now=2)
+    store.put("carol", "job1", "upload", "pdf", b"x" * 4, now=3)
+    assert store.get("alice", "job1", "upload", "pdf") is None
+    assert store.usage() == 8
+
+
+def test_sweep_removes_expired_files(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl=100)
+    store.put("alice", "old", "upload", "pdf", b"old", now=1000)
+    store.put("alice", "new", "upload", "pdf", b"new", now=1950)
+
+    assert store.sweep(now=2000) == 1
+
+    assert store.get("alice", "old", "upload", "pdf") is None
+    assert not os.path.exists(store.path_for("alice", "old", "upload", "pdf"))
+    assert store.get("alice", "new", "upload", "pdf") == b"new"
+
+
+def test_files_from_before_the_index_are_adopted(tmp_path):
+    job_dir = tmp_path / "alice" / "output" / "2024-01-01_12-00-00"
+    job_dir.mkdir(parents=True)
+    (job_dir / "2024-01-01_12-00-00.png").write_bytes(b"png")
+
+    store = ArtifactStore(str(tmp_path))
+
+    assert store.get("alice", "2024-01-01_12-00-00", "output", "png") == b"png"
+    assert store.usage() == 3
+
+
+def test_run_sweeper_sweeps_until_cancelled(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl=0)
+    store.put("alice", "job", "upload", "pdf", b"%PDF", now=1)
+
+    async def main():
+        sweeper = asyncio.create_task(run_sweeper(store, interval=0.01))
+        await asyncio.sleep(0.1)
+        sweeper.cancel()
+
+    asyncio.run(main())
+    assert store.usage() == 0
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import socket
+from urllib.parse import parse_qs
+
+import httpx
+from telegram.ext import Application, CommandHandler
+
+from http_server import HTTPServer, Response
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+TOKEN = "123:TEST"
+SECRET = "s3cret"
+
+
+class FakeTelegram:
+    """Answers the Bot API calls the bot makes and posts updates to its webhook like Telegram does."""
+
+    def __init__(self):
+        self.webhook_url = None
+        self.secret_token = None
+        self.sent = []
+        methods = {
+            "getMe": self.get_me,
+            "setWebhook": self.set_webhook,
+            "sendMessage": self.send_message,
+        }
+        self.server = HTTPServer({("POST", f"/bot{TOKEN}/{name}"): handler for name, handler in methods.items()})
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.port}/bot"
+
+    @staticmethod
+    def ok(result):
+        return Response(body=json.dumps({"ok": True, "result": result}).encode(), content_type="application/json")
+
+    @staticmethod
+    def params(request):
+        return {name: values[0] for name, values in parse_qs(request.body.decode()).items()}
+
+    async def get_me(self, request):
+        return self.ok({"id": 123, "is_bot": True, "first_name": "Test", "username": "test_bot"})
+
+    async def set_webhook(self, request):
+        params = self.params(request)
+        self.webhook_url = params["url"]
+        self.secret_token = params.get("secret_token")
+        return self.ok(True)
+
+    async def send_message(self, request):
+        params = self.params(request)
+        self.sent.append(params["text"])
+        chat = {"id": int(params["chat_id"]), "type": "private"}
+        return self.ok({"message_id": len(self.sent), "date": 0, "chat": chat, "text": params["text"]})
+
+    async def post_update(self, update_id, text, secret_token=None):
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": 42, "type": "private"},
+                "from": {"id": 42, "is_bot": False, "first_name": "User"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text[0] == "/" else [],
+            },
+        }
+        headers = {SECRET_TOKEN_HEADER: secret_token or self.secret_token}
+        async with httpx.AsyncClient() as client:
+            return await client.post(self.webhook_url, json=update, headers=headers)
+
+
+async def reply_slowly(update, context):
+    await asyncio.sleep(0.2)
+    await update.message.reply_text("pong")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_with_bot(scenario):
+    async def main():
+        telegram = FakeTelegram()
+        await telegram.server.start()
+        application = Application.builder().token(TOKEN).base_url(telegram.base_url).concurrent_updates(True).build()
+        application.add_handler(CommandHandler("ping", reply_slowly))
+        port = free_port()
+        webhook = WebhookServer(application, "127.0.0.1", port, "/telegram", SECRET)
+        await application.initialize()
+        await application.start()
+        try:
+            await webhook.start(f"http://127.0.0.1:{port}/telegram")
+            return await scenario(telegram, application, webhook)
+        finally:
+            await webhook.stop(drain_timeout=1)
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+            await telegram.server.stop()
+
+    return asyncio.run(main())
+
+
+def test_webhook_is_registered_with_the_secret_token():
+    async def scenario(telegram, application, webhook):
+        return telegram.webhook_url, telegram.secret_token
+
+    url, secret_token = run_with_bot(scenario)
+    assert url.endswith("/telegram")
+    assert secret_token == SECRET
+
+
+def test_posted_update_reaches_the_handlers():
+    async def scenario(telegram, application, webhook):
+        response = await telegram.post_update(1, "/ping")
+        for _ in range(50):
+            if telegram.sent:
+                break
+            await asyncio.sleep(0.05)
+        return response.status_code, telegram.sent
+
+    assert run_with_bot(scenario) == (200, ["pong"])
+
+
+def test_wrong_secret_token_is_rejected():
+    async def scenario(telegram, application, webhook):
+        response = await telegram.post_update(1, "/ping", secret_token="wrong")
+        await asyncio.sleep(0.3)
+        return response.status_code, telegram.sent
+
+    assert run_with_bot(scenario) == (403, [])
+
+
+def test_invalid_update_is_rejected():
+    async def scenario(telegram, application, webhook):
+        async with httpx.AsyncClient() as client:
+            response = await client.post(telegram.webhook_url, content=b"{", headers={SECRET_TOKEN_HEADER: SECRET})
+        return response.status_code
+
+    assert run_with_bot(scenario) == 400
+
+
+def test_stop_drains_received_updates_and_refuses_new_ones():
+    async def scenario(telegram, application, webhook):
+        response = await telegram.post_update(1, "/ping")
+        await webhook.stop()
+        await application.stop()
+        try:
+            await telegram.post_update(2, "/ping")
+            refused = False
+        except httpx.ConnectError:
+            refused = True
+        return response.status_code, telegram.sent, refused
+
+    assert run_with_bot(scenario) == (200, ["pong"], True)
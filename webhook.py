@@ -0,0 +1,81 @@
+import hmac
+import json
+import logging
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from http_server import HTTPError, HTTPServer, Request, Response
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+DEFAULT_WEBHOOK_LISTEN = "0.0.0.0"
+DEFAULT_WEBHOOK_PORT = 8443
+DEFAULT_WEBHOOK_PATH = "/telegram"
+DEFAULT_DRAIN_TIMEOUT = 30.0
+# Telegram sends updates of at most a few kilobytes; files are fetched separately.
+MAX_UPDATE_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    """Receives updates from Telegram over HTTP instead of long polling.
+
+    Telegram POSTs every update to ``path``; with a ``secret_token`` each
+    request must carry it in the ``X-Telegram-Bot-Api-Secret-Token`` header.
+    Updates go to the application's update queue, the same way the updater
+    delivers them when polling, so handlers do not know the difference.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str = DEFAULT_WEBHOOK_LISTEN,
+        port: int = DEFAULT_WEBHOOK_PORT,
+        path: str = DEFAULT_WEBHOOK_PATH,
+        secret_token: Optional[str] = None,
+    ) -> None:
+        self.application = application
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret_token = secret_token
+        self.server = HTTPServer({("POST", self.path): self.handle_update}, listen, port, MAX_UPDATE_SIZE)
+
+    @property
+    def port(self) -> int:
+        return self.server.port
+
+    async def start(self, webhook_url: Optional[str] = None) -> None:
+        """Start listening and, if ``webhook_url`` is given, point Telegram at it.
+
+        Without a URL the webhook is expected to be registered elsewhere, e.g.
+        once for all instances behind a load balancer.
+        """
+        if not self.secret_token:
+            logging.warning("WEBHOOK_SECRET_TOKEN is not set, anyone who knows the URL can post updates")
+        await self.server.start()
+        if webhook_url:
+            await self.application.bot.set_webhook(
+                url=webhook_url, secret_token=self.secret_token, allowed_updates=Update.ALL_TYPES
+            )
+            logging.info(f"Webhook registered at {webhook_url}")
+
+    async def stop(self, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> None:
+        """Stop accepting updates and let requests that are being read finish.
+
+        Updates already queued are processed by ``Application.stop``. Telegram
+        retries the ones it could not deliver, on this or another instance.
+        """
+        await self.server.stop(drain_timeout)
+
+    async def handle_update(self, request: Request) -> Response:
+        if self.secret_token is not None:
+            received = request.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                logging.warning("Webhook request with a wrong secret token rejected")
+                raise HTTPError(403)
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            logging.warning("Webhook request with an invalid update rejected", exc_info=True)
+            raise HTTPError(400, "Invalid update")
+        await self.application.update_queue.put(update)
+        return Response()